@@ -0,0 +1,189 @@
+import itertools
+import logging
+import os
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from bitbank import config
+from bitbank.const import PAIR, INTERVAL, CHANGERATE, TRADERULE
+from bitbank.market import MarketData, ReplayTransport
+from bitbank.orderbook import OrderBook, SIDE
+from bitbank.paper import PaperExchange, SimClock
+from bitbank.record import Record, CSV
+from bitbank.tick import TABLE, load_ticks
+from bitbank.trade import Trade
+from cmn.log import get_logger
+from cmn.sweep import run_sweep
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+# バックテスト中は売買ごとのログを出さない（件数が多く、ログの出力が処理時間の大半になるため）
+QUIET_LOGGERS = ['bitbank.trade', 'bitbank.record', 'bitbank.tape']
+
+
+class BacktestCell(NamedTuple):
+    rule: TRADERULE
+    limit: float
+    size: int
+    change_rate: float
+
+
+SUMMARY_COLUMNS = ['rule', 'limit', 'size', 'change_rate', 'tick_count', 'trade_count', 'win_count', 'lose_count',
+                   'win_rate', 'change_rate_sum', 'pl_sum', 'final_assets', 'max_drawdown', 'elapsed']
+
+
+class Backtest:
+    """
+    記録した板・約定を仮想時計で再生し、Trade の購入・売却判定と模擬取引所で売買して取引履歴を書く
+    Trade.trade_steps を、板を1件反映するたびに次の更新待ちまで進める
+    """
+
+    def __init__(self, pair: PAIR, rule: TRADERULE, ticks: dict, file_name: str, limit: float = 0.0005,
+                 size: int = 3, change_rate: float = CHANGERATE.MIN.value, wait: int = INTERVAL.LONG.value * 3):
+        """
+        :param ticks: bitbank.tick.load_ticks の戻り値
+        :param file_name: 取引履歴のファイル名（既にあれば作り直す）
+        :param wait: 指値注文の約定を待つ秒数（仮想時計）
+        """
+        self.ticks = ticks
+        self.clock = SimClock()
+        self.market = MarketData(pair=pair, transport=ReplayTransport())
+        self.exchange = PaperExchange(market=self.market, clock=self.clock)
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        self.trade = Trade(pair=pair, rule=rule, market=self.market, exchange=self.exchange,
+                           record=Record(file_name=file_name, fsync=False), limit=limit, size=size,
+                           change_rate=change_rate, wait=wait)
+        self.steps = None  # Trade の売買の流れ（最初の板を反映してから始める）
+
+    def run(self) -> dict:
+        depth = self.ticks[TABLE.DEPTH]
+        transactions = self.ticks[TABLE.TRANSACTIONS]
+        depth_times = np.asarray(depth['time'])
+        # 板ごとに、その時刻までに成立した約定の範囲
+        transaction_ends = np.searchsorted(np.asarray(transactions['executed_at']), depth_times, side='right')
+        transaction_columns = [np.asarray(transactions[col]).tolist()
+                               for col in ('transaction_id', 'executed_at', 'price', 'amount')]
+        # 全ての板の累積和・件数をまとめて計算しておき、板ごとには切り出すだけにする
+        sides = {}
+        for side, key in ((SIDE.ASK, 'ask'), (SIDE.BID, 'bid')):
+            prices, volumes = np.asarray(depth[f'{key}_price']), np.asarray(depth[f'{key}_volume'])
+            sides[side] = (prices, volumes, np.cumsum(volumes, axis=1), np.cumsum(prices * volumes, axis=1),
+                           np.count_nonzero(volumes, axis=1).tolist())
+
+        levels = {name: logging.getLogger(name).level for name in QUIET_LOGGERS}
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        started_at = time.perf_counter()
+        try:
+            start = 0
+            for i, end in enumerate(transaction_ends.tolist()):
+                self.clock.set(int(depth_times[i]))
+                if end > start:
+                    self.market.feed_transactions([
+                        {'transaction_id': transaction_id, 'executed_at': executed_at, 'price': price,
+                         'amount': amount}
+                        for transaction_id, executed_at, price, amount in zip(*(col[start:end] for col in transaction_columns))])
+                    start = end
+                book = {}, {}, {}, {}
+                for side, (prices, volumes, cum_volumes, cum_amounts, sizes) in sides.items():
+                    size = sizes[i]
+                    for book_columns, array in zip(book, (prices, volumes, cum_volumes, cum_amounts)):
+                        book_columns[side] = array[i, :size]
+                self.market.feed_book(OrderBook.from_cumsum(*book))
+                self.step()
+        finally:
+            for name, level in levels.items():
+                logging.getLogger(name).setLevel(level)
+        return self.summarize(tick_count=len(depth_times), elapsed=time.perf_counter() - started_at)
+
+    def step(self):
+        # 板・約定の更新があったものとして、次の更新待ちまで進める
+        if self.steps is None:
+            self.steps = self.trade.trade_steps()
+            next(self.steps)
+        else:
+            self.steps.send(True)
+
+    def summarize(self, tick_count: int, elapsed: float) -> dict:
+        ledger = self.trade.record.csv.ledger
+        stats = self.trade.record.get_stats(size=None)
+        assets = ledger.column(CSV.COlUMN.ASSETS).astype(np.float64)
+        init_assets = int(config.SIMUL_INIT_ASSETS)
+        peaks = np.maximum.accumulate(np.concatenate([[init_assets], assets]))
+        drawdowns = 1 - np.concatenate([[init_assets], assets]) / peaks
+        decided_count = stats.win_count + stats.lose_count
+        return {
+            'tick_count': tick_count,
+            'trade_count': stats.count,
+            'win_count': stats.win_count,
+            'lose_count': stats.lose_count,
+            'win_rate': stats.win_count / decided_count if decided_count else 0.0,
+            'change_rate_sum': stats.change_rate_sum,
+            'pl_sum': int(ledger.column(CSV.COlUMN.PL).sum()),
+            'final_assets': int(assets[-1]) if len(assets) else int(init_assets),
+            'max_drawdown': float(drawdowns.max()),
+            'elapsed': elapsed,
+        }
+
+
+def backtest(pair: PAIR, rule: TRADERULE, days: list, root: str = 'ticks', file_name: str = None,
+             **params) -> dict:
+    """
+    記録した板・約定で1つの取引ルールを試して集計を表示する
+    :param params: Backtest に渡す残りの引数（limit, size, change_rate, wait）
+    """
+    ticks = load_ticks(pair=pair, days=days, root=root)
+    file_name = file_name or f'【{rule.value}】{pair.value}（backtest）{config.RECORD_EXT}'
+    summary = Backtest(pair=pair, rule=rule, ticks=ticks, file_name=file_name, **params).run()
+    logger.info(f'【{rule.value}】 取引 {summary["trade_count"]}回  勝率 {summary["win_rate"]:.4f}  '
+                f'増減率合計 {summary["change_rate_sum"]:.6f}  資産 {summary["final_assets"]}  '
+                f'最大下落率 {summary["max_drawdown"]:.4f}  '
+                f'{summary["tick_count"] / summary["elapsed"]:.0f}板/秒')
+    return summary
+
+
+def make_grid(rules=tuple(TRADERULE), limits=(0.0005,), sizes=(3,), change_rates=(CHANGERATE.MIN.value,)) -> list:
+    """
+    取引ルール×価格差の割合×板の件数×増減率の全組み合わせを作る
+    """
+    return [BacktestCell(*cell) for cell in itertools.product(rules, limits, sizes, change_rates)]
+
+
+def _backtest_cell(args):
+    cell, pair, days, root, dir_name, wait = args
+    ticks = load_ticks(pair=pair, days=days, root=root)
+    file_name = os.path.join(dir_name, f'{cell.rule.value}_{cell.limit}_{cell.size}_{cell.change_rate}.csv')
+    summary = Backtest(pair=pair, rule=cell.rule, ticks=ticks, file_name=file_name, limit=cell.limit, size=cell.size,
+                       change_rate=cell.change_rate, wait=wait).run()
+    return [cell.rule.value, cell.limit, cell.size, cell.change_rate] + [summary[col] for col in SUMMARY_COLUMNS[4:]]
+
+
+def sweep(pair: PAIR, days: list, grid: list, root: str = 'ticks', dir_name: str = 'backtest',
+          file_name: str = 'backtest.csv', wait: int = INTERVAL.LONG.value * 3,
+          processes: Optional[int] = None) -> list:
+    """
+    パラメータの組み合わせごとのバックテストをプロセスプールで並列実行して1つのcsvにまとめる（cmn.sweep.run_sweep）
+    （記録はワーカーごとに np.memmap で読み込むので、ページキャッシュを共有してコピーしない）
+    :param grid: BacktestCell のリスト
+    :param dir_name: 組み合わせごとの取引履歴の出力先
+    :param file_name: 集計csvファイル名
+    """
+    os.makedirs(dir_name, exist_ok=True)
+    tasks = [(cell, pair, days, root, dir_name, wait) for cell in grid]
+    return run_sweep(worker=_backtest_cell, tasks=tasks, columns=SUMMARY_COLUMNS, file_name=file_name,
+                     processes=processes)
+
+
+def main():
+    # 記録済みの全日で2つの取引ルールを比較
+    pair = PAIR.BTC_JPY
+    days = sorted(os.listdir(os.path.join('ticks', pair.value)))
+    sweep(pair=pair, days=days, grid=make_grid(limits=(0.0003, 0.0005, 0.001), sizes=(1, 3, 5),
+                                               change_rates=(0.0002, 0.0005, 0.001)))
+
+
+if __name__ == '__main__':
+    main()
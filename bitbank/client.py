@@ -0,0 +1,367 @@
+import http.client
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from bitbank import config, metrics
+from bitbank.const import PAIR
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+
+class TokenBucket:
+    """
+    1秒あたり rate 回、最大 burst 回まで連続で通す流量制限（全スレッドで共有）
+    """
+
+    def __init__(self, rate: float = 10, burst: int = 10):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        1回分の枠を取得する（枠がなければ空くまで待つ）
+        :return: 待った秒数
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.burst)
+            self.updated_at = now
+            # 枠を先に確保してから待つ（後から来た処理はその次の枠を待つ）
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class ConnectionPool:
+    """
+    同じホストへの接続を使い回す（keep-alive）
+    """
+
+    def __init__(self, url: str, size: int = 4, timeout: float = 10):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connections = queue.LifoQueue(maxsize=size)
+
+    def request(self, path: str):
+        """
+        :return: ステータスコード、本文
+        """
+        try:
+            connection = self.connections.get_nowait()
+            is_reused = True
+        except queue.Empty:
+            connection = self.connection_class(self.host, timeout=self.timeout)
+            is_reused = False
+        try:
+            connection.request('GET', self.base_path + path, headers={'Connection': 'keep-alive'})
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            # 使い回した接続がサーバー側で切られていた場合は、新しい接続で1度だけやり直す
+            if not is_reused:
+                raise
+            connection = self.connection_class(self.host, timeout=self.timeout)
+            connection.request('GET', self.base_path + path, headers={'Connection': 'keep-alive'})
+            response = connection.getresponse()
+            body = response.read()
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self.connections.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, body
+
+    def close(self):
+        while True:
+            try:
+                self.connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class EndpointStats:
+    """
+    エンドポイントごとの応答時間の集計（最新 size 件から分位点を求める）
+    """
+
+    def __init__(self, size: int = 1000):
+        self.count = 0
+        self.error_count = 0
+        self.cache_count = 0  # キャッシュ・相乗りで応答した回数
+        self.wait_sum = 0.0  # 流量制限で待った秒数の合計
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latencies = deque(maxlen=size)
+
+    def add(self, latency: float):
+        self.count += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latencies.append(latency)
+
+    def to_dict(self) -> dict:
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {
+            'count': self.count,
+            'error_count': self.error_count,
+            'cache_count': self.cache_count,
+            'wait_sum': self.wait_sum,
+            'mean': self.latency_sum / self.count if self.count else 0.0,
+            'p50': float(p50),
+            'p90': float(p90),
+            'p99': float(p99),
+            'max': self.latency_max,
+        }
+
+
+class Call:
+    # 実行中のリクエスト（同じリクエストを待つ処理は結果を共有する）
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PublicClient:
+    """
+    bitbank の Public API クライアント（python_bitbankcc.public と同じ戻り値）
+    接続の使い回し・流量制限・同時に来た同じリクエストの相乗り・短時間のキャッシュを行い、応答時間を集計する
+    """
+    URL = 'https://public.bitbank.cc'
+
+    def __init__(self, url: str = URL, rate: float = 10, burst: int = 10, ttl: float = 0.5, pool_size: int = 4,
+                 timeout: float = 10):
+        """
+        :param url: API のURL（動作確認ではスタブサーバーのURL）
+        :param rate: 1秒あたりの最大リクエスト数
+        :param burst: 連続で送れる最大リクエスト数
+        :param ttl: 同じリクエストの応答を使い回す秒数（0ならキャッシュしない）
+        :param pool_size: 使い回す接続の最大数
+        :param timeout: 1リクエストのタイムアウト秒数
+        """
+        self.pool = ConnectionPool(url=url, size=pool_size, timeout=timeout)
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = {}  # パス → (取得時刻, データ)
+        self.calls = {}  # パス → 実行中の Call
+        self.stats = {}  # エンドポイント → EndpointStats
+
+    def get_stats(self, endpoint: str) -> EndpointStats:
+        if endpoint not in self.stats:
+            self.stats[endpoint] = EndpointStats()
+        return self.stats[endpoint]
+
+    def get(self, path: str, endpoint: str = None, ttl: float = None):
+        """
+        :param path: API のパス（'/btc_jpy/depth' など）
+        :param endpoint: 集計上の名前（未指定ならパスの最後）
+        :param ttl: キャッシュの秒数（未指定ならクライアントの既定値）
+        :return: 応答の data
+        """
+        endpoint = endpoint or path.rsplit('/', 1)[-1]
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            stats = self.get_stats(endpoint)
+            # 新しい応答があればそれを返す
+            if path in self.cache and time.monotonic() - self.cache[path][0] < ttl:
+                stats.cache_count += 1
+                return self.cache[path][1]
+            # 同じリクエストが実行中なら結果を待つ
+            call = self.calls.get(path)
+            is_owner = call is None
+            if is_owner:
+                call = Call()
+                self.calls[path] = call
+        if not is_owner:
+            call.event.wait()
+            with self.lock:
+                stats.cache_count += 1
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self.request(path=path, stats=stats, endpoint=endpoint)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                if call.error is None and ttl:
+                    self.cache[path] = (time.monotonic(), call.result)
+                del self.calls[path]
+            call.event.set()
+        return call.result
+
+    def request(self, path: str, stats: EndpointStats, endpoint: str = None):
+        wait = self.bucket.acquire()
+        started_at = time.perf_counter()
+        try:
+            status, body = self.pool.request(path)
+            response = json.loads(body)
+        except Exception:
+            with self.lock:
+                stats.error_count += 1
+            raise
+        latency = time.perf_counter() - started_at
+        metrics.observe('bitbank_api_request_seconds', latency, endpoint=endpoint or path.rsplit('/', 1)[-1])
+        with self.lock:
+            stats.wait_sum += wait
+            stats.add(latency)
+            if status != 200 or response.get('success') != 1:
+                stats.error_count += 1
+        if status != 200 or response.get('success') != 1:
+            raise Exception(f'APIエラー: {path} {status} {response.get("data")}')
+        return response['data']
+
+    def get_ticker(self, pair: str):
+        return self.get(f'/{pair}/ticker')
+
+    def get_depth(self, pair: str):
+        return self.get(f'/{pair}/depth')
+
+    def get_transactions(self, pair: str, yyyymmdd: str = None):
+        if yyyymmdd:
+            return self.get(f'/{pair}/transactions/{yyyymmdd}', endpoint='transactions_by_date')
+        return self.get(f'/{pair}/transactions')
+
+    def get_candlestick(self, pair: str, candle_type: str, yyyy: str):
+        return self.get(f'/{pair}/candlestick/{candle_type}/{yyyy}', endpoint='candlestick')
+
+    def report(self) -> dict:
+        # エンドポイントごとの集計（秒）
+        with self.lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self.stats.items()}
+
+    def log_report(self):
+        for endpoint, stats in self.report().items():
+            logger.info(f'{endpoint}: 件数 {stats["count"]}  エラー {stats["error_count"]}  '
+                        f'キャッシュ {stats["cache_count"]}  平均 {stats["mean"] * 1000:.1f}ms  '
+                        f'p99 {stats["p99"] * 1000:.1f}ms  最大 {stats["max"] * 1000:.1f}ms')
+
+    def close(self):
+        self.pool.close()
+
+
+class StubServer:
+    """
+    Public API と同じ形式で決まった応答を返すローカルサーバー（動作確認用）
+    """
+
+    def __init__(self, responses: dict = None, delay: float = 0, port: int = 0):
+        """
+        :param responses: パス → data（関数ならリクエストのたびに呼んだ戻り値）
+        :param delay: 応答までの秒数
+        :param port: 待ち受けるポート（0なら空いているポート）
+        """
+        self.responses = responses or {}
+        self.delay = delay
+        self.request_count = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.request_count += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                data = stub.responses.get(self.path)
+                if callable(data):
+                    data = data()
+                if data is None:
+                    body = json.dumps({'success': 0, 'data': {'code': 10000}}).encode()
+                    self.send_response(404)
+                else:
+                    body = json.dumps({'success': 1, 'data': data}).encode()
+                    self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub_server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+client = None
+
+
+def get_client() -> PublicClient:
+    """
+    全ての取引・監視で1つのクライアントを共有する（流量制限を合算するため）
+    """
+    global client
+    if client is None:
+        client = PublicClient()
+    return client
+
+
+def main(pair: PAIR = PAIR.BTC_JPY, threads: int = 8, number: int = 20):
+    # スタブサーバーに複数スレッドから同時に問い合わせて、相乗り・キャッシュ・流量制限の効果を表示
+    depth = {'asks': [['5000010', '0.1']], 'bids': [['5000000', '0.1']], 'timestamp': 0}
+    stub = StubServer(responses={f'/{pair.value}/depth': depth}, delay=0.05).start()
+    stub_client = PublicClient(url=stub.url, rate=20, burst=5, ttl=0.05)
+
+    def worker():
+        for _ in range(number):
+            stub_client.get_depth(pair.value)
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started_at = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    logger.info(f'呼び出し {threads * number}回 → サーバーへのリクエスト {stub.request_count}回  '
+                f'{time.perf_counter() - started_at:.2f}秒')
+    stub_client.log_report()
+    stub_client.close()
+    stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,8 @@
 IS_DEBUG = True
 WINRATE_SAMPLE = 1000
 SIMUL_INIT_ASSETS = '10000'
+RECORD_EXT = '.csv'  # '.bin' ならバイナリ形式
+METRICS = False  # True なら売買ループの処理時間を計測（bitbank.metrics）
+METRICS_FILE = 'logs/metrics.prom'
+METRICS_PORT = None  # 指定すれば http://127.0.0.1:{METRICS_PORT}/metrics でも返す
+PROFILE_INTERVAL = 0  # 0 より大きければこの秒数ごとに呼び出し履歴を記録
@@ -0,0 +1,135 @@
+import asyncio
+
+from bitbank import config, metrics
+from bitbank.const import PAIR, TRADERULE
+from bitbank.market import MarketData, Transport, PollingTransport
+from bitbank.paper import PaperExchange, SimClock
+from bitbank.trade import Trade
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+
+class Engine:
+    """
+    複数の 通貨ペア×取引ルール の自動売買を1つのイベントループでまとめて動かす
+    配信元は全通貨ペアで1つを共有し、受信したメッセージを通貨ペアごとの MarketData に振り分ける
+    """
+
+    def __init__(self, transport: Transport = None):
+        self.transport = transport or PollingTransport()
+        self.markets = {}  # 通貨ペア（文字列） → MarketData
+        self.trades = []
+        self.running = False
+
+    def get_market(self, pair: PAIR) -> MarketData:
+        # 受信はこのエンジンで行うので、MarketData のスレッドは開始しない
+        if pair.value not in self.markets:
+            self.markets[pair.value] = MarketData(pair=pair, transport=self.transport)
+        return self.markets[pair.value]
+
+    def add(self, pair: PAIR, rule: TRADERULE, is_rial: bool = False) -> Trade:
+        trade = Trade(pair=pair, rule=rule, is_rial=is_rial, market=self.get_market(pair))
+        self.trades.append(trade)
+        return trade
+
+    async def feed(self):
+        # 受信は別スレッドで待ち、ループ上では振り分けのみ行う
+        loop = asyncio.get_running_loop()
+        while self.running:
+            try:
+                message = await loop.run_in_executor(None, self.transport.recv, 1)
+            except Exception as e:
+                logger.error(f'受信エラー: {e}')
+                await asyncio.sleep(1)
+                continue
+            if message and message['pair'] in self.markets:
+                self.markets[message['pair']].feed(message)
+
+    async def run(self):
+        self.running = True
+        logger.info(f'【一括自動売買開始】 {len(self.trades)}件')
+        feed = asyncio.ensure_future(self.feed())
+        try:
+            await asyncio.gather(*[trade.trade_async() for trade in self.trades])
+        finally:
+            self.running = False
+            await feed
+            self.transport.close()
+
+
+class PaperEngine(Engine):
+    """
+    記録済みの板・約定を再生して模擬取引所で約定させる（待ち時間なしでメッセージの時刻どおりに進む）
+    メッセージを1件反映するたびに、全ての取引が次の更新待ちになるまで進めてから次を反映する
+    """
+
+    def __init__(self, transport: Transport, clock: SimClock = None):
+        """
+        :param transport: 再生する配信元（ReplayTransport を speed=0 で）
+        :param clock: メッセージの時刻（'time' ミリ秒）で進む時計
+        """
+        super().__init__(transport=transport)
+        self.clock = clock or SimClock()
+        self.exchanges = {}  # 通貨ペア（文字列） → PaperExchange
+        self.tasks = []
+
+    def get_exchange(self, pair: PAIR) -> PaperExchange:
+        if pair.value not in self.exchanges:
+            self.exchanges[pair.value] = PaperExchange(market=self.get_market(pair), clock=self.clock)
+        return self.exchanges[pair.value]
+
+    def add(self, pair: PAIR, rule: TRADERULE, is_rial: bool = False, file_name: str = None) -> Trade:
+        trade = Trade(pair=pair, rule=rule, is_rial=False, market=self.get_market(pair),
+                      exchange=self.get_exchange(pair), file_name=file_name)
+        self.trades.append(trade)
+        return trade
+
+    async def feed(self):
+        while self.running:
+            message = self.transport.recv()
+            # 再生終了
+            if message is None:
+                return
+            if 'time' in message:
+                self.clock.set(message['time'])
+            if message['pair'] in self.markets:
+                self.markets[message['pair']].feed(message)
+            await self.wait_idle()
+
+    async def wait_idle(self):
+        # 動いている取引がすべて更新待ち（wait_update_async）になるまで譲る
+        while sum(len(market.waiters) for market in self.markets.values()) < \
+                sum(not task.done() for task in self.tasks):
+            await asyncio.sleep(0)
+
+    async def run(self):
+        self.running = True
+        logger.info(f'【模擬取引開始】 {len(self.trades)}件')
+        self.tasks = [asyncio.ensure_future(trade.trade_async()) for trade in self.trades]
+        try:
+            await self.wait_idle()
+            await self.feed()
+        finally:
+            self.running = False
+            for task in self.tasks:
+                task.cancel()
+            results = await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.transport.close()
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+
+def main():
+    if config.METRICS:
+        metrics.start()
+    engine = Engine()
+    for pair in PAIR:
+        for rule in TRADERULE:
+            engine.add(pair=pair, rule=rule, is_rial=False)
+    asyncio.run(engine.run())
+
+
+if __name__ == '__main__':
+    main()
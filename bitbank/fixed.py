@@ -0,0 +1,75 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+from bitbank.const import RATE
+
+# 価格・資産は円単位の整数（btc_jpy の呼値は1円）、数量は 1e-8 BTC 単位の整数で扱う
+VOLUME_DIGITS = 8
+VOLUME_SCALE = 10 ** VOLUME_DIGITS
+# 注文数量の桁数（これより細かい端数は切り捨て）
+ORDER_VOLUME_DIGITS = 6
+# 増減率を整数で扱う場合の倍率
+RATE_SCALE = 10 ** RATE.ROUND_DIGITS.value
+
+
+class Volume(int):
+    """
+    数量（1e-8 BTC 単位の整数。文字列にすると BTC の小数表記）
+    文字列・小数は BTC の数量、整数はそのまま 1e-8 BTC 単位として変換する
+    """
+
+    def __new__(cls, value=0):
+        if isinstance(value, (str, float)):
+            # 小数は表示上の桁で変換する（0.1 * 1e8 の誤差を持ち込まない）
+            value = (Decimal(value if isinstance(value, str) else repr(float(value))) * VOLUME_SCALE).to_integral_value(
+                rounding=ROUND_HALF_EVEN)
+        return super().__new__(cls, value)
+
+    def __str__(self):
+        sign = '-' if self < 0 else ''
+        integer, fraction = divmod(abs(int(self)), VOLUME_SCALE)
+        fraction = f'{fraction:0{VOLUME_DIGITS}d}'.rstrip('0')
+        return f'{sign}{integer}.{fraction}' if fraction else f'{sign}{integer}'
+
+    def __repr__(self):
+        return f'Volume({str(self)!r})'
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    def to_float(self) -> float:
+        # 取引所の約定（小数の数量）と比べる場合
+        return int(self) / VOLUME_SCALE
+
+
+def to_volume(value) -> Volume:
+    """
+    取引所・板の数量（文字列・小数・整数はすべて BTC の数量）を Volume にする（Volume はそのまま）
+    """
+    if isinstance(value, Volume):
+        return value
+    return Volume(value if isinstance(value, str) else float(value))
+
+
+def amount(price: int, volume: int) -> int:
+    """
+    価格×数量の金額（円未満は四捨五入）
+    :param price: 価格（円）
+    :param volume: 数量（1e-8 BTC 単位）
+    """
+    return (price * volume * 2 + VOLUME_SCALE) // (VOLUME_SCALE * 2)
+
+
+def volume_for(assets: int, price: int, assets_rate: float = 1.0) -> Volume:
+    """
+    資産の assets_rate 倍で price の指値で買える数量（注文数量の桁未満は切り捨てるので、資産を超えない）
+    """
+    step = 10 ** (VOLUME_DIGITS - ORDER_VOLUME_DIGITS)
+    budget = int(assets * assets_rate) if assets_rate != 1.0 else assets
+    return Volume(budget * VOLUME_SCALE // price // step * step)
+
+
+def apply_rate(price: int, change_rate: float) -> int:
+    """
+    price を増減率 change_rate だけ増減させた価格（円未満は切り捨て）
+    """
+    return price * (RATE_SCALE + round(change_rate * RATE_SCALE)) // RATE_SCALE
@@ -0,0 +1,175 @@
+import numpy as np
+
+from bitbank.fixed import Volume
+
+# 列の型ごとの配列の型と空欄の値
+DTYPES = {
+    int: (np.int64, 0),
+    Volume: (np.int64, 0),
+    float: (np.float64, np.nan),
+    str: (object, ''),
+}
+
+
+class Ledger:
+    """
+    取引履歴を列ごとの型付き配列で保持する（行の追加は償却O(1)、列の参照は配列のビュー）
+    """
+
+    def __init__(self, columns: list, capacity: int = 1024):
+        """
+        :param columns: 列のリスト（値が [列名, 型] の Enum）
+        :param capacity: 初期確保行数（足りなくなったら倍に拡張）
+        """
+        self.columns = list(columns)
+        self.offsets = {col: i for i, col in enumerate(self.columns)}  # 列 → 行リスト上の位置
+        self.types = {col: col.value[1] for col in self.columns}
+        self.size = 0
+        self.capacity = max(capacity, 1)
+        self.arrays = {col: np.empty(self.capacity, dtype=DTYPES[self.types[col]][0]) for col in self.columns}
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_lines(cls, columns: list, lines: list):
+        """
+        行リスト（csvの文字列の行）から列ごとにまとめて変換して作成
+        """
+        ledger = cls(columns=columns, capacity=len(lines))
+        for col, values in zip(ledger.columns, zip(*lines) if lines else [()] * len(ledger.columns)):
+            ledger.arrays[col][:len(lines)] = [ledger.parse(col, value) for value in values]
+        ledger.size = len(lines)
+        return ledger
+
+    @classmethod
+    def from_arrays(cls, columns: list, arrays: dict, size: int):
+        """
+        列ごとの配列をコピーせずにそのまま使って作成（np.memmap など。追加時に初めてコピーして拡張）
+        """
+        ledger = cls(columns=columns, capacity=0)
+        ledger.arrays = dict(arrays)
+        ledger.size = size
+        ledger.capacity = size
+        return ledger
+
+    def parse(self, col, value):
+        # 空欄は型ごとの既定値（int・Volume: 0, float: NaN, str: ''）
+        col_type = self.types[col]
+        if value == '' or value is None:
+            return DTYPES[col_type][1]
+        return col_type(value)
+
+    def append(self, line: list):
+        if self.size == self.capacity:
+            self.reserve(max(self.capacity * 2, 1))
+        for col, i in self.offsets.items():
+            self.arrays[col][self.size] = self.parse(col, line[i])
+        self.size += 1
+
+    def reserve(self, capacity: int):
+        for col, array in self.arrays.items():
+            new_array = np.empty(capacity, dtype=array.dtype)
+            new_array[:self.size] = array[:self.size]
+            self.arrays[col] = new_array
+        self.capacity = capacity
+
+    def column(self, col, size: int = None) -> np.ndarray:
+        """
+        列の配列（最新 size 行分のビュー、size 未指定なら全行）
+        """
+        start = max(self.size - size, 0) if size else 0
+        return self.arrays[col][start:self.size]
+
+    def tail(self, size: int) -> dict:
+        """
+        最新 size 行分の全列のビュー
+        """
+        return {col: self.column(col, size=size) for col in self.columns}
+
+    def line(self, index: int) -> list:
+        """
+        1行をcsv用の行リストに戻す（空欄の値は空文字）
+        """
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        line = []
+        for col in self.columns:
+            value = self.arrays[col][index]
+            if self.types[col] is float and np.isnan(value):
+                line.append('')
+            else:
+                line.append(self.types[col](value))
+        return line
+
+    def lines(self):
+        for i in range(self.size):
+            yield self.line(i)
+
+
+class RollingStats:
+    """
+    最新 window 件の取引結果（増減率）の勝敗数と合計を、追加のたびに差分で更新する
+    増減率は丸め桁数の整数に変換して保持するので、足し引きを繰り返しても合計に誤差が溜まらない
+    """
+
+    def __init__(self, window: int = None, digits: int = 6):
+        """
+        :param window: 集計する最新件数（未指定なら全件）
+        :param digits: 増減率の丸め桁数
+        """
+        self.window = window
+        self.scale = 10 ** digits
+        self.buffer = np.zeros(window, dtype=np.int64) if window else None  # リングバッファ
+        self.pos = 0
+        self.count = 0
+        self.win_count = 0
+        self.lose_count = 0
+        self.zero_count = 0
+        self.scaled_sum = 0
+
+    def add(self, change_rate: float):
+        value = int(round(change_rate * self.scale))
+        if self.window:
+            # 一杯なら最も古い結果を取り除く
+            if self.count == self.window:
+                self.count_result(int(self.buffer[self.pos]), -1)
+            self.buffer[self.pos] = value
+            self.pos = (self.pos + 1) % self.window
+        self.count_result(value, 1)
+
+    def extend(self, change_rates):
+        # 集計対象になる最新分だけ追加
+        change_rates = np.asarray(change_rates, dtype=np.float64)
+        if self.window:
+            change_rates = change_rates[-self.window:]
+        # 空の場合は配列でまとめて集計（起動時の履歴読み込み用）
+        if self.count == 0:
+            values = np.round(change_rates * self.scale).astype(np.int64)
+            if self.window:
+                self.buffer[:len(values)] = values
+                self.pos = len(values) % self.window
+            self.count = len(values)
+            self.win_count = int(np.count_nonzero(values > 0))
+            self.lose_count = int(np.count_nonzero(values < 0))
+            self.zero_count = int(np.count_nonzero(values == 0))
+            self.scaled_sum = int(values.sum())
+            return
+        for change_rate in change_rates:
+            self.add(float(change_rate))
+
+    def count_result(self, value: int, sign: int):
+        self.count += sign
+        self.scaled_sum += sign * value
+        if value > 0:
+            self.win_count += sign
+        elif value < 0:
+            self.lose_count += sign
+        else:
+            self.zero_count += sign
+
+    @property
+    def change_rate_sum(self) -> float:
+        return self.scaled_sum / self.scale
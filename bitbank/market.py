@@ -0,0 +1,329 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from bitbank import config, metrics
+from bitbank.client import get_client
+from bitbank.const import PAIR, INTERVAL
+from bitbank.orderbook import OrderBook
+from bitbank.tape import TradeTape
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+
+class MESSAGE:
+    # 配信メッセージの種類（{'type': 種類, 'pair': 通貨ペア, 'data': APIと同じ形式のデータ}）
+    # API の約定一覧から作ったメッセージは 'snapshot': True（取りこぼしの確認用）
+    DEPTH = 'depth'
+    DEPTH_DIFF = 'depth_diff'
+    TRANSACTIONS = 'transactions'
+
+
+class Transport:
+    """
+    板・約定の配信元（差し替え可能）
+    """
+
+    def subscribe(self, pair: PAIR):
+        raise NotImplementedError
+
+    def recv(self, timeout: float = None) -> Optional[dict]:
+        """
+        次のメッセージを返す（timeout 秒以内に届かなければ None）
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollingTransport(Transport):
+    """
+    REST API を定期的に呼んでメッセージに変換する（配信が使えない場合の代替）
+    """
+
+    def __init__(self, client=None, interval: float = INTERVAL.MIN.value):
+        # 未指定なら全体で共有するクライアント（流量制限・キャッシュを共有）
+        self.client = client or get_client()
+        self.interval = interval
+        self.pairs = []
+        self.pending = deque()
+        self.next_poll = 0
+
+    def subscribe(self, pair: PAIR):
+        self.pairs.append(pair)
+
+    def recv(self, timeout: float = None) -> Optional[dict]:
+        if not self.pending:
+            wait = max(self.next_poll - time.time(), 0)
+            if timeout is not None and wait > timeout:
+                time.sleep(timeout)
+                return None
+            time.sleep(wait)
+            self.next_poll = time.time() + self.interval
+            for pair in self.pairs:
+                self.pending.append({'type': MESSAGE.DEPTH, 'pair': pair.value,
+                                     'data': self.client.get_depth(pair.value)})
+                self.pending.append({'type': MESSAGE.TRANSACTIONS, 'pair': pair.value, 'snapshot': True,
+                                     'data': self.client.get_transactions(pair.value)})
+        return self.pending.popleft() if self.pending else None
+
+
+class SocketIOTransport(Transport):
+    """
+    bitbank の配信（socket.io）を購読する（python-socketio が必要）
+    """
+    URL = 'wss://stream.bitbank.cc'
+
+    def __init__(self, url: str = URL):
+        import socketio
+        self.url = url
+        self.messages = queue.Queue()
+        self.rooms = []
+        self.client = socketio.Client(reconnection=True)
+        self.client.on('connect', self.on_connect)
+        self.client.on('message', self.on_message)
+
+    def subscribe(self, pair: PAIR):
+        self.rooms += [f'depth_whole_{pair.value}', f'depth_diff_{pair.value}', f'transactions_{pair.value}']
+        if self.client.connected:
+            self.on_connect()
+        else:
+            self.client.connect(self.url, transports=['websocket'])
+
+    def on_connect(self):
+        for room in self.rooms:
+            self.client.emit('join-room', room)
+
+    def on_message(self, message):
+        room_name = message['room_name']
+        data = message['message']['data']
+        if room_name.startswith('depth_whole_'):
+            self.messages.put({'type': MESSAGE.DEPTH, 'pair': room_name[len('depth_whole_'):], 'data': data})
+        elif room_name.startswith('depth_diff_'):
+            self.messages.put({'type': MESSAGE.DEPTH_DIFF, 'pair': room_name[len('depth_diff_'):], 'data': data})
+        elif room_name.startswith('transactions_'):
+            self.messages.put({'type': MESSAGE.TRANSACTIONS, 'pair': room_name[len('transactions_'):], 'data': data})
+
+    def recv(self, timeout: float = None) -> Optional[dict]:
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.client.disconnect()
+
+
+class ReplayTransport(Transport):
+    """
+    記録済みのメッセージを順に返す（オフラインでの動作確認用）
+    """
+
+    def __init__(self, messages: list = None, file_name: str = None, speed: float = 0):
+        """
+        :param messages: メッセージのリスト
+        :param file_name: メッセージを1行1件のJSONで記録したファイル
+        :param speed: 記録時の間隔（メッセージの 'time' ミリ秒）を何倍速で再現するか（0なら待たない）
+        """
+        if file_name:
+            with open(file=file_name, mode='r') as f:
+                messages = [json.loads(line) for line in f if line.strip()]
+        self.messages = deque(messages or [])
+        self.speed = speed
+        self.pairs = []
+        self.last_time = None
+
+    def subscribe(self, pair: PAIR):
+        self.pairs.append(pair.value)
+
+    def recv(self, timeout: float = None) -> Optional[dict]:
+        while self.messages:
+            message = self.messages.popleft()
+            if self.pairs and message['pair'] not in self.pairs:
+                continue
+            if self.speed and 'time' in message:
+                if self.last_time is not None:
+                    time.sleep(max(message['time'] - self.last_time, 0) / 1000 / self.speed)
+                self.last_time = message['time']
+            return message
+        if timeout:
+            time.sleep(timeout)
+        return None
+
+
+def set_waiter_result(future, value):
+    """
+    asyncio の待機に結果を設定する（loop.call_soon_threadsafe でループのスレッドから呼ぶ）
+    """
+    # タイムアウト・キャンセル済みの Future には設定しない
+    if not future.done():
+        future.set_result(value)
+
+
+class MarketData:
+    """
+    通貨ペアごとの最新の板と直近の約定（配信元からのメッセージで更新し、更新を待っている処理に通知する）
+    """
+
+    def __init__(self, pair: PAIR, transport: Transport, tape_size: int = 1000):
+        self.pair = pair
+        self.transport = transport
+        self.depth = None
+        self.book = None  # 最新の板（数値に変換済み）
+        self.tape = TradeTape(pair=pair, size=tape_size)  # 直近の約定
+        self.version = 0  # 更新のたびに増える
+        self.time = None  # 最後に反映したメッセージの時刻（ミリ秒、記録済みのメッセージのみ）
+        self.condition = threading.Condition()
+        self.listeners = []
+        self.waiters = []  # 更新を待っている asyncio の (ループ, Future)
+        self.thread = None
+        self.running = False
+        self.transport.subscribe(pair)
+
+    def start(self):
+        # 配信元からの受信を別スレッドで開始
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name=f'market_{self.pair.value}', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.transport.close()
+
+    def run(self):
+        while self.running:
+            try:
+                message = self.transport.recv(timeout=1)
+            except Exception as e:
+                logger.error(f'受信エラー: {e}')
+                time.sleep(INTERVAL.MIN.value)
+                continue
+            if message and message['pair'] == self.pair.value:
+                self.feed(message)
+
+    def feed(self, message: dict):
+        """
+        メッセージを反映して、更新を待っている処理と購読者に通知する
+        """
+        with metrics.timer('bitbank_feed_seconds', type=message['type']):
+            if 'time' in message:
+                self.time = message['time']
+            # 板の数値への変換・約定の取り込みはロックの外で1度だけ行う
+            if message['type'] == MESSAGE.DEPTH:
+                book = OrderBook.from_depth(message['data'])
+            elif message['type'] == MESSAGE.TRANSACTIONS:
+                # 新しい約定がなければ通知しない
+                if not self.tape.add(message['data']['transactions'], is_snapshot=message.get('snapshot', False)):
+                    return
+            with self.condition:
+                if message['type'] == MESSAGE.DEPTH:
+                    self.depth = message['data']
+                    self.book = book
+                elif message['type'] == MESSAGE.DEPTH_DIFF:
+                    # 全体の板を受信済みで、それより新しい差分のみ反映
+                    if self.book is None or (self.book.sequence_id is not None
+                                             and int(message['data']['s']) <= int(self.book.sequence_id)):
+                        return
+                    self.book = self.book.apply_diff(message['data'])
+            self.notify(message['type'])
+
+    def feed_book(self, book: OrderBook):
+        """
+        変換済みの板を反映する（記録した板の再生用）
+        """
+        with self.condition:
+            self.book = book
+        self.notify(MESSAGE.DEPTH)
+
+    def feed_transactions(self, transactions: list):
+        """
+        約定を反映する（記録した約定の再生用）
+        """
+        if self.tape.add(transactions):
+            self.notify(MESSAGE.TRANSACTIONS)
+
+    def notify(self, message_type: str):
+        # 購読者（模擬取引所の約定・時計など）を先に更新してから、更新を待っている処理を起こす
+        for listener in self.listeners:
+            listener(message_type, self)
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+            waiters, self.waiters = self.waiters, []
+        # asyncio の待機は、それぞれのループのスレッドで結果を設定する
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(set_waiter_result, future, self.version)
+
+    def subscribe(self, listener):
+        """
+        :param listener: 更新のたびに呼ばれる関数（引数はメッセージの種類と MarketData）
+        """
+        self.listeners.append(listener)
+
+    def wait_update(self, version: int = None, timeout: float = None) -> int:
+        """
+        version より新しい更新があるまで待つ（version 未指定なら次の更新まで）
+        :return: 最新の version
+        """
+        with self.condition:
+            if version is None:
+                version = self.version
+            self.condition.wait_for(lambda: self.version > version, timeout=timeout)
+            return self.version
+
+    async def wait_update_async(self, version: int = None, timeout: float = None) -> int:
+        """
+        wait_update の asyncio 版（待っている間もループ上のほかの処理は止まらない）
+        :return: 最新の version
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.condition:
+            if version is None:
+                version = self.version
+            if self.version > version:
+                return self.version
+            self.waiters.append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            with self.condition:
+                if (loop, future) in self.waiters:
+                    self.waiters.remove((loop, future))
+                return self.version
+
+    def get_depth(self, timeout: float = None):
+        # 板を一度も受信していなければ受信するまで待つ
+        with self.condition:
+            self.condition.wait_for(lambda: self.depth is not None, timeout=timeout)
+            return self.depth
+
+    def get_book(self, timeout: float = None) -> OrderBook:
+        # 板を一度も受信していなければ受信するまで待つ
+        with self.condition:
+            self.condition.wait_for(lambda: self.book is not None, timeout=timeout)
+            return self.book
+
+    def get_transactions(self) -> dict:
+        # API の get_transactions と同じ形式
+        return {'transactions': self.tape.get_transactions()}
+
+
+markets = {}
+
+
+def get_market_data(pair: PAIR, transport: Transport = None) -> MarketData:
+    """
+    通貨ペアごとに1つの MarketData を共有する（初回は配信元を指定しなければ REST API のポーリング）
+    """
+    if pair not in markets:
+        markets[pair] = MarketData(pair=pair, transport=transport or PollingTransport()).start()
+    return markets[pair]
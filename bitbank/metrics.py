@@ -0,0 +1,247 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bitbank import config
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+# 秒単位の既定の区切り（1ms 未満から30秒まで）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# 計測名 → 説明（Prometheus の HELP）
+HELP = {
+    'bitbank_api_request_seconds': 'Public API の応答時間',
+    'bitbank_feed_seconds': '配信メッセージの反映時間',
+    'bitbank_signal_seconds': '購入・売却判定の時間',
+    'bitbank_order_place_seconds': '指値注文の時間',
+    'bitbank_decision_to_order_seconds': '購入・売却判定の成立から注文までの時間',
+    'bitbank_fill_wait_seconds': '注文から約定・取消までの時間',
+    'bitbank_update_wait_seconds': '板・約定の更新待ちの時間',
+    'bitbank_ledger_query_seconds': '取引履歴の集計時間',
+}
+
+
+class Histogram:
+    """
+    観測値の件数・合計・区切りごとの件数（Prometheus の histogram）
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後は区切りを超えた分
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+
+class Timer:
+    # with 文の間の経過秒数を記録する
+    __slots__ = ('histogram', 'started_at')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.started_at)
+
+
+class NullTimer:
+    # 計測しない場合の with 文（何もしない）
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Registry:
+    """
+    プロセス内の計測値の置き場（計測名とラベルの組ごとに1つの Histogram）
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms = {}  # (計測名, ラベル) → Histogram
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str, labels: tuple = ()) -> Histogram:
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus のテキスト形式
+        """
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items(), key=lambda item: item[0])
+        names = set()
+        for (name, labels), histogram in items:
+            if name not in names:
+                names.add(name)
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+            with histogram.lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bucket, bucket_count in zip(histogram.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                bucket_labels = ','.join(filter(None, [label_text, f'le="{bucket}"']))
+                lines.append(f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+            suffix = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{name}_sum{suffix} {total}')
+            lines.append(f'{name}_count{suffix} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file_name: str):
+        # 読み取り側が書きかけのファイルを読まないように、一時ファイルに書いてから置き換える
+        tmp_file_name = f'{file_name}.tmp'
+        with open(file=tmp_file_name, mode='w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_file_name, file_name)
+
+
+registry = Registry(enabled=config.METRICS)
+
+
+def timer(name: str, **labels):
+    """
+    with 文の間の経過秒数を記録する（計測しない設定なら何もしない）
+    """
+    if not registry.enabled:
+        return NULL_TIMER
+    return Timer(registry.histogram(name, tuple(sorted(labels.items()))))
+
+
+def observe(name: str, value: float, **labels):
+    if registry.enabled:
+        registry.histogram(name, tuple(sorted(labels.items()))).observe(value)
+
+
+class SamplingProfiler:
+    """
+    一定間隔で全スレッドの呼び出し履歴を記録する（flamegraph.pl 等で読める collapsed 形式で書き出す）
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name='sampling_profiler', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        own_id = threading.get_ident()
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def top(self, size: int = 20) -> list:
+        """
+        最も多く記録された関数（呼び出し履歴の末端）と記録回数
+        """
+        leaves = Counter()
+        for stack, count in list(self.stacks.items()):
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(size)
+
+    def dump(self, file_name: str):
+        with open(file=file_name, mode='w') as f:
+            for stack, count in list(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+def serve(port: int):
+    """
+    計測値を http://localhost:{port}/metrics で返す
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics_server', daemon=True).start()
+    return server
+
+
+profiler = None
+
+
+def start(file_name: str = config.METRICS_FILE, port: int = config.METRICS_PORT, interval: float = 10,
+          profile_interval: float = config.PROFILE_INTERVAL):
+    """
+    計測を有効にして、interval 秒ごとにファイルへ書き出す（port を指定すれば HTTP でも返す）
+    :param profile_interval: 0 より大きければ、この秒数ごとの呼び出し履歴も記録して {file_name}.profile に書き出す
+    """
+    global profiler
+    registry.enabled = True
+    if port:
+        serve(port)
+    if profile_interval:
+        profiler = SamplingProfiler(interval=profile_interval).start()
+
+    def dump_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.dump(file_name)
+                if profiler:
+                    profiler.dump(f'{file_name}.profile')
+            except OSError as e:
+                logger.error(f'計測値の書き出しエラー: {e}')
+
+    threading.Thread(target=dump_loop, name='metrics_dump', daemon=True).start()
+    logger.info(f'【計測開始】 {file_name}' + (f'  http://127.0.0.1:{port}/metrics' if port else ''))
@@ -0,0 +1,163 @@
+import itertools
+import timeit
+from typing import Optional
+
+import numpy as np
+
+
+class SIDE:
+    ASK = 'asks'
+    BID = 'bids'
+
+
+class OrderBook:
+    """
+    板のスナップショット（受信時に1度だけ数値配列に変換し、上位N件の加重平均価格を累積和から O(1) で返す）
+    板そのものは全件保持し（差分の反映で上位の価格が消えても、その下の価格が繰り上がるように）、累積和だけ上位 levels 件にする
+    更新は新しい OrderBook を作って差し替える（読み取り中の処理からは常に一貫した板が見える）
+    """
+
+    def __init__(self, asks=None, bids=None, sequence_id: int = None, levels: int = 50):
+        """
+        :param asks: 売り板 [[価格, 数量], ...]（価格の安い順、文字列可）
+        :param bids: 買い板 [[価格, 数量], ...]（価格の高い順、文字列可）
+        :param sequence_id: 配信の通し番号（差分の適用順の確認用）
+        :param levels: 累積和（加重平均価格）を求める上位の件数
+        """
+        self.sequence_id = sequence_id
+        self.levels = levels
+        self.prices = {}
+        self.volumes = {}
+        self.cum_volumes = {}  # 上位 levels 件まで上位から累積した数量
+        self.cum_amounts = {}  # 上位 levels 件まで上位から累積した 価格×数量
+        for side, orders in ((SIDE.ASK, asks), (SIDE.BID, bids)):
+            # 文字列のまま1次元に並べてから一括で数値に変換
+            flat = list(itertools.chain.from_iterable(orders)) if orders else []
+            levels_array = np.array(flat, dtype=np.float64).reshape(-1, 2)
+            self.set_side(side, levels_array[:, 0].astype(np.int64), levels_array[:, 1])
+
+    @classmethod
+    def from_cumsum(cls, prices: dict, volumes: dict, cum_volumes: dict, cum_amounts: dict, sequence_id: int = None):
+        """
+        累積和まで計算済みの配列から作成（多数の板の累積和をまとめて計算しておく場合）
+        """
+        book = cls.__new__(cls)
+        book.sequence_id = sequence_id
+        book.levels = len(prices[SIDE.ASK])
+        book.prices, book.volumes, book.cum_volumes, book.cum_amounts = prices, volumes, cum_volumes, cum_amounts
+        return book
+
+    def set_side(self, side: str, prices: np.ndarray, volumes: np.ndarray):
+        self.prices[side] = prices
+        self.volumes[side] = volumes
+        self.cum_volumes[side] = np.cumsum(volumes[:self.levels])
+        self.cum_amounts[side] = np.cumsum(prices[:self.levels] * volumes[:self.levels])
+
+    @classmethod
+    def from_depth(cls, depth: dict, levels: int = 50):
+        """
+        API（get_depth）・配信（depth_whole）の形式から作成
+        """
+        return cls(asks=depth['asks'], bids=depth['bids'], sequence_id=depth.get('sequenceId'), levels=levels)
+
+    def apply_diff(self, diff: dict):
+        """
+        配信（depth_diff）の差分を反映した新しい板を返す（数量0の価格は削除）
+        :param diff: {'a': [[価格, 数量], ...], 'b': [[価格, 数量], ...], 's': 通し番号}
+        """
+        sides = {}
+        for side, key, descending in ((SIDE.ASK, 'a', False), (SIDE.BID, 'b', True)):
+            levels = dict(zip(self.prices[side].tolist(), self.volumes[side].tolist()))
+            for price, volume in diff.get(key, []):
+                if float(volume) == 0:
+                    levels.pop(int(price), None)
+                else:
+                    levels[int(price)] = float(volume)
+            sides[side] = sorted(levels.items(), reverse=descending)
+        return OrderBook(asks=sides[SIDE.ASK], bids=sides[SIDE.BID], sequence_id=diff.get('s', self.sequence_id),
+                         levels=self.levels)
+
+    def depth(self, side: str) -> int:
+        return len(self.prices[side])
+
+    def best(self, side: str) -> int:
+        return int(self.prices[side][0])
+
+    def volume_at(self, side: str, price: int) -> float:
+        # 指定価格の数量（板になければ0）
+        i = np.flatnonzero(self.prices[side] == int(price))
+        return float(self.volumes[side][i[0]]) if len(i) else 0.0
+
+    @property
+    def best_ask(self) -> int:
+        return self.best(SIDE.ASK)
+
+    @property
+    def best_bid(self) -> int:
+        return self.best(SIDE.BID)
+
+    def mean(self, side: str, size: int = 3) -> Optional[int]:
+        """
+        上位 size 件（最大 levels 件）の数量加重平均価格（Trade.get_mean_by_limit_orders と同じ値）
+        :return: 板が空なら None
+        """
+        i = min(size, len(self.cum_volumes[side])) - 1
+        if i < 0:
+            return None
+        return round(float(self.cum_amounts[side][i] / self.cum_volumes[side][i]))
+
+    def spread(self, size: int = 3) -> Optional[int]:
+        # 売り板と買い板の加重平均価格の差（どちらかの板が空なら None）
+        ask_price, bid_price = self.mean(SIDE.ASK, size=size), self.mean(SIDE.BID, size=size)
+        if ask_price is None or bid_price is None:
+            return None
+        return ask_price - bid_price
+
+    def spread_rate(self, size: int = 3) -> Optional[float]:
+        # 売り板の加重平均価格に対する差の割合（どちらかの板が空なら None）
+        spread = self.spread(size=size)
+        if spread is None:
+            return None
+        return spread / self.mean(SIDE.ASK, size=size)
+
+
+def benchmark(levels: int = 200, size: int = 3, number: int = 10000):
+    """
+    Trade.get_mean_by_limit_orders と OrderBook の比較（1回あたりの秒数を表示）
+    """
+    from bitbank.trade import Trade
+
+    rng = np.random.default_rng(0)
+    best_ask = 5000000
+    depth = {
+        'asks': [[str(best_ask + i * 1000), f'{rng.random():.4f}'] for i in range(levels)],
+        'bids': [[str(best_ask - (i + 1) * 1000), f'{rng.random():.4f}'] for i in range(levels)],
+    }
+
+    # 1ティックで売り・買いの加重平均を3回ずつ（sell, within_diff_rate, without_diff_rate）求める場合
+    # （OrderBook への変換は受信スレッドで1度だけ行われるので、取引側の負担は平均の参照のみ）
+    def current():
+        for _ in range(3):
+            Trade.get_mean_by_limit_orders(depth['asks'], size=size)
+            Trade.get_mean_by_limit_orders(depth['bids'], size=size)
+
+    def orderbook():
+        book = OrderBook.from_depth(depth)
+        for _ in range(3):
+            book.mean(SIDE.ASK, size=size)
+            book.mean(SIDE.BID, size=size)
+
+    book = OrderBook.from_depth(depth)
+    assert book.mean(SIDE.ASK, size=size) == Trade.get_mean_by_limit_orders(depth['asks'], size=size)
+    assert book.mean(SIDE.BID, size=size) == Trade.get_mean_by_limit_orders(depth['bids'], size=size)
+
+    current_time = timeit.timeit(current, number=number) / number
+    orderbook_time = timeit.timeit(orderbook, number=number) / number
+    read_time = timeit.timeit(lambda: book.mean(SIDE.ASK, size=size), number=number) / number
+    print(f'get_mean_by_limit_orders×6: {current_time * 1e6:.1f}µs')
+    print(f'OrderBook 変換+平均×6: {orderbook_time * 1e6:.1f}µs')
+    print(f'OrderBook 平均×1（変換済み）: {read_time * 1e6:.2f}µs')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,127 @@
+from bitbank import config
+from bitbank.const import DIRECTION, ORDER
+from bitbank.fixed import Volume, to_volume
+from bitbank.market import MarketData, MESSAGE
+from bitbank.orderbook import OrderBook, SIDE
+from bitbank.tape import TapeWatch
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+
+class SimClock:
+    """
+    記録済みのメッセージの時刻で進む時計（time モジュールの代わりに Trade に渡す）
+    """
+
+    def __init__(self, now: float = 0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def set(self, time_millisecond: int):
+        # 時刻は戻さない
+        self.now = max(self.now, time_millisecond / 1000)
+
+
+class PaperOrder(TapeWatch):
+    """
+    模擬取引所の指値注文（同じ価格に先に並んでいる数量を消化してから約定する）
+    """
+
+    def __init__(self, order: ORDER, price, volume: Volume, queue_ahead: Volume = Volume(0), since: int = None):
+        """
+        :param queue_ahead: 注文時に同じ価格に並んでいた数量（この分の約定の後に約定する）
+        数量はすべて Volume（1e-8 BTC 単位の整数）で数える
+        """
+        direction = DIRECTION.DOWN if order == ORDER.BUY else DIRECTION.UP
+        super().__init__(direction=direction, price=price, volume=volume, since=since)
+        self.order = order
+        self.queue_ahead = to_volume(queue_ahead)
+        self.side = SIDE.BID if order == ORDER.BUY else SIDE.ASK
+
+    def is_better(self, price: int) -> bool:
+        # 指値より有利な価格（買いなら安い、売りなら高い）
+        return price < self.price if self.order == ORDER.BUY else price > self.price
+
+    def fill(self, volume: Volume, transaction: dict = None) -> bool:
+        self.filled_volume = Volume(min(self.filled_volume + volume, self.volume))
+        if self.filled_volume >= self.volume:
+            self.transaction = transaction
+            self.event.set()
+            return True
+        return False
+
+    def update(self, transaction: dict) -> bool:
+        """
+        約定ごとに呼ばれる（TradeTape の監視として登録）
+        :return: この約定で全量約定したか
+        """
+        if self.is_done or (self.since is not None and transaction['executed_at'] <= self.since):
+            return False
+        price = int(transaction['price'])
+        amount = to_volume(transaction['amount'])
+        # 指値より有利な価格の約定があれば、指値の注文はすべて約定している
+        if self.is_better(price):
+            return self.fill(self.volume, transaction)
+        # 同じ価格の約定は、先に並んでいる数量から消化する
+        if price == self.price:
+            consumed = min(self.queue_ahead, amount)
+            self.queue_ahead = Volume(self.queue_ahead - consumed)
+            if amount > consumed:
+                return self.fill(Volume(amount - consumed), transaction)
+        return False
+
+    def update_book(self, book: OrderBook) -> bool:
+        """
+        板の更新ごとに呼ばれる
+        :return: この板で全量約定したか
+        """
+        if self.is_done:
+            return False
+        # 反対側の板が指値に届いたら約定（買いなら売り板の最良価格が指値以下）
+        opposite = SIDE.ASK if self.order == ORDER.BUY else SIDE.BID
+        if book.depth(opposite):
+            best = book.best(opposite)
+            if (self.order == ORDER.BUY and best <= self.price) or (self.order == ORDER.SELL and best >= self.price):
+                return self.fill(self.volume)
+        # 先に並んでいる注文が取り消されて板の数量が減った分は前に進む
+        self.queue_ahead = min(self.queue_ahead, to_volume(book.volume_at(self.side, self.price)))
+        return False
+
+
+class PaperExchange:
+    """
+    模擬取引所（記録・再生した板と約定に対して Trade の指値注文を約定させる）
+    """
+
+    def __init__(self, market: MarketData, clock: SimClock = None):
+        self.market = market
+        self.clock = clock or SimClock()
+        self.orders = []
+        market.subscribe(self.on_update)
+
+    def place(self, order: ORDER, price: int, volume: Volume) -> PaperOrder:
+        # 注文時点で同じ価格に並んでいる数量の後ろに並ぶ
+        book = self.market.book
+        side = SIDE.BID if order == ORDER.BUY else SIDE.ASK
+        queue_ahead = to_volume(book.volume_at(side, price)) if book else Volume(0)
+        paper_order = PaperOrder(order=order, price=price, volume=volume, queue_ahead=queue_ahead,
+                                 since=round(self.clock.time() * 1000))
+        if book:
+            paper_order.update_book(book)
+        self.orders.append(paper_order)
+        # 約定は TradeTape から新しい約定だけが渡される
+        return self.market.tape.watch(paper_order)
+
+    def on_update(self, message_type: str, market: MarketData):
+        # 時計はメッセージの時刻で進める（PaperEngine を使わず MarketData を直接再生する場合も進むように）
+        if market.time is not None:
+            self.clock.set(market.time)
+        if message_type not in (MESSAGE.DEPTH, MESSAGE.DEPTH_DIFF):
+            return
+        for paper_order in self.orders:
+            paper_order.update_book(market.book)
+        self.orders = [paper_order for paper_order in self.orders
+                       if not paper_order.is_done and paper_order in market.tape.watches]
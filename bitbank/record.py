@@ -1,10 +1,15 @@
 import csv
+import io
 import os
 from copy import copy
 from enum import Enum
 
-from bitbank import config
+import numpy as np
+
+from bitbank import config, metrics
 from bitbank.const import RATE
+from bitbank.fixed import VOLUME_SCALE, Volume, amount, apply_rate
+from bitbank.ledger import Ledger, RollingStats
 from cmn.log import get_logger
 
 logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
@@ -12,10 +17,15 @@ logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
 
 class Record:
 
-    def __init__(self, file_name: str = 'record.csv'):
-        self.csv = CSV(file_name=file_name)
+    def __init__(self, file_name: str = 'record.csv', fsync: bool = True):
+        # 拡張子が .bin ならバイナリ形式（BIN）、それ以外は CSV（バックテストなど消えても困らない場合は fsync しない）
+        self.csv = open_record_file(file_name=file_name, fsync=fsync)
+        # 集計件数ごとの勝敗数・増減率合計（売却のたびに差分更新）
+        self.stats = {}
+        self.get_stats(size=None)
+        self.get_stats(size=config.WINRATE_SAMPLE)
 
-    def buy(self, volume: float, price: str, try_num: int, executed_at: int, change_rate: float, assets: str):
+    def buy(self, volume: Volume, price: int, try_num: int, executed_at: int, change_rate: float, assets: int):
         cols = {
             CSV.COlUMN.VOLUME: volume,
             CSV.COlUMN.BUY_PRICE: price,
@@ -26,16 +36,17 @@ class Record:
             CSV.COlUMN.STATUS: CSV.STATUS.MONITORING.value,
         }
         self.csv.monitoring_line = CSV.generate_line(cols=cols)
+        self.csv.append(self.csv.monitoring_line)
 
-    def sell(self, price: str, executed_at: int, try_num: int, assets: str):
+    def sell(self, price: int, executed_at: int, try_num: int, assets: int):
         if not self.csv.monitoring_line:
             logger.error('「monitoring_line」が設定されていません。')
 
         buy_price = CSV.get_column_value(line=self.csv.monitoring_line, col=CSV.COlUMN.BUY_PRICE)
         volume = CSV.get_column_value(line=self.csv.monitoring_line, col=CSV.COlUMN.VOLUME)
-        price_diff = int(price) - int(buy_price)
-        pl = int(price_diff * volume)
-        change_rate = round((int(price) / int(buy_price) - 1), RATE.ROUND_DIGITS.value)
+        # 損益は売却額と購入額の差（資産の増減と一致する）
+        pl = amount(price, volume) - amount(buy_price, volume)
+        change_rate = round((price / buy_price - 1), RATE.ROUND_DIGITS.value)
         logger.info(f'損益: {pl}  増減率: {change_rate}')
         cols = {
             CSV.COlUMN.SELL_PRICE: price,
@@ -46,8 +57,12 @@ class Record:
             CSV.COlUMN.ASSETS: assets,
             CSV.COlUMN.STATUS: CSV.STATUS.CLOSED.value,
         }
-        self.csv.lines.append(CSV.generate_line(cols=cols, src_line=self.csv.monitoring_line))
+        line = CSV.generate_line(cols=cols, src_line=self.csv.monitoring_line)
+        self.csv.ledger.append(line)
+        self.csv.append(line)
         self.csv.monitoring_line = None
+        for stats in self.stats.values():
+            stats.add(change_rate)
 
     def get_sell_info(self, line=None):
         if not line:
@@ -55,41 +70,23 @@ class Record:
         buy_price = CSV.get_column_value(line=line, col=CSV.COlUMN.BUY_PRICE)
         volume = CSV.get_column_value(line=line, col=CSV.COlUMN.VOLUME)
         change_rate = CSV.get_column_value(line=line, col=CSV.COlUMN.BEST_CHANGE_RATE)
-        profit_price = str(int(int(buy_price) * (1 + change_rate)))
-        stop_loss_price = str(int(int(buy_price) * (1 - change_rate)))
+        profit_price = apply_rate(buy_price, change_rate)
+        stop_loss_price = apply_rate(buy_price, -change_rate)
         return volume, profit_price, stop_loss_price
 
     def get_win_rate(self, size: int = None, min_win_rate: float = 0):
         win_rate = 0
         use_min_win_rate = False
 
-        trade_count = 0
-        win_count = 0
-        lose_count = 0
-        zero_count = 0
-
-        if size:
-            # 指定されたサイズより履歴がある場合は指定されたサイズ分の最新履歴を対象とする
-            if len(self.csv.lines) - 1 >= size:
-                lines = self.csv.lines[-size:]
-            # 指定されたサイズより履歴がない場合は最低勝率を採用（存在する全履歴の勝率は算出できるようにする）
-            else:
-                lines = self.csv.lines[1:]
-                logger.warning(f'勝率計算サンプル数不足: {len(lines)} / {size}')
-                use_min_win_rate = True
-        else:
-            lines = self.csv.lines[1:]
-
-        # 取引回数、勝敗をカウント
-        for line in lines:
-            trade_count += 1
-            result_change_rate = CSV.get_column_value(line=line, col=CSV.COlUMN.RESULT_CHANGE_RATE)
-            if float(result_change_rate) == 0:
-                zero_count += 1
-            elif float(result_change_rate) > 0:
-                win_count += 1
-            elif float(result_change_rate) < 0:
-                lose_count += 1
+        # 指定されたサイズより履歴がない場合は最低勝率を採用（存在する全履歴の勝率は算出できるようにする）
+        if size and len(self.csv.ledger) < size:
+            logger.warning(f'勝率計算サンプル数不足: {len(self.csv.ledger)} / {size}')
+            use_min_win_rate = True
+        # 指定されたサイズ分の最新履歴（なければ全履歴）の取引回数、勝敗数
+        stats = self.get_stats(size=size)
+        trade_count = stats.count
+        win_count = stats.win_count
+        zero_count = stats.zero_count
 
         # 取引がない場合は最低勝率を採用
         if trade_count == 0:
@@ -117,40 +114,38 @@ class Record:
         return win_rate
 
     def get_change_rate_sum(self, size: int):
-        if len(self.csv.lines) - 1 < 1:
+        if len(self.csv.ledger) < 1:
             logger.debug(f'取引履歴なし')
             return 0
-        result_change_rate_list = []
-        if size:
-            # 指定されたサイズより履歴がある場合は指定されたサイズ分の最新履歴を対象とする
-            if len(self.csv.lines) - 1 >= size:
-                lines = self.csv.lines[-size:]
-            # 指定されたサイズより履歴がない場合は存在する全履歴を対象
-            else:
-                lines = self.csv.lines[1:]
-                logger.warning(f'増減率合計サンプル数不足: {len(lines)} / {size}')
-        else:
-            lines = self.csv.lines[1:]
-        for line in lines:
-            result_change_rate = CSV.get_column_value(line=line, col=CSV.COlUMN.RESULT_CHANGE_RATE)
-            result_change_rate_list.append(float(result_change_rate))
-
-        return round(sum(result_change_rate_list), RATE.ROUND_DIGITS.value)
+        # 指定されたサイズより履歴がない場合は存在する全履歴を対象
+        if size and len(self.csv.ledger) < size:
+            logger.warning(f'増減率合計サンプル数不足: {len(self.csv.ledger)} / {size}')
+        # 指定されたサイズ分の最新履歴（なければ全履歴）を対象とする
+        return round(self.get_stats(size=size).change_rate_sum, RATE.ROUND_DIGITS.value)
+
+    def get_stats(self, size: int = None) -> RollingStats:
+        # 初めて使う集計件数の場合だけ履歴から作成し、以降は売却のたびに差分更新する
+        if size not in self.stats:
+            with metrics.timer('bitbank_ledger_query_seconds', query='stats'):
+                stats = RollingStats(window=size, digits=RATE.ROUND_DIGITS.value)
+                stats.extend(self.csv.ledger.column(CSV.COlUMN.RESULT_CHANGE_RATE, size=size))
+            self.stats[size] = stats
+        return self.stats[size]
 
 
 class CSV:
     class COlUMN(Enum):
-        VOLUME = ['VOLUME', float]
-        BUY_PRICE = ['BUY_PRICE', str]
+        VOLUME = ['VOLUME', Volume]
+        BUY_PRICE = ['BUY_PRICE', int]
         BUY_AT = ['BUY_AT', int]
         BUY_TRY_NUM = ['BUY_TRY_NUM', int]
-        SELL_PRICE = ['SELL_PRICE', str]
+        SELL_PRICE = ['SELL_PRICE', int]
         SELL_AT = ['SELL_AT', int]
         SELL_TRY_NUM = ['SELL_TRY_NUM', int]
         BEST_CHANGE_RATE = ['BEST_CHANGE_RATE', float]
         RESULT_CHANGE_RATE = ['RESULT_CHANGE_RATE', float]
-        PL = ['PL', str]
-        ASSETS = ['ASSETS', str]
+        PL = ['PL', int]
+        ASSETS = ['ASSETS', int]
         STATUS = ['STATUS', str]
 
     class STATUS(Enum):
@@ -161,39 +156,98 @@ class CSV:
     for column in COlUMN:
         COLUMNS.append(column)
     del column
+    # 列 → 行リスト上の位置（毎回 COLUMNS.index で探さない）
+    COLUMN_INDEX = {column: i for i, column in enumerate(COLUMNS)}
 
-    def __init__(self, file_name: str = 'record.csv'):
+    STATUSES = [status.value for status in STATUS]
+
+    def __init__(self, file_name: str = 'record.csv', fsync: bool = True):
+        """
+        ファイルは追記専用のジャーナルとして扱う（購入時に売却中の行、売却時に売却済みの行を1行ずつ追記）
+        :param file_name: ファイル名
+        :param fsync: 追記のたびにディスクへの書き込みを待つかどうか
+        """
         self.file_name = file_name
-        self.lines = self.read_lines()
+        self.fsync = fsync
+        self.f = None
+        self.header, lines, is_torn = self.read_lines()
         self.monitoring_line = ''
 
+        # 追記された行を順に再生して、売却済みの行と売却中の行に分ける
+        closed_lines = []
+        for line in lines:
+            if len(line) != len(self.COLUMNS) or line[self.COLUMN_INDEX[CSV.COlUMN.STATUS]] not in self.STATUSES:
+                logger.warning(f"書き込み途中で終了した行を無視します: {line}")
+                is_torn = True
+                continue
+            if CSV.get_column_value(line=line, col=CSV.COlUMN.STATUS) == CSV.STATUS.CLOSED.value:
+                closed_lines.append(line)
+                self.monitoring_line = ''
+            else:
+                self.monitoring_line = copy(line)
         # 前回処理途中だった場合の考慮
-        last_line = copy(self.lines[-1])
-        if last_line and CSV.get_column_value(line=last_line, col=CSV.COlUMN.STATUS) == CSV.STATUS.MONITORING.value:
-            self.monitoring_line = last_line
-            del self.lines[-1]
+        if self.monitoring_line:
             logger.warning("前回売却できずに終了しています。")
+        self.ledger = Ledger.from_lines(columns=self.COLUMNS, lines=closed_lines)
 
-        self.f = open(file=self.file_name, newline='', mode='w')
-        self.writer = csv.writer(self.f)
+        # 書き込み途中の行があるか、売却済みで不要になった売却中の行が必要な行の半分以上になったら詰め直す
+        # （取引ごとに売却中・売却済みの2行を追記するので、不要な行は売却済みの行数を超えない。
+        # 詰め直すのは前回詰め直した時点から行数が倍になるごとなので、取引1回あたりの処理は定数）
+        stale_count = len(lines) - len(closed_lines) - (1 if self.monitoring_line else 0)
+        if is_torn or (stale_count and stale_count * 2 >= len(closed_lines)):
+            self.compact()
+
+        self.open()
 
     def __del__(self):
-        self.writer.writerows(self.lines)
-        if self.monitoring_line:
-            self.writer.writerow(self.monitoring_line)
-        self.f.close()
+        if self.f:
+            self.f.close()
+
+    def open(self):
+        self.f = open(file=self.file_name, newline='', mode='a')
+        self.writer = csv.writer(self.f)
+
+    def append(self, line: list):
+        # 1行追記してディスクへの書き込みまで待つ（途中で落ちても追記済みの行は失われない）
+        self.writer.writerow(line)
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+
+    def compact(self):
+        """
+        売却済みの行と売却中の行だけで一時ファイルに書き出してから置き換える（置き換えは不可分）
+        """
+        if self.f:
+            self.f.close()
+        tmp_file_name = self.file_name + '.tmp'
+        with open(file=tmp_file_name, newline='', mode='w') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.header)
+            writer.writerows(self.ledger.lines())
+            if self.monitoring_line:
+                writer.writerow(self.monitoring_line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_name, self.file_name)
+        logger.debug(f'履歴ファイルを詰め直しました: {self.file_name}')
+        if self.f:
+            self.open()
 
     def read_lines(self):
-        if not os.path.exists(self.file_name):
+        if not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0:
             self.create()
 
-        with open(file=self.file_name, mode='r') as f:
-            reader = csv.reader(f)
-            lines = []
-            for i, line in enumerate(reader):
-                if line:
-                    lines.append(line)
-        return lines
+        with open(file=self.file_name, newline='', mode='r') as f:
+            content = f.read()
+        # 改行で終わっていない場合は最後の行が書き込み途中
+        is_torn = not content.endswith('\n')
+        reader = csv.reader(io.StringIO(content))
+        lines = []
+        for i, line in enumerate(reader):
+            if line:
+                lines.append(line)
+        return lines[0], lines[1:], is_torn
 
     def create(self):
         with open(file=self.file_name, mode='w') as f:
@@ -201,7 +255,7 @@ class CSV:
             line = self.generate_new_line()
             for column in self.COLUMNS:
                 col_name, _ = column.value
-                line[self.COLUMNS.index(column)] = col_name
+                line[self.COLUMN_INDEX[column]] = col_name
             writer.writerow(line)
 
     @classmethod
@@ -211,7 +265,7 @@ class CSV:
 
     @classmethod
     def get_column_value(cls, line: list, col: COlUMN):
-        value = line[cls.COLUMNS.index(col)]
+        value = line[cls.COLUMN_INDEX[col]]
         _, col_type = col.value
         return col_type(value)
 
@@ -222,5 +276,213 @@ class CSV:
         else:
             line = cls.generate_new_line()
         for col, value in cols.items():
-            line[cls.COLUMNS.index(col)] = value
+            line[cls.COLUMN_INDEX[col]] = value
         return line
+
+
+class BIN:
+    """
+    固定長バイナリ形式の履歴ファイル（列は CSV と同じ）
+    ヘッダ: 識別子・版数・レコード長・売却中フラグ・売却中の行（1レコード分）
+    本体: 売却済みの行を1レコードずつ追記（起動時は np.memmap で開くだけで、文字列の変換をしない）
+    """
+    EXT = '.bin'
+    MAGIC = b'BBLEDGER'
+    VERSION = 2
+    # 版1は数量を小数（'<f8'）で保持していた（開いた時に版2に変換する）
+    FLOAT_VOLUME_VERSION = 1
+
+    # 列の型ごとのレコード上の型（文字列の列は状態コード）
+    STATUS_CODES = {status: i for i, status in enumerate(CSV.STATUSES)}
+    RECORD_DTYPE = np.dtype([
+        (col.value[0], {int: '<i8', Volume: '<i8', float: '<f8', str: 'u1'}[col.value[1]]) for col in CSV.COLUMNS
+    ])
+    HEADER_DTYPE = np.dtype([
+        ('MAGIC', 'S8'),
+        ('VERSION', '<u4'),
+        ('RECORD_SIZE', '<u4'),
+        ('HAS_MONITORING', '<u8'),
+        ('MONITORING_LINE', RECORD_DTYPE),
+    ])
+    HAS_MONITORING_OFFSET = HEADER_DTYPE.fields['HAS_MONITORING'][1]
+    MONITORING_LINE_OFFSET = HEADER_DTYPE.fields['MONITORING_LINE'][1]
+
+    def __init__(self, file_name: str = 'record.bin', fsync: bool = True):
+        """
+        :param file_name: ファイル名
+        :param fsync: 追記のたびにディスクへの書き込みを待つかどうか
+        """
+        self.file_name = file_name
+        self.fsync = fsync
+        self.f = None
+        if not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0:
+            self.create()
+
+        header = np.fromfile(self.file_name, dtype=self.HEADER_DTYPE, count=1)
+        version = header['VERSION'][0] if len(header) else None
+        if len(header) == 0 or header['MAGIC'][0] != self.MAGIC \
+                or version not in (self.VERSION, self.FLOAT_VOLUME_VERSION) \
+                or header['RECORD_SIZE'][0] != self.RECORD_DTYPE.itemsize:
+            raise ValueError(f'履歴ファイルの形式が違います: {self.file_name}')
+
+        # 書き込み途中のレコードがあれば切り捨て
+        body_size = os.path.getsize(self.file_name) - self.HEADER_DTYPE.itemsize
+        self.count = body_size // self.RECORD_DTYPE.itemsize
+        if body_size % self.RECORD_DTYPE.itemsize:
+            logger.warning(f"書き込み途中で終了したレコードを切り捨てます: {self.file_name}")
+            os.truncate(self.file_name, self.HEADER_DTYPE.itemsize + self.count * self.RECORD_DTYPE.itemsize)
+
+        # 売却済みの行は memmap のまま列ごとのビューにする（文字列の状態列だけ変換）
+        if self.count:
+            records = np.memmap(self.file_name, dtype=self.RECORD_DTYPE, mode='r',
+                                offset=self.HEADER_DTYPE.itemsize, shape=(self.count,))
+        else:
+            records = np.empty(0, dtype=self.RECORD_DTYPE)
+        arrays = {col: records[col.value[0]] for col in CSV.COLUMNS}
+        arrays[CSV.COlUMN.STATUS] = np.array(CSV.STATUSES, dtype=object)[records[CSV.COlUMN.STATUS.value[0]]]
+        monitoring_record = header['MONITORING_LINE'][0]
+        if version == self.FLOAT_VOLUME_VERSION:
+            # 変換後に同じファイルを置き換えるので、memmap のビューを残さないようにメモリ上にコピーして閉じる
+            # （Windows では memmap で開いたままのファイルは置き換えられない）
+            arrays = {col: np.array(array) for col, array in arrays.items()}
+            arrays[CSV.COlUMN.VOLUME] = self.to_volume_units(records[CSV.COlUMN.VOLUME.value[0]])
+            del records
+            monitoring_record = monitoring_record.copy()
+            monitoring_record[CSV.COlUMN.VOLUME.value[0]] = self.to_volume_units(
+                monitoring_record[CSV.COlUMN.VOLUME.value[0]])
+        self.ledger = Ledger.from_arrays(columns=CSV.COLUMNS, arrays=arrays, size=self.count)
+
+        # 前回処理途中だった場合の考慮
+        self.monitoring_line = ''
+        if header['HAS_MONITORING'][0]:
+            line = self.to_line(monitoring_record)
+            # 売却済みのレコードを追記してからフラグを下ろす前に終了していた場合は売却済み
+            if self.count and self.ledger.column(CSV.COlUMN.BUY_AT)[-1] == \
+                    CSV.get_column_value(line=line, col=CSV.COlUMN.BUY_AT):
+                self.write_at(self.HAS_MONITORING_OFFSET, np.uint64(0).tobytes())
+            else:
+                self.monitoring_line = line
+                logger.warning("前回売却できずに終了しています。")
+
+        if version == self.FLOAT_VOLUME_VERSION:
+            self.compact()
+            logger.info(f'履歴ファイルを版{self.VERSION}に変換しました: {self.file_name}')
+
+        self.open()
+
+    def __del__(self):
+        if self.f:
+            self.f.close()
+
+    def open(self):
+        self.f = open(file=self.file_name, mode='r+b')
+
+    def create(self):
+        header = np.zeros(1, dtype=self.HEADER_DTYPE)
+        header['MAGIC'] = self.MAGIC
+        header['VERSION'] = self.VERSION
+        header['RECORD_SIZE'] = self.RECORD_DTYPE.itemsize
+        with open(file=self.file_name, mode='wb') as f:
+            f.write(header.tobytes())
+
+    def append(self, line: list):
+        """
+        売却中の行はヘッダに上書きしてフラグを立て、売却済みの行は末尾に追記してからフラグを下ろす
+        """
+        record = self.to_record(line)
+        if CSV.get_column_value(line=line, col=CSV.COlUMN.STATUS) == CSV.STATUS.MONITORING.value:
+            self.write_at(self.MONITORING_LINE_OFFSET, record.tobytes())
+            self.write_at(self.HAS_MONITORING_OFFSET, np.uint64(1).tobytes())
+        else:
+            self.write_at(self.HEADER_DTYPE.itemsize + self.count * self.RECORD_DTYPE.itemsize, record.tobytes())
+            self.count += 1
+            self.write_at(self.HAS_MONITORING_OFFSET, np.uint64(0).tobytes())
+
+    def write_at(self, offset: int, data: bytes):
+        f = self.f or open(file=self.file_name, mode='r+b')
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        if f is not self.f:
+            f.close()
+
+    def compact(self):
+        """
+        メモリ上の履歴から一時ファイルに書き出してから置き換える（置き換えは不可分）
+        """
+        if self.f:
+            self.f.close()
+        header = np.zeros(1, dtype=self.HEADER_DTYPE)
+        header['MAGIC'] = self.MAGIC
+        header['VERSION'] = self.VERSION
+        header['RECORD_SIZE'] = self.RECORD_DTYPE.itemsize
+        if self.monitoring_line:
+            header['HAS_MONITORING'] = 1
+            header['MONITORING_LINE'] = self.to_record(self.monitoring_line)
+        records = np.empty(len(self.ledger), dtype=self.RECORD_DTYPE)
+        for col in CSV.COLUMNS:
+            if col == CSV.COlUMN.STATUS:
+                records[col.value[0]] = np.fromiter((self.STATUS_CODES[status] for status in self.ledger.column(col)),
+                                                    dtype=np.uint8, count=len(self.ledger))
+            else:
+                records[col.value[0]] = self.ledger.column(col)
+
+        tmp_file_name = self.file_name + '.tmp'
+        with open(file=tmp_file_name, mode='wb') as f:
+            f.write(header.tobytes())
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_name, self.file_name)
+        self.count = len(self.ledger)
+        if self.f:
+            self.open()
+
+    @staticmethod
+    def to_volume_units(volumes) -> np.ndarray:
+        # 版1の小数の数量（'<f8' として読み直す）を 1e-8 BTC 単位の整数にする
+        volumes = np.asarray(volumes).view('<f8')
+        return np.round(volumes * VOLUME_SCALE).astype(np.int64)
+
+    def to_record(self, line: list) -> np.ndarray:
+        record = np.zeros(1, dtype=self.RECORD_DTYPE)
+        for col in CSV.COLUMNS:
+            value = line[CSV.COLUMN_INDEX[col]]
+            if col == CSV.COlUMN.STATUS:
+                record[col.value[0]] = self.STATUS_CODES[value]
+            else:
+                record[col.value[0]] = self.ledger.parse(col, value)
+        return record
+
+    def to_line(self, record) -> list:
+        line = CSV.generate_new_line()
+        for col in CSV.COLUMNS:
+            value = record[col.value[0]]
+            if col == CSV.COlUMN.STATUS:
+                line[CSV.COLUMN_INDEX[col]] = CSV.STATUSES[value]
+            elif not (col.value[1] is float and np.isnan(value)):
+                line[CSV.COLUMN_INDEX[col]] = col.value[1](value)
+        return line
+
+
+def open_record_file(file_name: str, fsync: bool = True):
+    # 拡張子でファイル形式を判定
+    if file_name.endswith(BIN.EXT):
+        return BIN(file_name=file_name, fsync=fsync)
+    return CSV(file_name=file_name, fsync=fsync)
+
+
+def convert(src_file_name: str, dst_file_name: str):
+    """
+    履歴ファイルを csv ⇔ バイナリ で変換する（形式は拡張子で判定）
+    """
+    if os.path.exists(dst_file_name):
+        raise FileExistsError(dst_file_name)
+    src = open_record_file(src_file_name)
+    dst = open_record_file(dst_file_name)
+    dst.ledger = src.ledger
+    dst.monitoring_line = src.monitoring_line
+    dst.compact()
+    logger.info(f'変換しました: {src_file_name} -> {dst_file_name}  {len(dst.ledger)}件')
@@ -0,0 +1,86 @@
+from functools import lru_cache
+
+import numpy as np
+
+# 黄金比（黄金分割探索用）
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+
+def expected_log_growth(win_rate, change_rate, price_rate=1.0, cost_rate=0):
+    """
+    1回の取引あたりの資産の対数成長率の期待値（ケリー基準の目的関数）
+    引数はすべて NumPy 配列でも可（ブロードキャストして計算）
+    :param win_rate: 勝率
+    :param change_rate: 利確・損切の増減率（勝ち負け同じ）
+    :param price_rate: 資産に対する投資金割合
+    :param cost_rate: 手数料割合
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        up = np.log(1 + price_rate * (change_rate - cost_rate))
+        down = np.log(np.maximum(1 - price_rate * (change_rate + cost_rate), 0))
+    return win_rate * up + (1 - win_rate) * down
+
+
+def search_best_risk(win_rates, cost_rate: float = 0, iterations: int = 64):
+    """
+    勝率ごとに対数成長率の期待値が最大になる増減率を探す（黄金分割探索、全勝率をまとめて配列で計算）
+    取引は資産の全額で行う（投資金割合1）。1回の取引の式では投資金割合と増減率は積でしか効かず、
+    手数料だけが投資金割合に比例して増えるため、投資金割合は候補に加えても最小のものが選ばれるだけで探索しない
+    目的関数は1回の取引の式（expected_log_growth）だけで、シミュレーション（simuration.simulate_assets）にある
+    最低購入価格での退場・元本回収ラインでの終了、資産の1円未満切り捨ては考慮しない（資産が十分大きい場合の近似）
+    それらを含めた評価は simuration.solve_assets / simulate_assets で候補ごとに確認すること
+    :param win_rates: 勝率の配列
+    :param cost_rate: 手数料割合
+    :param iterations: 黄金分割探索の回数（1回ごとに探索範囲が約0.618倍になる）
+    :return: 勝率ごとの 最適な増減率、その時の対数成長率
+    """
+    win_rates = np.asarray(win_rates, dtype=np.float64)
+
+    # 増減率の探索範囲（負けても資産が0にならない範囲）
+    lower = np.zeros(win_rates.shape)
+    upper = np.full(win_rates.shape, max(1 - 1e-9 - cost_rate, 0))
+
+    # 黄金分割探索（対数成長率は増減率に対して上に凸）
+    left = upper - GOLDEN_RATIO * (upper - lower)
+    right = lower + GOLDEN_RATIO * (upper - lower)
+    left_growth = expected_log_growth(win_rates, left, cost_rate=cost_rate)
+    right_growth = expected_log_growth(win_rates, right, cost_rate=cost_rate)
+    for _ in range(iterations):
+        move_right = left_growth < right_growth
+        lower = np.where(move_right, left, lower)
+        upper = np.where(move_right, upper, right)
+        left, right = (np.where(move_right, right, upper - GOLDEN_RATIO * (upper - lower)),
+                       np.where(move_right, lower + GOLDEN_RATIO * (upper - lower), left))
+        left_growth, right_growth = (
+            np.where(move_right, right_growth, expected_log_growth(win_rates, left, cost_rate=cost_rate)),
+            np.where(move_right, expected_log_growth(win_rates, right, cost_rate=cost_rate), left_growth))
+    change_rates = (lower + upper) / 2
+    growths = expected_log_growth(win_rates, change_rates, cost_rate=cost_rate)
+
+    # 成長しない場合は取引しない（増減率0）
+    return np.where(growths > 0, change_rates, 0), np.maximum(growths, 0)
+
+
+class RiskTable:
+    """
+    勝率ごとの最適な増減率の早見表（取引中は計算せずに引くだけ）
+    """
+
+    def __init__(self, cost_rate: float = 0, min_win_rate: float = 0.5, step: float = 0.0001):
+        self.cost_rate = cost_rate
+        self.min_win_rate = min_win_rate
+        self.step = step
+        self.win_rates = min_win_rate + step * np.arange(int(round((1 - min_win_rate) / step)) + 1)
+        self.change_rates, self.growths = search_best_risk(win_rates=self.win_rates, cost_rate=cost_rate)
+
+    def get(self, win_rate: float) -> float:
+        """
+        :return: 最適な増減率（前後の格子点の間を線形補間）
+        """
+        return float(np.interp(win_rate, self.win_rates, self.change_rates))
+
+
+@lru_cache(maxsize=None)
+def get_risk_table(cost_rate: float = 0) -> RiskTable:
+    # 手数料割合ごとに1度だけ作成
+    return RiskTable(cost_rate=cost_rate)
@@ -0,0 +1,86 @@
+import numpy as np
+
+from bitbank.const import PAIR
+from bitbank.tick import TABLE, load_ticks
+
+
+def weighted_means(prices: np.ndarray, volumes: np.ndarray, sizes=(3,)) -> np.ndarray:
+    """
+    板ごとの上位 size 件の数量加重平均価格（OrderBook.mean と同じ値）をまとめて計算
+    :param prices: 価格（板数×件数。件数に満たない板は数量0で埋める）
+    :param volumes: 数量（板数×件数）
+    :param sizes: 板の件数の候補
+    :return: 件数の候補数×板数（板が空なら NaN）
+    """
+    prices = np.asarray(prices)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    cum_volumes = np.cumsum(volumes, axis=1)
+    cum_amounts = np.cumsum(prices * volumes, axis=1)
+    # 件数に満たない板は、ある分だけで平均する（OrderBook.mean と同じ）
+    depths = np.count_nonzero(volumes, axis=1)
+    indexes = np.minimum(np.asarray(sizes)[:, np.newaxis], depths[np.newaxis, :]) - 1
+    rows = np.arange(len(prices))[np.newaxis, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.rint(cum_amounts[rows, indexes] / cum_volumes[rows, indexes])
+    return np.where(indexes >= 0, means, np.nan)
+
+
+def spread_rates(ask_prices: np.ndarray, ask_volumes: np.ndarray, bid_prices: np.ndarray, bid_volumes: np.ndarray,
+                 sizes=(3,)) -> np.ndarray:
+    """
+    板ごとの売り板の加重平均価格に対する売り買いの差の割合（OrderBook.spread_rate と同じ値）
+    :return: 件数の候補数×板数
+    """
+    ask_means = weighted_means(ask_prices, ask_volumes, sizes=sizes)
+    bid_means = weighted_means(bid_prices, bid_volumes, sizes=sizes)
+    return (ask_means - bid_means) / ask_means
+
+
+def judge_rules(rates: np.ndarray, limits=(0.0005,)):
+    """
+    板ごとの購入条件（Trade.within_diff_rate / without_diff_rate）をまとめて判定
+    :param rates: spread_rates の戻り値（件数の候補数×板数）
+    :param limits: 価格差の割合の候補
+    :return: within, without（件数の候補数×割合の候補数×板数 の真偽値）
+    """
+    rates = np.asarray(rates)[:, np.newaxis, :]
+    limits = np.asarray(limits)[np.newaxis, :, np.newaxis]
+    return rates <= limits, rates >= limits
+
+
+def response_curve(rates: np.ndarray, limits) -> tuple:
+    """
+    価格差の割合ごとに購入条件を満たす板の割合（判定結果の配列を作らずに、並べ替えと二分探索で求める）
+    :param rates: spread_rates の戻り値（件数の候補数×板数）
+    :param limits: 価格差の割合の候補（多数でも可）
+    :return: within, without（件数の候補数×割合の候補数）
+    """
+    rates = np.sort(np.asarray(rates), axis=1)
+    limits = np.asarray(limits)
+    within = np.empty((len(rates), len(limits)))
+    without = np.empty((len(rates), len(limits)))
+    for i, sorted_rates in enumerate(rates):
+        # 空の板（NaN）は並べ替えで末尾に集まるので数えない
+        size = np.count_nonzero(~np.isnan(sorted_rates))
+        sorted_rates = sorted_rates[:size]
+        within[i] = np.searchsorted(sorted_rates, limits, side='right') / max(size, 1)
+        without[i] = (size - np.searchsorted(sorted_rates, limits, side='left')) / max(size, 1)
+    return within, without
+
+
+def evaluate_ticks(pair: PAIR, days: list, sizes=(3,), limits=(0.0005,), root: str = 'ticks',
+                   chunk_size: int = 1000000):
+    """
+    記録した板（bitbank.tick）の価格差の割合と、価格差の割合ごとの購入条件を満たす板の割合
+    :param chunk_size: 一度に計算する板数（np.memmap から少しずつ読み込み、累積和の作業領域を抑える）
+    :return: 価格差の割合（件数の候補数×板数）、within, without（件数の候補数×割合の候補数）
+    """
+    depth = load_ticks(pair=pair, days=days, root=root)[TABLE.DEPTH]
+    rates = np.concatenate([
+        spread_rates(depth['ask_price'][start:start + chunk_size], depth['ask_volume'][start:start + chunk_size],
+                     depth['bid_price'][start:start + chunk_size], depth['bid_volume'][start:start + chunk_size],
+                     sizes=sizes)
+        for start in range(0, len(depth['time']), chunk_size)
+    ] or [np.empty((len(sizes), 0))], axis=1)
+    within, without = response_curve(rates, limits=limits)
+    return rates, within, without
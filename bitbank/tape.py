@@ -0,0 +1,159 @@
+import threading
+from collections import deque
+
+from bitbank import config
+from bitbank.const import DIRECTION, ORDER, PAIR
+from bitbank.fixed import Volume, to_volume
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+
+class TapeWatch:
+    """
+    指定価格以上（UP）・以下（DOWN）で成立した約定の数量を、新しい約定が届くたびに加算する
+    数量が volume に達したら完了（volume が0なら価格到達の監視）
+    """
+
+    def __init__(self, direction: DIRECTION, price: int, volume: Volume = Volume(0), since: int = None, callback=None):
+        """
+        :param direction: UP なら price 以上、DOWN なら price 以下の約定を数える
+        :param price: 価格
+        :param volume: 完了とする数量（Volume。小数・文字列は BTC の数量）
+        :param since: この時刻（ミリ秒）より後の約定のみ数える
+        :param callback: 完了時に呼ばれる関数（引数は TapeWatch）
+        """
+        self.direction = direction
+        self.price = int(price)
+        self.volume = to_volume(volume)
+        self.since = since
+        self.callback = callback
+        # 条件に合う約定の数量の累計（小数で足すと 0.7 + 0.1 < 0.8 になるので 1e-8 BTC 単位の整数で足す）
+        self.filled_volume = Volume(0)
+        self.transaction = None  # 完了させた約定
+        self.event = threading.Event()
+
+    @classmethod
+    def for_order(cls, order: ORDER, price, volume: Volume, since: int = None, callback=None):
+        # 買い注文は指値以下、売り注文は指値以上の約定で成立
+        direction = DIRECTION.DOWN if order == ORDER.BUY else DIRECTION.UP
+        return cls(direction=direction, price=price, volume=volume, since=since, callback=callback)
+
+    @property
+    def is_done(self) -> bool:
+        return self.event.is_set()
+
+    def update(self, transaction: dict) -> bool:
+        """
+        :return: この約定で完了したか
+        """
+        if self.is_done or (self.since is not None and transaction['executed_at'] <= self.since):
+            return False
+        price = int(transaction['price'])
+        if (self.direction == DIRECTION.UP and price >= self.price) or (
+                self.direction == DIRECTION.DOWN and price <= self.price):
+            self.filled_volume = Volume(self.filled_volume + to_volume(transaction['amount']))
+            if self.filled_volume >= self.volume:
+                self.transaction = transaction
+                self.event.set()
+                return True
+        return False
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.event.wait(timeout=timeout)
+
+
+class TradeTape:
+    """
+    通貨ペアごとの約定履歴（最後に取り込んだ約定以降の新しい約定だけを処理する）
+    監視（TapeWatch）には新しい約定だけを渡すので、確認は新しい約定の件数分で済む
+    """
+
+    def __init__(self, pair: PAIR, size: int = 1000):
+        """
+        :param size: 保持する直近の約定数（監視を登録した時点で既に届いていた約定の確認用）
+        """
+        self.pair = pair
+        self.transactions = deque(maxlen=size)  # 古い順
+        self.last_id = None
+        self.last_executed_at = None
+        self.watches = []
+        self.lock = threading.Lock()
+
+    def add(self, transactions: list, is_snapshot: bool = False) -> list:
+        """
+        API・配信の約定リストから新しい約定だけを取り込み、監視に渡す
+        :param is_snapshot: 直近の約定の一覧（API）か（配信は新しい約定のみ届く）
+        :return: 新しい約定（古い順）
+        """
+        done_watches = []
+        with self.lock:
+            transactions = sorted(transactions, key=lambda t: t['transaction_id'])
+            # 取得済みの約定は除く（ポーリングでは同じ約定が何度も届く）
+            if self.last_id is not None:
+                new_transactions = [t for t in transactions if t['transaction_id'] > self.last_id]
+                # 一覧に前回の最後の約定が含まれていなければ、間の約定を取りこぼしている可能性がある
+                if is_snapshot and transactions and len(new_transactions) == len(transactions):
+                    logger.warning(f'約定の取りこぼしの可能性: {self.pair.value} {self.last_id} → '
+                                   f'{transactions[0]["transaction_id"]}')
+            else:
+                new_transactions = transactions
+            if not new_transactions:
+                return []
+            self.transactions.extend(new_transactions)
+            self.last_id = new_transactions[-1]['transaction_id']
+            self.last_executed_at = new_transactions[-1]['executed_at']
+            for watch in self.watches:
+                for transaction in new_transactions:
+                    if watch.update(transaction):
+                        done_watches.append(watch)
+                        break
+            if done_watches:
+                self.watches = [watch for watch in self.watches if not watch.is_done]
+        # 完了の通知はロックの外で行う（通知先から監視を登録できるように）
+        for watch in done_watches:
+            if watch.callback:
+                watch.callback(watch)
+        return new_transactions
+
+    def watch(self, watch: TapeWatch) -> TapeWatch:
+        """
+        監視を登録する（保持している約定のうち since より後のものは登録時に数える）
+        """
+        with self.lock:
+            # 新しい方から since より後の約定だけを集めて、古い順に数える
+            recent = []
+            for transaction in reversed(self.transactions):
+                if watch.since is not None and transaction['executed_at'] <= watch.since:
+                    break
+                recent.append(transaction)
+            for transaction in reversed(recent):
+                if watch.update(transaction):
+                    break
+            if not watch.is_done:
+                self.watches.append(watch)
+        if watch.is_done and watch.callback:
+            watch.callback(watch)
+        return watch
+
+    def unwatch(self, watch: TapeWatch):
+        with self.lock:
+            if watch in self.watches:
+                self.watches.remove(watch)
+
+    def get_transactions(self) -> list:
+        with self.lock:
+            return list(self.transactions)
+
+    def get_new_transactions(self, last_id: int = None) -> list:
+        """
+        last_id より新しい約定（古い順。新しい方から辿るので新しい件数分で済む）
+        """
+        transactions = []
+        with self.lock:
+            for transaction in reversed(self.transactions):
+                if last_id is not None and transaction['transaction_id'] <= last_id:
+                    break
+                transactions.append(transaction)
+        transactions.reverse()
+        return transactions
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from bitbank import config
+from bitbank.const import PAIR
+from bitbank.market import MarketData, MESSAGE, get_market_data
+from bitbank.orderbook import SIDE
+from cmn.log import get_logger
+
+logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
+
+# 板の記録件数（これより少ない板は数量0で埋める）
+LEVELS = 20
+
+
+class TABLE:
+    # テーブル名 → {列名: (型, 1行あたりの要素数)}（要素数が None なら板の記録件数）
+    DEPTH = 'depth'
+    TRANSACTIONS = 'transactions'
+    COLUMNS = {
+        DEPTH: {
+            'time': (np.int64, 1),
+            'ask_price': (np.int64, None),
+            'ask_volume': (np.float64, None),
+            'bid_price': (np.int64, None),
+            'bid_volume': (np.float64, None),
+        },
+        TRANSACTIONS: {
+            'transaction_id': (np.int64, 1),
+            'executed_at': (np.int64, 1),
+            'price': (np.int64, 1),
+            'amount': (np.float64, 1),
+            'side': (np.int8, 1),  # 1: buy, -1: sell
+        },
+    }
+
+
+def get_day_dir(root: str, pair: PAIR, day: str) -> str:
+    return os.path.join(root, pair.value, day)
+
+
+def to_day(time_millisecond: int) -> str:
+    return datetime.fromtimestamp(time_millisecond / 1000).strftime('%Y%m%d')
+
+
+class TickTable:
+    """
+    1テーブルを列ごとの生のバイナリファイル（{テーブル名}.{列名}）に追記する
+    行はまとめて追記し、読み込み時は全列がそろっている行までを使う（書き込み途中で終了しても壊れない）
+    """
+
+    def __init__(self, dir_name: str, table: str, levels: int = LEVELS, flush_size: int = 1000,
+                 fsync: bool = False):
+        self.dir_name = dir_name
+        self.table = table
+        self.levels = levels
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.columns = TABLE.COLUMNS[table]
+        self.buffers = {col: [] for col in self.columns}
+        self.size = 0  # 未書き込みの行数
+        os.makedirs(dir_name, exist_ok=True)
+        write_meta(dir_name=dir_name, levels=levels)
+
+    def get_file_name(self, col: str) -> str:
+        return os.path.join(self.dir_name, f'{self.table}.{col}')
+
+    def append(self, row: dict):
+        for col, buffer in self.buffers.items():
+            buffer.append(row[col])
+        self.size += 1
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.size == 0:
+            return
+        for col, buffer in self.buffers.items():
+            dtype, width = self.columns[col]
+            with open(file=self.get_file_name(col), mode='ab') as f:
+                f.write(np.asarray(buffer, dtype=dtype).tobytes())
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        self.buffers = {col: [] for col in self.columns}
+        self.size = 0
+
+
+def write_meta(dir_name: str, levels: int):
+    file_name = os.path.join(dir_name, 'meta.json')
+    if not os.path.exists(file_name):
+        with open(file=file_name, mode='w') as f:
+            json.dump({'levels': levels}, f)
+
+
+def read_table(dir_name: str, table: str) -> dict:
+    """
+    列ごとの配列（np.memmap。全列がそろっている行まで）
+    """
+    with open(file=os.path.join(dir_name, 'meta.json'), mode='r') as f:
+        levels = json.load(f)['levels']
+    columns = TABLE.COLUMNS[table]
+    widths = {col: width or levels for col, (dtype, width) in columns.items()}
+    sizes = {}
+    for col, (dtype, width) in columns.items():
+        file_name = os.path.join(dir_name, f'{table}.{col}')
+        file_size = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+        sizes[col] = file_size // (np.dtype(dtype).itemsize * widths[col])
+    size = min(sizes.values())
+    arrays = {}
+    for col, (dtype, width) in columns.items():
+        if size == 0:
+            arrays[col] = np.empty((0, widths[col]) if widths[col] > 1 else 0, dtype=dtype)
+            continue
+        array = np.memmap(os.path.join(dir_name, f'{table}.{col}'), dtype=dtype, mode='r',
+                          shape=(size * widths[col],))
+        arrays[col] = array.reshape(size, widths[col]) if widths[col] > 1 else array
+    return arrays
+
+
+def load_ticks(pair: PAIR, days: list, root: str = 'ticks') -> dict:
+    """
+    指定日の記録を読み込んで日をまたいでつなげる
+    :return: テーブル名 → 列ごとの配列
+    """
+    ticks = {}
+    for table in (TABLE.DEPTH, TABLE.TRANSACTIONS):
+        parts = [read_table(dir_name=get_day_dir(root, pair, day), table=table) for day in days]
+        ticks[table] = {col: np.concatenate([part[col] for part in parts]) if len(parts) > 1 else parts[0][col]
+                        for col in TABLE.COLUMNS[table]}
+    return ticks
+
+
+class TickRecorder:
+    """
+    MarketData の更新を購読して、板と約定を通貨ペア・日ごとに記録する
+    """
+
+    def __init__(self, market: MarketData, root: str = 'ticks', levels: int = LEVELS, flush_size: int = 1000):
+        self.market = market
+        self.root = root
+        self.levels = levels
+        self.flush_size = flush_size
+        self.day = None
+        self.tables = {}
+        self.last_transaction_id = None
+        self.lock = threading.Lock()  # 受信スレッドの追記と定期的な書き出しの排他
+        market.subscribe(self.on_update)
+
+    def get_tables(self, time_millisecond: int) -> dict:
+        # 日付が変わったら新しいディレクトリに記録
+        day = to_day(time_millisecond)
+        if day != self.day:
+            self.flush_tables()
+            dir_name = get_day_dir(self.root, self.market.pair, day)
+            self.tables = {table: TickTable(dir_name=dir_name, table=table, levels=self.levels,
+                                            flush_size=self.flush_size) for table in TABLE.COLUMNS}
+            self.day = day
+        return self.tables
+
+    def on_update(self, message_type: str, market: MarketData):
+        with self.lock:
+            if message_type in (MESSAGE.DEPTH, MESSAGE.DEPTH_DIFF):
+                self.record_book(market)
+            elif message_type == MESSAGE.TRANSACTIONS:
+                self.record_transactions(market)
+
+    def record_book(self, market: MarketData):
+        book = market.book
+        row = {'time': round(time.time() * 1000)}
+        for side, key in ((SIDE.ASK, 'ask'), (SIDE.BID, 'bid')):
+            prices = np.zeros(self.levels, dtype=np.int64)
+            volumes = np.zeros(self.levels, dtype=np.float64)
+            size = min(book.depth(side), self.levels)
+            prices[:size] = book.prices[side][:size]
+            volumes[:size] = book.volumes[side][:size]
+            row[f'{key}_price'] = prices
+            row[f'{key}_volume'] = volumes
+        self.get_tables(row['time'])[TABLE.DEPTH].append(row)
+
+    def record_transactions(self, market: MarketData):
+        # 前回記録した約定より新しいものだけを記録
+        for transaction in market.tape.get_new_transactions(last_id=self.last_transaction_id):
+            self.get_tables(transaction['executed_at'])[TABLE.TRANSACTIONS].append({
+                'transaction_id': transaction['transaction_id'],
+                'executed_at': transaction['executed_at'],
+                'price': int(transaction['price']),
+                'amount': float(transaction['amount']),
+                'side': 1 if transaction['side'] == 'buy' else -1,
+            })
+            self.last_transaction_id = transaction['transaction_id']
+
+    def flush(self):
+        with self.lock:
+            self.flush_tables()
+
+    def flush_tables(self):
+        for table in self.tables.values():
+            table.flush()
+
+
+def main(pairs: list = None, interval: int = 60):
+    # 通貨ペアごとの板・約定を記録し続ける（interval 秒ごとにファイルへ書き出す）
+    recorders = [TickRecorder(market=get_market_data(pair)) for pair in pairs or list(PAIR)]
+    logger.info(f'【記録開始】 {", ".join(recorder.market.pair.value for recorder in recorders)}')
+    try:
+        while True:
+            time.sleep(interval)
+            for recorder in recorders:
+                recorder.flush()
+    finally:
+        for recorder in recorders:
+            recorder.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,60 @@
 import time
 
 import numpy as np
-import python_bitbankcc
 
-from bitbank import config
+from bitbank import config, metrics
 from bitbank.const import PAIR, ORDER, RATE, INTERVAL, CHANGERATE, TRADERULE, TRYNUM
+from bitbank.fixed import Volume, amount, volume_for
+from bitbank.market import MarketData, get_market_data
+from bitbank.orderbook import OrderBook, SIDE
+from bitbank.paper import PaperExchange
 from bitbank.record import Record, CSV
+from bitbank.risk import get_risk_table
+from bitbank.tape import TapeWatch
 from cmn.log import get_logger
 
 logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
-pub = python_bitbankcc.public()
 
 
 class Trade:
 
-    def __init__(self, pair: PAIR, rule: TRADERULE, is_rial: bool = False):
+    def __init__(self, pair: PAIR, rule: TRADERULE, is_rial: bool = False, market: MarketData = None,
+                 exchange: PaperExchange = None, file_name: str = None, record: Record = None,
+                 limit: float = 0.0005, size: int = 3, change_rate: float = CHANGERATE.MIN.value,
+                 wait: int = INTERVAL.LONG.value * 3):
+        """
+        :param market: 板・約定（未指定なら通貨ペアごとに共有する配信）
+        :param exchange: 模擬取引所（指定すると注文は模擬取引所で約定し、時刻はメッセージの時刻で進む）
+        :param file_name: 取引履歴のファイル名（未指定なら取引ルール・通貨ペアから決める）
+        :param record: 取引履歴（指定した場合は file_name は使わない）
+        :param limit: 購入条件の売り板と買い板の価格差の割合
+        :param size: 購入条件の価格差を求める板の件数
+        :param change_rate: 利確・損切の増減率
+        :param wait: 指値注文の約定を待つ秒数
+        """
         self.pair = pair
         self.rule = rule
         self.is_rial = is_rial
+        self.limit = limit
+        self.size = size
+        self.change_rate = change_rate
+        self.wait = wait
+        # 板・約定は配信で更新されるものを参照する（未指定なら通貨ペアごとに共有）
+        self.market = market or get_market_data(pair)
+        self.exchange = exchange
+        # 現在時刻の取得元（模擬取引所ではメッセージの時刻）
+        self.clock = exchange.clock if exchange else time
+        # 処理時間の計測用（bitbank.metrics）
+        self.decided_at = None  # 購入・売却判定が成立した時刻（time.perf_counter）
+        self.ordered_at = None  # 注文した時刻（self.clock）
 
-        if is_rial:
-            file_name = f'【{rule.value}】{self.pair.value}.csv'
-        else:
-            file_name = f'【{rule.value}】{self.pair.value}（simul）.csv'
+        if file_name is None:
+            if is_rial:
+                file_name = f'【{rule.value}】{self.pair.value}{config.RECORD_EXT}'
+            else:
+                file_name = f'【{rule.value}】{self.pair.value}（simul）{config.RECORD_EXT}'
 
-        self.record = Record(file_name=file_name)
+        self.record = record or Record(file_name=file_name)
 
         # TODO: 現在の資産取得
         if self.is_rial:
@@ -34,55 +64,120 @@ class Trade:
             if self.record.csv.monitoring_line:
                 assets = CSV.get_column_value(line=self.record.csv.monitoring_line, col=CSV.COlUMN.ASSETS)
             # 初回実行の場合
-            elif len(self.record.csv.lines) == 1:
-                assets = config.SIMUL_INIT_ASSETS
+            elif len(self.record.csv.ledger) == 0:
+                assets = int(config.SIMUL_INIT_ASSETS)
             # 売却済みで前回終了していた場合
             else:
-                assets = CSV.get_column_value(line=self.record.csv.lines[-1], col=CSV.COlUMN.ASSETS)
+                assets = CSV.get_column_value(line=self.record.csv.ledger.line(-1), col=CSV.COlUMN.ASSETS)
+        # 資産（円）・価格（円）は整数、数量は Volume（1e-8 BTC 単位の整数）で扱う
         self.assets = assets
 
     def trade(self):
+        self.run_steps(self.trade_steps())
+
+    async def trade_async(self):
+        # trade と同じ流れを、待っている間はループ上のほかの取引を止めずに実行する
+        # 板を受信するまで待つ（get_book で待つとループごと止まる）
+        while self.market.book is None:
+            await self.market.wait_update_async(timeout=INTERVAL.MIN.value)
+        await self.run_steps_async(self.trade_steps())
+
+    def trade_steps(self):
+        """
+        自動売買の流れ（判定・注文・記録）を進めるジェネレーター
+        板・約定の更新を待つところで待つ秒数を返し、更新があったかどうかを受け取って続きから進める
+        （待ち方は呼び出し側が決める：run_steps / run_steps_async / bitbank.backtest.Backtest）
+        """
+        sell_info = self.start_trade()
+        if sell_info:
+            yield from self.sell_steps(*sell_info)
+        while True:
+            logger.info(f'資産: {self.assets}  勝率: {self.record.get_win_rate()}')
+            yield from self.buy_steps()
+            yield from self.sell_steps(*self.get_sell_info())
+
+    def run_steps(self, steps):
+        """
+        trade_steps などのジェネレーターを、板・約定の更新を待ちながら最後まで進める
+        :return: ジェネレーターの戻り値
+        """
+        version = self.market.version
+        is_updated = None
+        while True:
+            try:
+                timeout = steps.send(is_updated)
+            except StopIteration as e:
+                return e.value
+            latest = self.market.wait_update(version=version, timeout=timeout)
+            is_updated, version = latest > version, latest
+
+    async def run_steps_async(self, steps):
+        """
+        run_steps の asyncio 版
+        """
+        version = self.market.version
+        is_updated = None
+        while True:
+            try:
+                timeout = steps.send(is_updated)
+            except StopIteration as e:
+                return e.value
+            latest = await self.market.wait_update_async(version=version, timeout=timeout)
+            is_updated, version = latest > version, latest
+
+    def start_trade(self):
+        """
+        :return: 前回売却できていない建玉があれば 数量、利確ライン、損切ライン
+        """
         # TODO: 未約定の注文取消し
         if self.is_rial:
             pass
         logger.info("【自動売買開始】")
         if self.record.csv.monitoring_line:
             logger.info("前回売却できていない建玉を売却します。")
-            volume, profit_price, stop_loss_price = self.record.get_sell_info()
-            self.sell(volume=volume, profit_price=profit_price, stop_loss_price=stop_loss_price)
-        while True:
-            logger.info(f'資産: {self.assets}  勝率: {self.record.get_win_rate()}')
-            self.buy()
-            volume, profit_price, stop_loss_price = self.record.get_sell_info()
-            logger.debug(
-                f'利確ライン: {profit_price}  損切ライン： {stop_loss_price}  価格差： {int(profit_price) - int(stop_loss_price)}')
-            self.sell(volume=volume, profit_price=profit_price, stop_loss_price=stop_loss_price)
+            return self.record.get_sell_info()
+        return None
+
+    def get_sell_info(self):
+        volume, profit_price, stop_loss_price = self.record.get_sell_info()
+        logger.debug(
+            f'利確ライン: {profit_price}  損切ライン： {stop_loss_price}  価格差： {profit_price - stop_loss_price}')
+        return volume, profit_price, stop_loss_price
 
     def judge_should_buy(self, rule: TRADERULE):
-        should_buy = False
-        buy_info = None
-
-        if rule == TRADERULE.WITHIN_DIFFRATE:
-            depth = pub.get_depth(self.pair.value)
-            if self.within_diff_rate(depth):
-                change_rate = CHANGERATE.MIN.value
-                price = str(int(depth['bids'][0][0]) + 1)
-                volume = self.generate_volume(price=price)
-                buy_info = [price, volume, change_rate]
-                should_buy = True
-
-        elif rule == TRADERULE.WITHOUT_DIFFRATE:
-            depth = pub.get_depth(self.pair.value)
-            if self.without_diff_rate(depth):
-                change_rate = CHANGERATE.MIN.value
-                price = str(int(depth['bids'][0][0]) + 1)
-                volume = self.generate_volume(price=price)
-                buy_info = [price, volume, change_rate]
-                should_buy = True
+        with metrics.timer('bitbank_signal_seconds', order=ORDER.BUY.value, rule=rule.value):
+            should_buy = False
+            buy_info = None
 
+            if rule == TRADERULE.WITHIN_DIFFRATE:
+                book = self.market.get_book()
+                if self.within_diff_rate(book, limit=self.limit, size=self.size):
+                    change_rate = self.change_rate
+                    price = book.best_bid + 1
+                    volume = self.generate_volume(price=price)
+                    buy_info = [price, volume, change_rate]
+                    should_buy = True
+
+            elif rule == TRADERULE.WITHOUT_DIFFRATE:
+                book = self.market.get_book()
+                if self.without_diff_rate(book, limit=self.limit, size=self.size):
+                    change_rate = self.change_rate
+                    price = book.best_bid + 1
+                    volume = self.generate_volume(price=price)
+                    buy_info = [price, volume, change_rate]
+                    should_buy = True
+
+        if should_buy:
+            self.decided_at = time.perf_counter()
         return should_buy, buy_info
 
     def buy(self, interval: int = INTERVAL.MIN.value):
+        self.run_steps(self.buy_steps(interval=interval))
+
+    async def buy_async(self, interval: int = INTERVAL.MIN.value):
+        await self.run_steps_async(self.buy_steps(interval=interval))
+
+    def buy_steps(self, interval: int = INTERVAL.MIN.value):
         try_count = 0
         while True:
             if try_count > TRYNUM.BUY.value:
@@ -96,75 +191,149 @@ class Trade:
                 logger.debug("購入条件一致！")
                 price, volume, change_rate = buy_info
                 # 購入
-                executed_at = self.limit_order(order=ORDER.BUY, price=price, volume=volume)
+                executed_at = yield from self.limit_order_steps(order=ORDER.BUY, price=price, volume=volume,
+                                                                wait=self.wait)
                 try_count += 1
                 # 成功した場合
                 if executed_at:
-                    self.assets = str(int(self.assets) - round(int(price) * volume))
-                    self.record.buy(price=price,
-                                    volume=volume,
-                                    executed_at=executed_at,
-                                    try_num=try_count,
-                                    change_rate=change_rate,
-                                    assets=self.assets)
-                    logger.debug(f'購入挑戦回数: {try_count}')
+                    self.bought(price=price, volume=volume, change_rate=change_rate, executed_at=executed_at,
+                                try_count=try_count)
                     return
-            time.sleep(interval)
+            # 次の板・約定の更新まで待つ（更新がなくても interval 秒で再判定）
+            with metrics.timer('bitbank_update_wait_seconds'):
+                yield interval
+
+    def bought(self, price: int, volume: Volume, change_rate: float, executed_at: int, try_count: int):
+        self.assets -= amount(price, volume)
+        self.record.buy(price=price,
+                        volume=volume,
+                        executed_at=executed_at,
+                        try_num=try_count,
+                        change_rate=change_rate,
+                        assets=self.assets)
+        logger.debug(f'購入挑戦回数: {try_count}')
 
-    def sell(self, volume: float, profit_price: str, stop_loss_price: str,
+    def judge_should_sell(self, profit_price: int, stop_loss_price: int):
+        with metrics.timer('bitbank_signal_seconds', order=ORDER.SELL.value, rule=self.rule.value):
+            price = None
+
+            book = self.market.get_book()
+            ask_price = book.mean(SIDE.ASK, size=3)
+            bid_price = book.mean(SIDE.BID, size=3)
+            # 利確ラインを超えていたら（板が空の側では判定しない）
+            if ask_price is not None and ask_price > profit_price:
+                logger.debug("利確ライン到達！")
+                price = book.best_ask - 1
+            # 損切りラインを割ったら
+            elif bid_price is not None and bid_price < stop_loss_price:
+                logger.debug("損切ライン到達！")
+                price = book.best_bid + 1
+
+        if price:
+            self.decided_at = time.perf_counter()
+        return price
+
+    def sell(self, volume: Volume, profit_price: int, stop_loss_price: int,
              interval: int = INTERVAL.MIN.value):
+        self.run_steps(self.sell_steps(volume=volume, profit_price=profit_price, stop_loss_price=stop_loss_price,
+                                       interval=interval))
+
+    async def sell_async(self, volume: Volume, profit_price: int, stop_loss_price: int,
+                         interval: int = INTERVAL.MIN.value):
+        await self.run_steps_async(self.sell_steps(volume=volume, profit_price=profit_price,
+                                                   stop_loss_price=stop_loss_price, interval=interval))
+
+    def sell_steps(self, volume: Volume, profit_price: int, stop_loss_price: int,
+                   interval: int = INTERVAL.MIN.value):
         try_count = 0
         while True:
             if try_count > TRYNUM.SELL.value:
                 logger.error(f'売却挑戦回数超過: {try_count} > {TRYNUM.BUY.value}')
                 # raise Exception
             logger.debug("売却条件監視中・・・")
-            need_order = False
-            price = None
 
-            depth = pub.get_depth(self.pair.value)
-            ask_price = self.get_mean_by_limit_orders(depth['asks'], size=3)
-            bid_price = self.get_mean_by_limit_orders(depth['bids'], size=3)
-            # 利確ラインを超えていたら
-            if ask_price > int(profit_price):
-                logger.debug("利確ライン到達！")
-                price = str(int(depth['asks'][0][0]) - 1)
-                need_order = True
-            # 損切りラインを割ったら
-            elif bid_price < int(stop_loss_price):
-                logger.debug("損切ライン到達！")
-                price = str(int(depth['bids'][0][0]) + 1)
-                need_order = True
+            price = self.judge_should_sell(profit_price=profit_price, stop_loss_price=stop_loss_price)
             # 注文
-            if need_order:
+            if price:
                 # 売却
-                executed_at = self.limit_order(order=ORDER.SELL, price=price, volume=volume)
+                executed_at = yield from self.limit_order_steps(order=ORDER.SELL, price=price, volume=volume,
+                                                                wait=self.wait)
                 try_count += 1
                 # 成功した場合
                 if executed_at:
-                    # 売却後の資産取得
-                    # TODO: APIで資産取得
-                    if self.is_rial:
-                        pass
-                    else:
-                        self.assets = str(int(self.assets) + round(int(price) * volume))
-                    self.record.sell(price=price, executed_at=executed_at, try_num=try_count, assets=self.assets)
-                    logger.debug(f'売却挑戦回数: {try_count}')
+                    self.sold(price=price, volume=volume, executed_at=executed_at, try_count=try_count)
                     return
-            time.sleep(interval)
+            # 次の板・約定の更新まで待つ（更新がなくても interval 秒で再判定）
+            with metrics.timer('bitbank_update_wait_seconds'):
+                yield interval
 
-    def limit_order(self, order: ORDER, price: str, volume: float, wait: int = INTERVAL.LONG.value * 3):
+    def sold(self, price: int, volume: Volume, executed_at: int, try_count: int):
+        # 売却後の資産取得
+        # TODO: APIで資産取得
+        if self.is_rial:
+            pass
+        else:
+            self.assets += amount(price, volume)
+        self.record.sell(price=price, executed_at=executed_at, try_num=try_count, assets=self.assets)
+        logger.debug(f'売却挑戦回数: {try_count}')
+
+    def limit_order(self, order: ORDER, price: int, volume: Volume, wait: int = INTERVAL.LONG.value * 3):
+        return self.run_steps(self.limit_order_steps(order=order, price=price, volume=volume, wait=wait))
+
+    async def limit_order_async(self, order: ORDER, price: int, volume: Volume,
+                                wait: int = INTERVAL.LONG.value * 3):
+        return await self.run_steps_async(self.limit_order_steps(order=order, price=price, volume=volume, wait=wait))
+
+    def limit_order_steps(self, order: ORDER, price: int, volume: Volume, wait: int = INTERVAL.LONG.value * 3):
+        """
+        指値注文して、成立するか期限（wait 秒）まで板・約定の更新を待つ
+        :return: 成立した時刻（不成立なら None）
+        """
+        fill = self.place_order(order=order, price=price, volume=volume)
+        # 約定が届くたびに成立を確認（模擬取引所では時計がメッセージの時刻で進むので、期限も仮想時計で確認）
+        deadline = self.clock.time() + wait
+        while not self.is_order_completed(fill=fill) and self.clock.time() < deadline:
+            is_updated = yield deadline - self.clock.time()
+            # 更新が届かないまま待ち切った（再生終了などで時計が進まない）
+            if not is_updated:
+                break
+        return self.settle_order(fill=fill)
+
+    def place_order(self, order: ORDER, price: int, volume: Volume) -> TapeWatch:
+        """
+        :return: 注文後の約定で成立を確認する監視
+        """
         # 注文
         # TODO: APIで指値注文
         if self.is_rial:
             pass
         logger.debug("指値注文！")
-        time_from = round(time.time() * 1000)
-        time.sleep(wait)
+        with metrics.timer('bitbank_order_place_seconds', order=order.value):
+            # 約定の数量も 1e-8 BTC 単位の整数にして注文の数量と比べる（小数の足し算の誤差で成立を見逃さない）
+            if self.exchange:
+                fill = self.exchange.place(order=order, price=price, volume=volume)
+            else:
+                time_from = round(self.clock.time() * 1000)
+                fill = self.market.tape.watch(
+                    TapeWatch.for_order(order=order, price=price, volume=volume, since=time_from))
+        # 判定の成立から注文までの時間
+        if self.decided_at is not None:
+            metrics.observe('bitbank_decision_to_order_seconds', time.perf_counter() - self.decided_at,
+                            order=order.value)
+            self.decided_at = None
+        self.ordered_at = self.clock.time()
+        return fill
+
+    def settle_order(self, fill: TapeWatch):
+        self.market.tape.unwatch(fill)
+        is_completed = self.is_order_completed(fill=fill)
+        # 注文から約定・取消までの時間（模擬取引所では仮想時計の秒数）
+        metrics.observe('bitbank_fill_wait_seconds', self.clock.time() - self.ordered_at,
+                        result='filled' if is_completed else 'cancelled')
         # 売買成立
-        if self.is_order_completed(price=price, volume=volume, order=order, time_from=time_from):
+        if is_completed:
             logger.debug("成立！")
-            executed_at = round(time.time() * 1000)
+            executed_at = round(self.clock.time() * 1000)
             return executed_at
         # 売買不成立
         else:
@@ -177,62 +346,43 @@ class Trade:
             executed_at = None
             return executed_at
 
-    def is_order_completed(self, price: str, volume: float, order: ORDER, time_from: int = None):
-        # return True
-        is_completed = False
-        completed_volume = 0
-        if time_from is None:
-            time_from = round(time.time() * 1000)
+    def is_order_completed(self, fill: TapeWatch):
         # TODO: APIで売買成立を確認
         if self.is_rial:
             pass
-        else:
-            transactions = pub.get_transactions(pair=self.pair.value)['transactions']
-            for transaction in transactions:
-                if transaction['executed_at'] <= time_from:
-                    continue
-                if (order == ORDER.SELL and int(transaction['price']) >= int(price)) or (
-                        order == ORDER.BUY and int(transaction['price']) <= int(price)):
-                    completed_volume += float(transaction['amount'])
-            if completed_volume >= volume:
-                is_completed = True
-            else:
-                is_completed = False
-        return is_completed
+        # 注文後の約定のうち、指値以上（売り）・以下（買い）の数量が注文数量に達したら成立
+        return fill.is_done
 
-    def generate_volume(self, price: str, assets_rate: float = 1.0):
-        return round(round(int(assets_rate * int(self.assets)) / int(price), RATE.ROUND_DIGITS.value + 1),
-                     RATE.ROUND_DIGITS.value)
+    def generate_volume(self, price: int, assets_rate: float = 1.0) -> Volume:
+        return volume_for(assets=self.assets, price=price, assets_rate=assets_rate)
 
     @staticmethod
-    def within_diff_rate(depth, limit: float = 0.0005, size: int = 3):
-        ask_price = Trade.get_mean_by_limit_orders(depth['asks'], size=size)
-        bid_price = Trade.get_mean_by_limit_orders(depth['bids'], size=size)
-        diff = ask_price - bid_price
-        diff_rate = diff / ask_price
-        if diff_rate <= limit:
+    def within_diff_rate(book: OrderBook, limit: float = 0.0005, size: int = 3):
+        # 記録した板でまとめて判定する場合は bitbank.spread.judge_rules
+        diff_rate = book.spread_rate(size=size)
+        # どちらかの板が空なら購入しない
+        if diff_rate is not None and diff_rate <= limit:
             return True
         else:
             return False
 
     @staticmethod
-    def without_diff_rate(depth, limit: float = 0.0005, size: int = 3):
-        ask_price = Trade.get_mean_by_limit_orders(depth['asks'], size=size)
-        bid_price = Trade.get_mean_by_limit_orders(depth['bids'], size=size)
-        diff = ask_price - bid_price
-        diff_rate = diff / ask_price
-        if diff_rate >= limit:
+    def without_diff_rate(book: OrderBook, limit: float = 0.0005, size: int = 3):
+        diff_rate = book.spread_rate(size=size)
+        if diff_rate is not None and diff_rate >= limit:
             return True
         else:
             return False
 
     @staticmethod
-    def generate_best_change_rate(win_rate: float):
-        best_change_rate = round((win_rate - 0.5) * 2, RATE.ROUND_DIGITS.value)
-        return best_change_rate
+    def generate_best_change_rate(win_rate: float, cost_rate: float = 0):
+        # 対数成長率の期待値が最大になる増減率を早見表から引く（手数料0なら「(勝率-50%)*2」と一致）
+        best_change_rate = get_risk_table(cost_rate=cost_rate).get(win_rate)
+        return round(best_change_rate, RATE.ROUND_DIGITS.value)
 
     @staticmethod
     def get_mean_by_limit_orders(limit_orders, size: int = 3):
+        # 板1件ごとに変換する従来版（取引中は OrderBook.mean を使う。比較は bitbank.orderbook.benchmark）
         # 価格と量をそれぞれ抽出してリスト化
         price_list = []
         volume_list = []
@@ -248,6 +398,8 @@ class Trade:
 
 
 def main():
+    if config.METRICS:
+        metrics.start()
     trade = Trade(pair=PAIR.BTC_JPY, rule=TRADERULE.WITHOUT_DIFFRATE, is_rial=False)
     trade.trade()
 
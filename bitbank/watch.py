@@ -1,40 +1,306 @@
-import time
-
-import python_bitbankcc
+import asyncio
+import heapq
+import itertools
+import threading
 
 from bitbank import config
-from bitbank.const import DIRECTION, INTERVAL, PAIR, ORDER
-from bitbank.trade import Trade
+from bitbank.const import DIRECTION, INTERVAL, PAIR
+from bitbank.market import MarketData, MESSAGE, get_market_data, set_waiter_result
+from bitbank.orderbook import SIDE
 from cmn.log import get_logger
 
 logger = get_logger(modname=__name__, is_debug=config.IS_DEBUG)
-pub = python_bitbankcc.public()
+
+
+class WATCHTYPE:
+    PRICE = 'price'  # 約定価格が水準に到達
+    SPREAD = 'spread'  # 売り板と買い板の価格差の割合が水準に到達
+
+
+class WatchCondition:
+    """
+    監視条件（1度成立したら終了。成立は callback・wait・wait_async のいずれかで受け取る）
+    """
+
+    def __init__(self, pair: PAIR, watch_type: str, direction: DIRECTION, level, size: int = None,
+                 since: int = None, callback=None):
+        """
+        :param watch_type: WATCHTYPE
+        :param direction: UP なら水準以上、DOWN なら水準以下で成立
+        :param level: 価格（PRICE）・価格差の割合（SPREAD）
+        :param size: 価格差を求める板の件数（SPREAD）
+        :param since: この時刻（ミリ秒）より後の約定のみ対象（PRICE）
+        :param callback: 成立時に呼ばれる関数（引数は WatchCondition）
+        """
+        self.pair = pair
+        self.watch_type = watch_type
+        self.direction = direction
+        self.level = level
+        self.size = size
+        self.since = since
+        self.callback = callback
+        self.value = None  # 成立時の価格・価格差の割合
+        self.transaction = None  # 成立させた約定（PRICE）
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.waiters = []  # 成立を待っている asyncio の (ループ, Future)
+
+    @property
+    def is_fired(self) -> bool:
+        return self.event.is_set()
+
+    def is_reached(self, value) -> bool:
+        return value >= self.level if self.direction == DIRECTION.UP else value <= self.level
+
+    def fire(self, value, transaction: dict = None):
+        with self.lock:
+            if self.is_fired:
+                return
+            self.value = value
+            self.transaction = transaction
+            self.event.set()
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(set_waiter_result, future, value)
+        if self.callback:
+            self.callback(self)
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.event.wait(timeout=timeout)
+
+    async def wait_async(self, timeout: float = None):
+        """
+        :return: 成立時の値（timeout 秒以内に成立しなければ None）
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.is_fired:
+                return self.value
+            self.waiters.append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LevelIndex:
+    """
+    同じ種類・向きの監視条件を、次に成立する水準が先頭に来るヒープに入れておき、成立したものだけを先頭から取り出す
+    （追加は O(log 条件数)、成立した条件は1件あたり O(log 条件数)、成立しなければ先頭を見るだけ）
+    """
+
+    def __init__(self, direction: DIRECTION):
+        self.direction = direction
+        self.heap = []  # (水準（DOWN は符号を反転して大きい順）, 登録順, 監視条件)
+        self.counts = {}  # 監視条件 → 登録順（ヒープに残っているもの）
+        self.removed = set()  # 取り消してヒープに残っている登録順（取り出す時に読み飛ばす）
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get_key(self, level):
+        return level if self.direction == DIRECTION.UP else -level
+
+    def add(self, condition: WatchCondition):
+        count = next(self.counter)
+        self.counts[condition] = count
+        heapq.heappush(self.heap, (self.get_key(condition.level), count, condition))
+
+    def remove(self, condition: WatchCondition):
+        count = self.counts.pop(condition, None)
+        if count is None:
+            return
+        self.removed.add(count)
+        # 取り消したものがヒープの半分を超えたら詰め直す（詰め直しは O(条件数) だが、取り消し1件あたりでは定数）
+        if len(self.removed) * 2 > len(self.heap):
+            self.heap = [entry for entry in self.heap if entry[1] not in self.removed]
+            heapq.heapify(self.heap)
+            self.removed.clear()
+
+    def pop_reached(self, value) -> list:
+        """
+        value で成立する監視条件を取り除いて返す（UP は水準が value 以下、DOWN は value 以上のもの）
+        """
+        key = self.get_key(value)
+        reached = []
+        while self.heap and self.heap[0][0] <= key:
+            _, count, condition = heapq.heappop(self.heap)
+            if count in self.removed:
+                self.removed.discard(count)
+                continue
+            del self.counts[condition]
+            reached.append(condition)
+        return reached
+
+
+class PairWatch:
+    # 通貨ペアごとの監視条件の索引
+    def __init__(self, market: MarketData):
+        self.market = market
+        self.last_transaction_id = market.tape.last_id  # 処理済みの約定
+        self.prices = {direction: LevelIndex(direction) for direction in DIRECTION}
+        self.spreads = {}  # 板の件数 → {向き: LevelIndex}
+
+
+class WatchService:
+    """
+    複数の通貨ペアの価格到達・価格差の割合の監視条件をまとめて管理する
+    通貨ペアごとに1つの配信（MarketData）を購読し、更新のたびに成立した条件だけをヒープの先頭から取り出す
+    （成立する条件がなければ1回の更新あたり O(1)、成立した条件は1件あたり O(log 条件数)）
+    """
+
+    def __init__(self, get_market=get_market_data):
+        """
+        :param get_market: 通貨ペアから MarketData を返す関数（未指定なら通貨ペアごとに共有する配信）
+        """
+        self.get_market = get_market
+        self.pairs = {}
+        self.lock = threading.Lock()
+
+    def get_pair_watch(self, pair: PAIR) -> PairWatch:
+        if pair not in self.pairs:
+            market = self.get_market(pair)
+            self.pairs[pair] = PairWatch(market=market)
+            market.subscribe(self.on_update)
+        return self.pairs[pair]
+
+    def watch_price(self, pair: PAIR, price, direction: DIRECTION, since: int = None,
+                    callback=None) -> WatchCondition:
+        """
+        約定価格が price 以上（UP）・以下（DOWN）になったら成立
+        :param since: この時刻（ミリ秒）より後の約定のみ対象（受信済みの約定も確認する）
+        """
+        condition = WatchCondition(pair=pair, watch_type=WATCHTYPE.PRICE, direction=direction, level=int(price),
+                                   since=since, callback=callback)
+        with self.lock:
+            pair_watch = self.get_pair_watch(pair)
+            # 処理済みの約定のうち since より後のものは、登録時にここで確認する
+            reached = None
+            if since is not None:
+                for transaction in reversed(pair_watch.market.tape.get_transactions()):
+                    if transaction['executed_at'] <= since:
+                        break
+                    if pair_watch.last_transaction_id is not None and \
+                            transaction['transaction_id'] <= pair_watch.last_transaction_id and \
+                            condition.is_reached(int(transaction['price'])):
+                        reached = transaction
+            if reached is None:
+                pair_watch.prices[direction].add(condition)
+        if reached is not None:
+            condition.fire(int(reached['price']), transaction=reached)
+        return condition
+
+    def watch_spread(self, pair: PAIR, limit: float, direction: DIRECTION, size: int = 3,
+                     callback=None) -> WatchCondition:
+        """
+        売り板と買い板の加重平均価格の差の割合が limit 以上（UP）・以下（DOWN）になったら成立
+        """
+        condition = WatchCondition(pair=pair, watch_type=WATCHTYPE.SPREAD, direction=direction, level=limit,
+                                   size=size, callback=callback)
+        with self.lock:
+            pair_watch = self.get_pair_watch(pair)
+            if size not in pair_watch.spreads:
+                pair_watch.spreads[size] = {direction: LevelIndex(direction) for direction in DIRECTION}
+            pair_watch.spreads[size][direction].add(condition)
+        # 受信済みの板で成立していればすぐに通知
+        book = pair_watch.market.book
+        if book is not None:
+            self.check_spreads(pair_watch, book)
+        return condition
+
+    def cancel(self, condition: WatchCondition):
+        with self.lock:
+            pair_watch = self.pairs.get(condition.pair)
+            if pair_watch is None:
+                return
+            if condition.watch_type == WATCHTYPE.PRICE:
+                pair_watch.prices[condition.direction].remove(condition)
+            elif condition.size in pair_watch.spreads:
+                pair_watch.spreads[condition.size][condition.direction].remove(condition)
+
+    def on_update(self, message_type: str, market: MarketData):
+        pair_watch = self.pairs.get(market.pair)
+        if pair_watch is None:
+            return
+        if message_type == MESSAGE.TRANSACTIONS:
+            self.check_prices(pair_watch)
+        elif message_type in (MESSAGE.DEPTH, MESSAGE.DEPTH_DIFF):
+            self.check_spreads(pair_watch, market.book)
+
+    def check_prices(self, pair_watch: PairWatch):
+        fired = []
+        with self.lock:
+            transactions = pair_watch.market.tape.get_new_transactions(last_id=pair_watch.last_transaction_id)
+            if not transactions:
+                return
+            pair_watch.last_transaction_id = transactions[-1]['transaction_id']
+            # 新しい約定の最高値・最安値で、成立した条件だけを取り出す
+            highest = max(transactions, key=lambda t: int(t['price']))
+            lowest = min(transactions, key=lambda t: int(t['price']))
+            for condition in pair_watch.prices[DIRECTION.UP].pop_reached(int(highest['price'])):
+                fired.append((condition, highest))
+            for condition in pair_watch.prices[DIRECTION.DOWN].pop_reached(int(lowest['price'])):
+                fired.append((condition, lowest))
+        # 通知はロックの外で行う（通知先から監視を登録できるように）
+        for condition, transaction in fired:
+            condition.fire(int(transaction['price']), transaction=transaction)
+
+    def check_spreads(self, pair_watch: PairWatch, book):
+        fired = []
+        with self.lock:
+            for size, indexes in pair_watch.spreads.items():
+                if not (len(indexes[DIRECTION.UP]) or len(indexes[DIRECTION.DOWN])):
+                    continue
+                if not (book.depth(SIDE.ASK) and book.depth(SIDE.BID)):
+                    continue
+                spread_rate = book.spread_rate(size=size)
+                for index in indexes.values():
+                    for condition in index.pop_reached(spread_rate):
+                        fired.append((condition, spread_rate))
+        for condition, spread_rate in fired:
+            condition.fire(spread_rate)
+
+
+watch_service = None
+
+
+def get_watch_service() -> WatchService:
+    """
+    全体で1つの監視サービスを共有する（通貨ペアごとの配信も共有）
+    """
+    global watch_service
+    if watch_service is None:
+        watch_service = WatchService()
+    return watch_service
 
 
 class Watch:
 
     @staticmethod
     def reach(pair: PAIR, price: str, time_from: int, direction: DIRECTION, interval: int = 5):
-        while True:
-            transactions = pub.get_transactions(pair.value)['transactions']
-            for transaction in transactions:
-                if not transaction['executed_at'] > time_from:
-                    continue
-                if (direction == DIRECTION.UP and transaction['price'] >= price) or (
-                        direction == DIRECTION.DOWN and transaction['price'] <= price):
-                    logger.debug(transaction)
-                    return True
-            time.sleep(interval)
+        # 共有の監視サービスに登録して成立を待つ（interval 秒ごとに監視中であることを表示）
+        condition = get_watch_service().watch_price(pair=pair, price=price, direction=direction, since=time_from)
+        while not condition.wait(timeout=interval):
+            logger.debug(f'価格到達監視中: {price} {direction.value}')
+        logger.debug(condition.transaction)
+        return True
 
     @staticmethod
-    def price_diff(pair: PAIR, size: int = 1, interval: int = INTERVAL.MIN, except_diff_1: bool = True):
+    def price_diff(pair: PAIR, size: int = 1, interval: int = INTERVAL.MIN.value, except_diff_1: bool = True):
+        # 共有の配信の板が更新されるたびに表示（更新がなくても interval 秒ごと）
+        market = get_market_data(pair)
         while True:
-            depth = pub.get_depth(pair.value)
-            ask_price = Trade.get_mean_by_limit_orders(depth['asks'], size=size)
-            bid_price = Trade.get_mean_by_limit_orders(depth['bids'], size=size)
+            book = market.get_book()
+            ask_price = book.mean(SIDE.ASK, size=size)
+            bid_price = book.mean(SIDE.BID, size=size)
+            # どちらかの板が空なら表示しない
+            if ask_price is None or bid_price is None:
+                market.wait_update(timeout=interval)
+                continue
             diff = ask_price - bid_price
             diff_rate = '{:.4%}'.format(diff / ask_price)
             if not except_diff_1 or (except_diff_1 and diff > 1):
                 logger.info(f'{diff_rate}: {diff}')
-            time.sleep(interval)
-
+            market.wait_update(timeout=interval)
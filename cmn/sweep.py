@@ -0,0 +1,26 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+
+def run_sweep(worker, tasks: list, columns: list, file_name: str, processes: Optional[int] = None) -> list:
+    """
+    パラメータの組み合わせごとの処理をプロセスプールで並列実行して1つのcsvにまとめる
+    :param worker: 1組み合わせ分の処理（引数は tasks の1件、戻り値はcsvの1行）。pickle できるようにモジュール直下の関数にする
+    :param tasks: worker に渡す引数のリスト
+    :param columns: csvの見出し
+    :param file_name: 出力csvファイル名
+    :param processes: プロセス数（未指定ならCPU数）
+    :return: csvに書いた行のリスト（tasks と同じ順）
+    """
+    # プロセス間通信の回数を減らすため、ワーカーごとに数件ずつまとめて渡す
+    chunksize = max(len(tasks) // (4 * (processes or os.cpu_count() or 1)), 1)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        rows = list(executor.map(worker, tasks, chunksize=chunksize))
+
+    with open(file=file_name, newline='', mode='w') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    return rows
@@ -1,48 +1,138 @@
+import itertools
 import random
 import statistics
+from typing import NamedTuple, Optional
 
 import matplotlib.pyplot as plt
+import numpy as np
+
+from cmn.sweep import run_sweep
 
 plt.rcParams['font.family'] = "Meiryo"
 
 
-def assets_simulation(name: str, win_rate: float, win_change_rate: float, lose_change_rate: float, price_rate: float,
-                      init_assets: int,
-                      cost_rate: float = 0, max_inv_count: int = 10000, min_price: int = 1000, simul_num: int = 1000,
-                      stop_get_paid: bool = False):
+class SimulationResult(NamedTuple):
+    median_principal_ratio: float  # 投資終了時の元本割合_中央値
+    exit_rate: float  # 退場率
+    get_paid_rate: float  # 元本回収ライン達成率
+    win_count: int
+    lose_count: int
+    final_assets: Optional[np.ndarray] = None  # シミュレーションごとの投資終了時の資産
+    exit_step: Optional[np.ndarray] = None  # シミュレーションごとの退場した投資回数（退場していなければ -1）
+    get_paid_step: Optional[np.ndarray] = None  # シミュレーションごとの元本回収ラインを初めて超えた投資回数（超えていなければ -1）
+    quantiles: tuple = ()  # bands の各列に対応する分位点
+    bands: Optional[np.ndarray] = None  # 投資回数×分位点ごとの元本割合（扇形チャート用）
+    paths: Optional[np.ndarray] = None  # 先頭 sample_paths 件の元本割合の推移（投資回数×件数、終了後は NaN）
+    pruned_prob: float = 0.0  # 解析解で確率が小さいため捨てた状態の確率の合計（統計値に含まれない分）
+
+
+def simulate_assets(win_rate: float, win_change_rate: float, lose_change_rate: float, price_rate: float,
+                    init_assets: int,
+                    cost_rate: float = 0, max_inv_count: int = 10000, min_price: int = 1000, simul_num: int = 1000,
+                    stop_get_paid: bool = False, seed: Optional[int] = None,
+                    quantiles: tuple = (), sample_paths: int = 0) -> SimulationResult:
     """
-    :param name: シミュレーション名
-    :param win_rate: 投資回数ごとの勝率
-    :param win_change_rate: 勝った場合の増加率
-    :param lose_change_rate: 負けた場合の減少率
-    :param price_rate: 投資回数ごとの投資金割合
-    :param init_assets: 初期資産
-    （以下任意パラメータ）
-    :param cost_rate: 手数料割合
-    :param max_inv_count: 投資回数上限
-    :param min_price: 最低購入価格
-    :param simul_num: シミュレーション回数
-    :param stop_get_paid: 元本回収ラインを超えた場合に投資を止めるかどうか
+    全シミュレーションを配列でまとめて1回ずつ進める（NumPy版）
+    投資回数ごとの推移は全件保持せず、分位点と一部のシミュレーションだけを記録する（推移の分のメモリは simul_num に比例しない）
+    シミュレーションごとの 終了時の資産・退場した投資回数・元本回収ラインを超えた投資回数 は simul_num 件の配列で保持して返す
+    引数は assets_simulation と同じ（以下追加分）
+    :param seed: 乱数シード（同じ値なら同じ結果になる）
+    :param quantiles: 投資回数ごとに記録する元本割合の分位点（例: (0.05, 0.5, 0.95)）
+    :param sample_paths: 推移を記録するシミュレーション件数（先頭から）
     """
-    print(f"シミュレーション名: 【{name}】")
-    print(f"初期資産: {init_assets / 10000}万円")
-    print(f"投資金割合: {'{:.1%}'.format(price_rate)}")
-    print(f"勝率: {'{:.5%}'.format(win_rate)}")
-    print(f"勝った場合の増加率: {'{:.1%}'.format(win_change_rate)}")
-    print(f"負けた場合の減少率: {'{:.1%}'.format(lose_change_rate)}")
-    print(f"手数料割合: {'{:.1%}'.format(cost_rate)}")
-    print(f"投資回数上限: {max_inv_count}回")
-    print(f"最低購入価格: {min_price / 10000}万円")
-    print(f"サンプル数: {simul_num}")
-    print(f"元本回収ラインを超えた場合に投資を止めるかどうか: {stop_get_paid}")
+    rng = np.random.default_rng(seed)
+    sample_paths = min(sample_paths, simul_num)
 
-    fig, ax = plt.subplots()
+    assets = np.full(simul_num, init_assets, dtype=np.float64)
+    active = np.ones(simul_num, dtype=bool)  # 投資を続けているシミュレーション
+    exit_step = np.full(simul_num, -1, dtype=np.int64)  # 退場になった投資回数
+    get_paid_step = np.full(simul_num, -1, dtype=np.int64)  # 元本回収ラインを超えた投資回数
+    stopped = np.zeros(simul_num, dtype=bool)  # 元本回収ラインを超えて投資をやめたシミュレーション
+    win_count = 0
+    lose_count = 0
+
+    bands = [np.quantile(assets, quantiles) / init_assets] if quantiles else None
+    paths = [assets[:sample_paths] / init_assets] if sample_paths else None
+
+    inv_count = 0
+    while active.any():
+        idx = np.flatnonzero(active)
+        # 購入価格計算（int() と同じく0方向に切り捨て）
+        price = np.trunc(assets[idx] * price_rate)
+        # 最低購入価格以下なら購入できず退場
+        is_exit = price < min_price
+        exit_step[idx[is_exit]] = inv_count
+        active[idx[is_exit]] = False
+        idx = idx[~is_exit]
+        price = price[~is_exit]
+        if idx.size == 0:
+            break
+
+        # 勝敗に応じて資産反映
+        is_win = rng.random(idx.size) >= 1 - win_rate
+        n_win = int(np.count_nonzero(is_win))
+        win_count += n_win
+        lose_count += idx.size - n_win
+        change_rate = np.where(is_win, win_change_rate, -lose_change_rate)
+        assets[idx] = assets[idx] - price + np.trunc(price * (1 + change_rate - cost_rate))
+        inv_count += 1
+
+        # 元本回収ラインを超えた場合（初めて超えた投資回数を記録）
+        is_paid = assets[idx] / init_assets >= simul_num
+        first_paid = idx[is_paid & (get_paid_step[idx] < 0)]
+        get_paid_step[first_paid] = inv_count
+        # 投資をやめる指定がされていた場合は投資終了
+        if stop_get_paid:
+            stopped[idx[is_paid]] = True
+            active[idx[is_paid]] = False
+
+        # 推移の記録（終了したシミュレーションは終了時の資産のまま）
+        if quantiles:
+            bands.append(np.quantile(assets, quantiles) / init_assets)
+        if sample_paths:
+            path = np.full(sample_paths, np.nan)
+            sample_idx = idx[idx < sample_paths]
+            path[sample_idx] = assets[sample_idx] / init_assets
+            paths.append(path)
+
+        # 投資回数上限を超えているなら終了
+        if max_inv_count and inv_count >= max_inv_count:
+            break
+
+    exit_rate = max((int(np.count_nonzero(exit_step >= 0)) - int(np.count_nonzero(stopped))) / simul_num, 0)
+    return SimulationResult(
+        median_principal_ratio=float(np.median(assets)) / init_assets,
+        exit_rate=exit_rate,
+        get_paid_rate=int(np.count_nonzero(get_paid_step >= 0)) / simul_num,
+        win_count=win_count,
+        lose_count=lose_count,
+        final_assets=assets,
+        exit_step=exit_step,
+        get_paid_step=get_paid_step,
+        quantiles=tuple(quantiles),
+        bands=np.array(bands) if quantiles else None,
+        paths=np.array(paths) if sample_paths else None,
+    )
+
+
+def simulate_assets_scalar(win_rate: float, win_change_rate: float, lose_change_rate: float, price_rate: float,
+                           init_assets: int,
+                           cost_rate: float = 0, max_inv_count: int = 10000, min_price: int = 1000,
+                           simul_num: int = 1000, stop_get_paid: bool = False, seed: Optional[int] = None,
+                           quantiles: tuple = (), sample_paths: int = 0) -> SimulationResult:
+    """
+    シミュレーションを1回ずつ1投資ずつ進める（従来版・NumPy版の検証用）
+    引数は simulate_assets と同じ（quantiles は未対応のため無視）
+    """
+    rand = random.Random(seed)
 
-    # シミュレーション
     exit_list = []  # 退場になったシミュレーション番号のリスト
     get_paid_list = []  # 元本回収ラインを超えたシミュレーション番号のリスト
     stop_get_paid_list = []  # 元本回収ラインを超えて投資をやめたシミュレーション番号のリスト
     assets_list = []  # 投資終了時の資産リスト
+    exit_step = np.full(simul_num, -1, dtype=np.int64)
+    get_paid_step = np.full(simul_num, -1, dtype=np.int64)
+    sample_records = []  # 先頭 sample_paths 件の元本割合の推移
     win_count = 0
     lose_count = 0
 
@@ -58,12 +148,13 @@ def assets_simulation(name: str, win_rate: float, win_change_rate: float, lose_c
             # 最低購入価格以下なら購入できず退場
             if price < min_price:
                 exit_list.append(i)
+                exit_step[i] = len(assets_record) - 1
                 break
             # 購入
             assets -= price
 
             # 勝敗に応じて資産反映
-            if random.random() >= 1 - win_rate:
+            if rand.random() >= 1 - win_rate:
                 change_rate = win_change_rate
                 win_count += 1
             else:
@@ -80,6 +171,7 @@ def assets_simulation(name: str, win_rate: float, win_change_rate: float, lose_c
                 # 重複しないようにリスト追加
                 if i not in get_paid_list:
                     get_paid_list.append(i)
+                    get_paid_step[i] = len(assets_record) - 1
                 # 投資をやめる指定がされていた場合はリスト追加して投資終了
                 if stop_get_paid:
                     stop_get_paid_list.append(i)
@@ -91,44 +183,338 @@ def assets_simulation(name: str, win_rate: float, win_change_rate: float, lose_c
                     break
 
         assets_list.append(assets)
+        if i < sample_paths:
+            sample_records.append(assets_record)
+
+    # 推移を NumPy版と同じ形（投資回数×件数、終了後は NaN）に揃える
+    paths = None
+    if sample_records:
+        paths = np.full((max(len(record) for record in sample_records), len(sample_records)), np.nan)
+        for i, record in enumerate(sample_records):
+            paths[:len(record), i] = record
+
+    exit_rate = max((len(exit_list) - len(stop_get_paid_list)) / simul_num, 0)
+    return SimulationResult(
+        median_principal_ratio=statistics.median(assets_list) / init_assets,
+        exit_rate=exit_rate,
+        get_paid_rate=len(get_paid_list) / simul_num,
+        win_count=win_count,
+        lose_count=lose_count,
+        final_assets=np.array(assets_list, dtype=np.float64),
+        exit_step=exit_step,
+        get_paid_step=get_paid_step,
+        paths=paths,
+    )
+
+
+def solve_assets(win_rate: float, win_change_rate: float, lose_change_rate: float, price_rate: float,
+                 init_assets: int,
+                 cost_rate: float = 0, max_inv_count: int = 10000, min_price: int = 1000, simul_num: int = 1000,
+                 stop_get_paid: bool = False, tol: float = 1e-18) -> SimulationResult:
+    """
+    勝ち数ごとの確率分布を投資回数ごとに更新して（二項格子上の動的計画法）、統計値を乱数なしで計算する
+    資産は勝ち数・負け数で決まる倍率として扱い、シミュレーションの毎回の1円未満切り捨て（購入価格・売却額）は無視する
+    切り捨ては毎回資産を減らす方向に働くので、購入価格が最低購入価格に近い（1回の増減が数円程度の）設定では
+    退場率が低く出る（例: 勝率0.5・増減5%・初期資産1000・投資金割合0.2・最低購入価格100・10000回で 0.65、シミュレーションでは 1.0）
+    切り捨てを再現するには資産を整数の状態として持つ必要があり、状態数が投資回数とともに増えて現実的な時間で解けない
+    ずれの大きさは cross_check で確認すること
+    引数は simulate_assets と同じ（simul_num は元本回収ラインとしてのみ使用、以下追加分）
+    :param tol: これより小さい確率の状態は捨てる（計算を速くするため。捨てた確率の合計は pruned_prob）
+    """
+    if not max_inv_count:
+        raise ValueError('max_inv_count を指定してください。')
+
+    # 1回の投資での資産倍率（勝ち・負け）を対数で扱う（負けると資産が0になる場合は十分小さい値で代用）
+    up_rate = 1 + price_rate * (win_change_rate - cost_rate)
+    down_rate = 1 - price_rate * (lose_change_rate + cost_rate)
+    log_up = np.log(up_rate) if up_rate > 0 else -1e300
+    log_down = np.log(down_rate) if down_rate > 0 else -1e300
+    # 退場ライン（購入価格が最低購入価格未満）と元本回収ラインを元本割合の対数で表す
+    log_exit = np.log(min_price / (price_rate * init_assets))
+    log_get_paid = np.log(simul_num)
+
+    # 勝ち数ごとの確率（元本回収ライン未達・達成済み）、確率が残っている勝ち数の範囲 [low, high)
+    wins = np.arange(max_inv_count + 2)
+    unpaid = np.zeros(max_inv_count + 2)
+    paid = np.zeros(max_inv_count + 2)
+    unpaid[0] = 1
+    low, high = 0, 1
+
+    exit_prob = 0
+    get_paid_prob = 0
+    stopped_prob = 0
+    pruned_prob = 0
+    win_count = 0
+    lose_count = 0
+    end_values = []  # 投資終了時の元本割合の対数
+    end_probs = []  # その確率
+
+    for inv_count in range(max_inv_count):
+        unpaid_window = unpaid[low:high]
+        paid_window = paid[low:high]
+
+        # 最低購入価格以下なら購入できず退場
+        x = wins[low:high] * log_up + (inv_count - wins[low:high]) * log_down
+        is_exit = x < log_exit
+        if is_exit.any():
+            prob = unpaid_window[is_exit] + paid_window[is_exit]
+            exit_prob += prob.sum()
+            end_values.append(x[is_exit])
+            end_probs.append(prob)
+            unpaid_window[is_exit] = 0
+            paid_window[is_exit] = 0
+
+        # 勝敗に応じて確率を勝ち数方向に1つずらす
+        alive = unpaid_window.sum() + paid_window.sum()
+        win_count += alive * win_rate
+        lose_count += alive * (1 - win_rate)
+        for probs in (unpaid, paid):
+            win_probs = probs[low:high] * win_rate
+            probs[low:high] *= 1 - win_rate
+            probs[low + 1:high + 1] += win_probs
+        high += 1
+
+        # 元本回収ラインを超えた場合
+        x = wins[low:high] * log_up + (inv_count + 1 - wins[low:high]) * log_down
+        is_paid = x >= log_get_paid
+        if is_paid.any():
+            unpaid_window = unpaid[low:high]
+            paid_window = paid[low:high]
+            get_paid_prob += unpaid_window[is_paid].sum()
+            paid_window[is_paid] += unpaid_window[is_paid]
+            unpaid_window[is_paid] = 0
+            # 投資をやめる指定がされていた場合は投資終了
+            if stop_get_paid:
+                stopped_prob += paid_window[is_paid].sum()
+                end_values.append(x[is_paid])
+                end_probs.append(paid_window[is_paid])
+                paid_window[is_paid] = 0
+
+        # 確率がほぼ0の端の状態を捨てる
+        while low < high and unpaid[low] <= tol and paid[low] <= tol:
+            pruned_prob += unpaid[low] + paid[low]
+            unpaid[low] = paid[low] = 0
+            low += 1
+        while low < high and unpaid[high - 1] <= tol and paid[high - 1] <= tol:
+            pruned_prob += unpaid[high - 1] + paid[high - 1]
+            unpaid[high - 1] = paid[high - 1] = 0
+            high -= 1
+        if low == high:
+            break
+    else:
+        # 投資回数上限まで続けた状態
+        end_values.append(wins[low:high] * log_up + (max_inv_count - wins[low:high]) * log_down)
+        end_probs.append(unpaid[low:high] + paid[low:high])
 
-        # プロット
-        x = range(len(assets_record))
-        y = assets_record
-        ax.plot(x, y)
+    # 確率で重み付けした中央値
+    values = np.concatenate(end_values)
+    probs = np.concatenate(end_probs)
+    order = np.argsort(values)
+    cum_probs = np.cumsum(probs[order])
+    median = values[order][np.searchsorted(cum_probs, cum_probs[-1] / 2)]
+
+    return SimulationResult(
+        median_principal_ratio=float(np.exp(median)),
+        exit_rate=max(float(exit_prob - stopped_prob), 0),
+        get_paid_rate=float(get_paid_prob),
+        win_count=round(win_count * simul_num),
+        lose_count=round(lose_count * simul_num),
+        pruned_prob=float(pruned_prob),
+    )
+
+
+def cross_check(seed: Optional[int] = None, tolerance: float = 0.01, **params) -> dict:
+    """
+    解析解（solve_assets）とシミュレーション（simulate_assets）の統計値を比較して表示する
+    解析解は1円未満の切り捨てを無視するので、許容差を超えた項目は切り捨ての影響が大きい設定と判断する
+    :param seed: シミュレーションの乱数シード
+    :param tolerance: 許容差（率はシミュレーションの標準誤差の3倍を加えた差、元本割合の中央値は比で判定）
+    :param params: simulate_assets に渡す引数
+    :return: 項目 → 許容差以内か
+    """
+    solved = solve_assets(**params)
+    simulated = simulate_assets(seed=seed, **params)
+    simul_num = params.get('simul_num', 1000)
+    is_within = {}
+    for field in ('median_principal_ratio', 'exit_rate', 'get_paid_rate'):
+        solved_value = getattr(solved, field)
+        simulated_value = getattr(simulated, field)
+        diff = simulated_value - solved_value
+        if field == 'median_principal_ratio':
+            is_within[field] = abs(diff) <= tolerance * max(abs(solved_value), abs(simulated_value))
+        else:
+            std_error = (simulated_value * (1 - simulated_value) / simul_num) ** 0.5
+            is_within[field] = abs(diff) <= tolerance + 3 * std_error
+        print(f"{field}: 解析解 {solved_value:.6g}  シミュレーション {simulated_value:.6g}  "
+              f"差 {diff:+.6g}  {'OK' if is_within[field] else '許容差超え（切り捨ての影響）'}")
+    print(f"解析解で捨てた確率: {solved.pruned_prob:.3g}")
+    return is_within
+
+
+def render(result: SimulationResult, name: str, init_assets: int, min_price: int, simul_num: int,
+           file_name: Optional[str] = None):
+    """
+    シミュレーション結果を描画して保存する
+    分位点があれば扇形チャート、推移を記録したシミュレーションがあれば折れ線を重ねる
+    """
+    fig, ax = plt.subplots()
+
+    # 扇形チャート（外側の分位点の組から順に塗る）
+    if result.bands is not None:
+        x = range(len(result.bands))
+        n = len(result.quantiles)
+        for i in range(n // 2):
+            ax.fill_between(x, result.bands[:, i], result.bands[:, n - 1 - i], color="tab:blue",
+                            alpha=0.15 + 0.15 * i, linewidth=0,
+                            label=f"{'{:.0%}'.format(result.quantiles[i])}〜{'{:.0%}'.format(result.quantiles[n - 1 - i])}")
+        if n % 2:
+            ax.plot(x, result.bands[:, n // 2], color="tab:blue",
+                    label=f"{'{:.0%}'.format(result.quantiles[n // 2])}")
+        ax.legend(loc="upper left")
+    # 一部のシミュレーションの推移
+    if result.paths is not None:
+        ax.plot(result.paths, linewidth=0.5)
 
     # グラフ表示
     ax.set_xlabel('投資回数')  # x軸ラベル
     ax.set_ylabel('元本割合')  # y軸ラベル
     # ax.yaxis.set_major_formatter(ticker.PercentFormatter(1.0))  # y軸を百分率で表示
     title = f"【{name}】\n"
-    title += f"元本割合_中央値: {'{:.1%}'.format(statistics.median(assets_list) / init_assets)}\n"
-    exit_rate = (len(exit_list) - len(stop_get_paid_list)) / (i + 1)
-    if exit_rate < 0:
-        exit_rate = 0
-    title += f"退場率: {'{:.1%}'.format(exit_rate)}\n"
-    title += f"元本回収ライン達成率: {'{:.1%}'.format(len(get_paid_list) / (i + 1))}"
+    title += f"元本割合_中央値: {'{:.1%}'.format(result.median_principal_ratio)}\n"
+    title += f"退場率: {'{:.1%}'.format(result.exit_rate)}\n"
+    title += f"元本回収ライン達成率: {'{:.1%}'.format(result.get_paid_rate)}"
     ax.set_title(title)  # グラフタイトル
     fig.tight_layout()  # レイアウトの設定
     ax.grid()  # 罫線
-    if get_paid_list:
-        plt.axhline(y=simul_num, xmin=0.0, xmax=1.0, color="blue", linestyle=":")  # 元本回収ライン
-    plt.axhline(y=init_assets / init_assets, xmin=0.0, xmax=1.0, color="black", linestyle=":")  # 初期資産ライン
-    plt.axhline(y=min_price / init_assets, xmin=0.0, xmax=1.0, color="red", linestyle=":")  # 退場（最低購入価格）ライン
+    if result.get_paid_rate:
+        ax.axhline(y=simul_num, xmin=0.0, xmax=1.0, color="blue", linestyle=":")  # 元本回収ライン
+    ax.axhline(y=init_assets / init_assets, xmin=0.0, xmax=1.0, color="black", linestyle=":")  # 初期資産ライン
+    ax.axhline(y=min_price / init_assets, xmin=0.0, xmax=1.0, color="red", linestyle=":")  # 退場（最低購入価格）ライン
     fig.set_size_inches(10, 10)
-    fig.savefig(f"【{name}】.png")
+    fig.savefig(file_name or f"【{name}】.png")
+    plt.close(fig)
     # plt.show()
 
 
-def best_risk():
+def assets_simulation(name: str, win_rate: float, win_change_rate: float, lose_change_rate: float, price_rate: float,
+                      init_assets: int,
+                      cost_rate: float = 0, max_inv_count: int = 10000, min_price: int = 1000, simul_num: int = 1000,
+                      stop_get_paid: bool = False, seed: Optional[int] = None, vectorize: bool = True,
+                      quantiles: tuple = (0.05, 0.25, 0.5, 0.75, 0.95), sample_paths: int = 20,
+                      headless: bool = False):
+    """
+    :param name: シミュレーション名
+    :param win_rate: 投資回数ごとの勝率
+    :param win_change_rate: 勝った場合の増加率
+    :param lose_change_rate: 負けた場合の減少率
+    :param price_rate: 投資回数ごとの投資金割合
+    :param init_assets: 初期資産
+    （以下任意パラメータ）
+    :param cost_rate: 手数料割合
+    :param max_inv_count: 投資回数上限
+    :param min_price: 最低購入価格
+    :param simul_num: シミュレーション回数
+    :param stop_get_paid: 元本回収ラインを超えた場合に投資を止めるかどうか
+    :param seed: 乱数シード
+    :param vectorize: NumPy版で計算するかどうか（False なら従来の1回ずつ計算）
+    :param quantiles: 扇形チャートに描画する元本割合の分位点
+    :param sample_paths: 推移を描画するシミュレーション件数
+    :param headless: 統計値だけ計算して描画しないかどうか
+    """
+    print(f"シミュレーション名: 【{name}】")
+    print(f"初期資産: {init_assets / 10000}万円")
+    print(f"投資金割合: {'{:.1%}'.format(price_rate)}")
+    print(f"勝率: {'{:.5%}'.format(win_rate)}")
+    print(f"勝った場合の増加率: {'{:.1%}'.format(win_change_rate)}")
+    print(f"負けた場合の減少率: {'{:.1%}'.format(lose_change_rate)}")
+    print(f"手数料割合: {'{:.1%}'.format(cost_rate)}")
+    print(f"投資回数上限: {max_inv_count}回")
+    print(f"最低購入価格: {min_price / 10000}万円")
+    print(f"サンプル数: {simul_num}")
+    print(f"元本回収ラインを超えた場合に投資を止めるかどうか: {stop_get_paid}")
+
+    # シミュレーション
+    simulate = simulate_assets if vectorize else simulate_assets_scalar
+    result = simulate(
+        win_rate=win_rate,
+        win_change_rate=win_change_rate,
+        lose_change_rate=lose_change_rate,
+        price_rate=price_rate,
+        init_assets=init_assets,
+        cost_rate=cost_rate,
+        max_inv_count=max_inv_count,
+        min_price=min_price,
+        simul_num=simul_num,
+        stop_get_paid=stop_get_paid,
+        seed=seed,
+        quantiles=() if headless else quantiles,
+        sample_paths=0 if headless else sample_paths,
+    )
+
+    if not headless:
+        render(result=result, name=name, init_assets=init_assets, min_price=min_price, simul_num=simul_num)
+
+    return result
+
+
+class SweepCell(NamedTuple):
+    win_rate: float
+    win_change_rate: float
+    lose_change_rate: float
+    price_rate: float
+    cost_rate: float = 0
+
+
+SWEEP_COLUMNS = list(SweepCell._fields) + [
+    'median_principal_ratio', 'exit_rate', 'get_paid_rate', 'win_count', 'lose_count'
+]
+
+
+def make_grid(win_rates, change_rates, price_rates=(1.0,), cost_rates=(0,)) -> list:
+    """
+    勝率×増減率（勝ち負け同じ）×投資金割合×手数料割合の全組み合わせを作る
+    """
+    return [
+        SweepCell(win_rate, change_rate, change_rate, price_rate, cost_rate)
+        for win_rate, change_rate, price_rate, cost_rate in itertools.product(
+            win_rates, change_rates, price_rates, cost_rates)
+        if change_rate >= 0
+    ]
+
+
+def _simulate_cell(args):
+    cell, seed, params = args
+    result = simulate_assets(**cell._asdict(), seed=seed, **params)
+    return list(cell) + list(result[:5])
+
+
+def sweep(grid: list, file_name: str = 'sweep.csv', seed: Optional[int] = None, processes: Optional[int] = None,
+          **params) -> list:
+    """
+    パラメータの組み合わせごとのシミュレーションをプロセスプールで並列実行して1つのcsvにまとめる（cmn.sweep.run_sweep）
+    :param grid: SweepCell のリスト
+    :param file_name: 出力csvファイル名
+    :param seed: 乱数シード（組み合わせごとに独立した乱数列を派生させるので、並列数によらず同じ結果になる）
+    :param processes: プロセス数（未指定ならCPU数）
+    :param params: simulate_assets に渡す残りの引数（init_assets, min_price 等）
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    tasks = [(cell, cell_seed, params) for cell, cell_seed in zip(grid, seeds)]
+    return run_sweep(worker=_simulate_cell, tasks=tasks, columns=SWEEP_COLUMNS, file_name=file_name,
+                     processes=processes)
+
+
+def best_risk(seed: Optional[int] = None, processes: Optional[int] = None):
     init_assets = 1000000
     min_price = int(init_assets / 10000)
 
     # 最適なリスクの取り方をシミュレーションで調べる
     # 何回かやってみて「(勝率%-50%)*2」が最適っぽいからその近辺で細かくシミュレーションさせる
+    # （手数料0・投資金割合100%の場合のケリー基準の解と一致する。一般の場合は bitbank.risk.search_best_risk）
     init_win_rate = 0.500000000000000
     max_win_rate = 0.60
 
+    grid = []
     win_rate = init_win_rate
     while win_rate <= max_win_rate:
         best_change_rate = (win_rate - 0.500000000000000) * 2
@@ -137,23 +523,21 @@ def best_risk():
             best_change_rate,
             best_change_rate + 0.005,
         ]
-        for change_rate in change_rate_list:
-            if change_rate < 0:
-                continue
-            assets_simulation(
-                name=f"勝率{'{:.1%}'.format(win_rate)}、増減率±{'{:.1%}'.format(change_rate)}",
-                price_rate=1.0,
-                win_rate=win_rate,
-                win_change_rate=change_rate,
-                lose_change_rate=change_rate,
-                init_assets=init_assets,
-                min_price=min_price,
-                simul_num=1000,
-                max_inv_count=10000,
-                # stop_get_paid=True
-            )
+        grid += make_grid(win_rates=[win_rate], change_rates=change_rate_list, price_rates=[1.0])
         win_rate += 0.01
 
+    return sweep(
+        grid=grid,
+        file_name='best_risk.csv',
+        seed=seed,
+        processes=processes,
+        init_assets=init_assets,
+        min_price=min_price,
+        simul_num=1000,
+        max_inv_count=10000,
+        # stop_get_paid=True
+    )
+
 
 def main():
     # assets_simulation(
@@ -1,41 +1,318 @@
 '''
-This file contains a simple animation demo using mplfinance "external axes mode".
-Note that presently mplfinance does not support "blitting" (blitting makes animation
-more efficient).  Nonetheless, the animation is efficient enough to update at least
-once per second, and typically more frequently depending on the size of the plot.
+調整済みのデータ（stock.store）の日足を、ローソク足・出来高で1本ずつ再生するアニメーション
+ローソク足・出来高は表示期間の本数分の図形を作っておき、フレームごとに最新の足の図形だけを書き換える
+軸・目盛は保存しておいた背景の画像を戻すだけにして、図形だけを描き直す（blitting）
+表示期間は図形の平行移動で日付の目盛の間隔ごとにずらすので、データの本数によらず1フレームの処理は一定
 '''
 import os
+import shutil
+import subprocess
+import time
 
-import pandas as pd
-import mplfinance as mpf
-import matplotlib.animation as animation
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+from matplotlib.image import imsave
+from matplotlib.path import Path
+from matplotlib.ticker import FuncFormatter
+from matplotlib.transforms import Affine2D
 
-stock_code = "1407"
-mplf_csv = os.path.join('mplf_csv', stock_code + '.csv' + '.mplf')
-df = pd.read_csv(mplf_csv, index_col=0, parse_dates=[0], encoding="SHIFT-JIS")
-df = df.sort_index(ascending=True)
-df.shape
-df.head(3)
-df.tail(3)
+from cmn.log import get_logger
+from stock.store import DATE, TimechartStore
 
-fig = mpf.figure(style='charles', figsize=(8, 7))
-ax1 = fig.add_subplot(2, 1, 1)
-ax2 = fig.add_subplot(3, 1, 3)
+logger = get_logger(modname=__name__, is_debug=True)
 
+# 色（mplfinance の charles と同じ）
+UP_COLOR = to_rgba('#006340')
+DOWN_COLOR = to_rgba('#A02128')
+# ローソク足の幅（足の間隔に対する割合）
+BODY_WIDTH = 0.6
+# 縦軸を合わせ直すときの上下の余白（表示期間の値幅に対する割合）
+MARGIN = 0.25
+# 表示期間の値幅が縦軸の幅のこの割合より狭くなったら縦軸を合わせ直す
+FIT_RATIO = 0.4
+# 横軸の日付の目盛の数（目安）
+DATE_TICKS = 6
+# 長方形（閉じた4角形）の頂点の種類
+RECT_CODES = np.array([Path.MOVETO, Path.LINETO, Path.LINETO, Path.LINETO, Path.CLOSEPOLY], dtype=Path.code_type)
 
-def animate(ival):
-    if (20 + ival) > len(df):
-        print('no more data to plot')
-        ani.event_source.interval *= 3
-        if ani.event_source.interval > 12000:
-            exit()
-        return
-    data = df.iloc[0:(20 + ival)]
-    ax1.clear()
-    ax2.clear()
-    mpf.plot(data, ax=ax1, volume=ax2, type='candle')
 
+class CandleAnimator:
+    """
+    ローソク足・出来高の再生
+    足 i の図形は i % window 番目を使い回し、横軸の位置は i のまま（表示期間のずれは平行移動で合わせる）
+    縦軸の範囲が変わったとき・表示期間をずらしたとき（日付の目盛が変わる）だけ全体を描き直し、それ以外は背景を戻して図形だけ描く
+    """
 
-ani = animation.FuncAnimation(fig, animate, interval=1000)
+    def __init__(self, columns: dict, window: int = 60, figsize=(8, 7), headless: bool = False, title: str = ''):
+        """
+        :param columns: 列名 → 配列（日付・始値・高値・安値・終値・出来高。TimechartStore.read_columns の戻り値）
+        :param window: 表示する本数
+        :param headless: 画面に表示せずに画像・動画に書き出す
+        """
+        self.dates = columns[DATE]
+        self.opens = columns['Open']
+        self.highs = columns['High']
+        self.lows = columns['Low']
+        self.closes = columns['Close']
+        self.volumes = columns['Volume']
+        self.window = window
+        self.title = title
+        self.count = 0  # 表示した本数（次に追加する足の番号）
+        self.offset = 0  # 表示期間の左端の足の番号
+        self.frame_seconds = []  # フレームごとの処理時間
 
-mpf.show()
+        # 表示期間の足の高値・安値・出来高（縦軸の範囲を決める。まだ足がない所は NaN）
+        self.window_highs = np.full(window, np.nan)
+        self.window_lows = np.full(window, np.nan)
+        self.window_volumes = np.full(window, np.nan)
+        self.colors = np.zeros((window, 4))
+
+        if headless:
+            self.fig = Figure(figsize=figsize)
+            FigureCanvasAgg(self.fig)
+        else:
+            self.fig = plt.figure(figsize=figsize)
+        self.canvas = self.fig.canvas
+        self.ax_price, self.ax_volume = self.fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+        self.ax_price.set_xlim(-0.5, window - 0.5)
+        # 横軸の日付（目盛は tick_step 本ごと。表示期間も tick_step 本ごとにずらすので、目盛の位置は変わらず
+        # 日付は全体を描き直す時だけ変わる。文字の描画は重いので背景に含めてフレームごとには描かない）
+        self.tick_step = max(window // DATE_TICKS, 1)
+        self.ax_volume.set_xticks(np.arange(0, window, self.tick_step))
+        self.ax_volume.xaxis.set_major_formatter(FuncFormatter(self.format_date))
+        self.ax_price.tick_params(labelbottom=False)
+        self.fig.suptitle(title)
+
+        # 表示期間の左端の足が横軸の0になるように平行移動する
+        self.shift = Affine2D()
+        nan_line = np.full((2, 2), np.nan)
+        nan_rect = np.full((5, 2), np.nan)
+        self.wick_paths = [Path(nan_line) for _ in range(window)]
+        self.body_paths = [Path(nan_rect, RECT_CODES) for _ in range(window)]
+        self.volume_paths = [Path(nan_rect, RECT_CODES) for _ in range(window)]
+        self.wicks = PathCollection(self.wick_paths, facecolors='none', linewidths=1,
+                                    transform=self.shift + self.ax_price.transData, animated=True)
+        self.bodies = PathCollection(self.body_paths, linewidths=0.5,
+                                     transform=self.shift + self.ax_price.transData, animated=True)
+        self.volume_bars = PathCollection(self.volume_paths, linewidths=0.5,
+                                          transform=self.shift + self.ax_volume.transData, animated=True)
+        self.ax_price.add_collection(self.wicks, autolim=False)
+        self.ax_price.add_collection(self.bodies, autolim=False)
+        self.ax_volume.add_collection(self.volume_bars, autolim=False)
+        self.label = self.ax_price.text(0.01, 0.98, '', transform=self.ax_price.transAxes, va='top', animated=True)
+        self.artists = [self.wicks, self.bodies, self.volume_bars, self.label]
+
+        # 全体を描き直したとき（ウィンドウの大きさの変更も含む）に背景を保存し直す
+        self.background = None
+        self.is_scrolled = False  # 前回描画してから表示期間をずらしたか
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def format_date(self, x, pos=None) -> str:
+        # 横軸の位置（表示期間の左端が0）→ 足の日付
+        i = int(round(x)) + self.offset
+        return str(self.dates[i]) if 0 <= i < self.count else ''
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def set_bar(self, i: int, open_price, high, low, close, volume):
+        """
+        足 i の図形を書き換える（その足の分だけ）
+        """
+        slot = i % self.window
+        x = float(i)
+        left, right = x - BODY_WIDTH / 2, x + BODY_WIDTH / 2
+        self.wick_paths[slot].vertices = np.array([[x, low], [x, high]], dtype=np.float64)
+        self.body_paths[slot].vertices = np.array(
+            [[left, open_price], [right, open_price], [right, close], [left, close], [left, open_price]],
+            dtype=np.float64)
+        self.volume_paths[slot].vertices = np.array(
+            [[left, 0], [right, 0], [right, volume], [left, volume], [left, 0]], dtype=np.float64)
+        self.colors[slot] = UP_COLOR if close >= open_price else DOWN_COLOR
+        self.window_highs[slot] = high
+        self.window_lows[slot] = low
+        self.window_volumes[slot] = volume
+
+    def append(self, open_price, high, low, close, volume):
+        # 新しい足を追加して、右端を超えたら表示期間を tick_step 本ずらす
+        self.set_bar(self.count, open_price, high, low, close, volume)
+        self.count += 1
+        offset = max(self.get_offset(self.count), self.offset)
+        if offset != self.offset:
+            # 表示期間から外れた足を消す（縦軸の範囲にも含めない）
+            for i in range(max(self.offset, self.count - self.window), offset):
+                self.clear_bar(i)
+            self.offset = offset
+            self.shift.clear().translate(-offset, 0)
+            self.is_scrolled = True
+
+    def get_offset(self, count: int) -> int:
+        # count 本表示する時の表示期間の左端（tick_step の倍数）
+        return max(-(-(count - self.window) // self.tick_step) * self.tick_step, 0)
+
+    def clear_bar(self, i: int):
+        slot = i % self.window
+        for paths in (self.wick_paths, self.body_paths, self.volume_paths):
+            paths[slot].vertices = np.full_like(paths[slot].vertices, np.nan)
+        self.window_highs[slot] = self.window_lows[slot] = self.window_volumes[slot] = np.nan
+
+    def update_last(self, open_price, high, low, close, volume):
+        # 最新の足を書き換える（足の確定前の更新）
+        self.set_bar(self.count - 1, open_price, high, low, close, volume)
+
+    def seek(self, i: int):
+        """
+        足 i の手前まで表示した状態にする（表示期間の本数分だけ図形を作る）
+        """
+        for slot in range(self.window):
+            self.clear_bar(slot)
+        self.count = self.offset = self.get_offset(i)
+        self.shift.clear().translate(-self.offset, 0)
+        self.is_scrolled = True
+        for j in range(self.count, i):
+            self.append(self.opens[j], self.highs[j], self.lows[j], self.closes[j], self.volumes[j])
+
+    def fit(self) -> bool:
+        """
+        表示期間の足が縦軸の範囲からはみ出した・範囲に比べて狭くなった場合だけ、縦軸を合わせ直す
+        :return: 合わせ直したか（全体の描き直しが必要）
+        """
+        changed = False
+        low, high = np.nanmin(self.window_lows), np.nanmax(self.window_highs)
+        y_min, y_max = self.ax_price.get_ylim()
+        if low < y_min or high > y_max or high - low < (y_max - y_min) * FIT_RATIO:
+            margin = (high - low) * MARGIN or max(abs(high) * 0.01, 1)
+            self.ax_price.set_ylim(low - margin, high + margin)
+            changed = True
+        volume = np.nanmax(self.window_volumes)
+        _, volume_max = self.ax_volume.get_ylim()
+        if volume > volume_max or volume < volume_max * FIT_RATIO:
+            self.ax_volume.set_ylim(0, volume * (1 + MARGIN) or 1)
+            changed = True
+        return changed
+
+    def draw(self):
+        i = self.count - 1
+        self.bodies.set_facecolor(self.colors)
+        self.bodies.set_edgecolor(self.colors)
+        self.wicks.set_edgecolor(self.colors)
+        self.volume_bars.set_facecolor(self.colors)
+        self.volume_bars.set_edgecolor(self.colors)
+        # 文字の描画は図形より重いので、日付と終値だけにする
+        self.label.set_text(f'{self.dates[i]}  {self.closes[i]:g}')
+        if self.fit() or self.is_scrolled or self.background is None:
+            # 軸・目盛から描き直す（on_draw で背景を保存して図形を描く）
+            self.is_scrolled = False
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+        self.canvas.blit(self.fig.bbox)
+
+    def step(self) -> bool:
+        """
+        次の足を追加して描画する
+        :return: 描画したか（最後の足まで表示済みなら False）
+        """
+        if self.count >= len(self.closes):
+            return False
+        started_at = time.perf_counter()
+        i = self.count
+        self.append(self.opens[i], self.highs[i], self.lows[i], self.closes[i], self.volumes[i])
+        self.draw()
+        self.frame_seconds.append(time.perf_counter() - started_at)
+        return True
+
+    def play(self, interval: int = 100):
+        """
+        画面に表示して interval ミリ秒ごとに1本ずつ再生する
+        """
+        timer = self.canvas.new_timer(interval=interval)
+
+        def on_timer():
+            if not self.step():
+                timer.stop()
+                self.log_stats()
+
+        timer.add_callback(on_timer)
+        timer.start()
+        plt.show()
+
+    def frames(self, end: int = None):
+        """
+        end の手前の足まで1本ずつ描画して、フレームの画像（RGBA の配列。次のフレームで上書きされる）を返す
+        """
+        end = len(self.closes) if end is None else min(end, len(self.closes))
+        while self.count < end and self.step():
+            yield np.asarray(self.canvas.buffer_rgba())
+
+    def export_png(self, dir_name: str, end: int = None) -> int:
+        """
+        フレームを連番の png に書き出す
+        :return: フレーム数
+        """
+        os.makedirs(dir_name, exist_ok=True)
+        count = 0
+        for count, rgba in enumerate(self.frames(end=end), start=1):
+            imsave(os.path.join(dir_name, f'{count:06d}.png'), rgba)
+        self.log_stats()
+        return count
+
+    def export_video(self, file_name: str, fps: int = 30, end: int = None) -> int:
+        """
+        フレームを ffmpeg に渡して動画に書き出す（画像のファイルを作らない）
+        :return: フレーム数
+        """
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError('ffmpeg が見つかりません')
+        width, height = self.canvas.get_width_height()
+        command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                   '-s', f'{width}x{height}', '-r', str(fps), '-i', '-', '-pix_fmt', 'yuv420p', file_name]
+        count = 0
+        with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+            for count, rgba in enumerate(self.frames(end=end), start=1):
+                process.stdin.write(rgba.tobytes())
+            process.stdin.close()
+        self.log_stats()
+        return count
+
+    def log_stats(self):
+        if self.frame_seconds:
+            seconds = np.array(self.frame_seconds)
+            logger.info(f'{self.title}  {len(seconds)}フレーム  平均 {seconds.mean() * 1000:.2f}ms  '
+                        f'99% {np.percentile(seconds, 99) * 1000:.2f}ms  最大 {seconds.max() * 1000:.2f}ms')
+
+
+def load(stock_code: str, window: int = 60, headless: bool = False, start: int = 0) -> CandleAnimator:
+    """
+    調整済みのデータから再生を作成する（列ファイルを np.memmap で開くだけで読み込まない）
+    :param start: この番号の足から再生する
+    """
+    columns = TimechartStore().read_columns(stock_code, columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+    animator = CandleAnimator(columns, window=window, headless=headless, title=stock_code)
+    if start:
+        animator.seek(start)
+    return animator
+
+
+def main(stock_code: str = '1407', interval: int = 100, out_dir: str = None):
+    """
+    :param out_dir: 指定すれば画面に表示せずに、フレームを連番の png に書き出す
+    """
+    if out_dir:
+        load(stock_code, headless=True).export_png(out_dir)
+    else:
+        load(stock_code).play(interval=interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from collections import deque
+
+import numpy as np
+
+# 移動VWAPの既定の期間（日）
+VWAP_WINDOWS = (5, 25, 75)
+
+
+def rolling_vwap(vwaps, volumes, windows=VWAP_WINDOWS) -> dict:
+    """
+    日ごとの VWAP・出来高から期間ごとの移動VWAP（期間内の売買代金合計 / 出来高合計）をまとめて計算
+    売買代金・出来高の累積和を1度だけ求め、期間ごとには差を取るだけにする（行数×期間数）
+    :param vwaps: 日ごとの VWAP（古い順）
+    :param volumes: 日ごとの出来高（古い順）
+    :param windows: 期間の候補
+    :return: 期間 → 移動VWAP の配列（期間に満たない先頭の行は NaN）
+    """
+    trading_prices = np.asarray(vwaps, dtype=np.float64) * np.asarray(volumes, dtype=np.float64)
+    # 先頭に0を置いた累積和（i 行目までの合計は cum[i + 1]）
+    cum_trading_prices = np.concatenate([[0.0], np.cumsum(trading_prices)])
+    cum_volumes = np.concatenate([[0.0], np.cumsum(np.asarray(volumes, dtype=np.float64))])
+    result = {}
+    for window in windows:
+        values = np.full(len(trading_prices), np.nan)
+        if len(trading_prices) >= window:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values[window - 1:] = (cum_trading_prices[window:] - cum_trading_prices[:-window]) / (
+                        cum_volumes[window:] - cum_volumes[:-window])
+        result[window] = values
+    return result
+
+
+class RollingVWAP:
+    """
+    移動VWAPの逐次計算（1日追加するごとに期間数分の計算だけで、過去分は計算し直さない）
+    保持するのは最長の期間分の累積和だけで、値は rolling_vwap と同じ計算順なので一致する
+    """
+
+    def __init__(self, windows=VWAP_WINDOWS):
+        self.windows = tuple(windows)
+        size = max(self.windows) + 1
+        self.cum_trading_prices = deque([0.0], maxlen=size)
+        self.cum_volumes = deque([0.0], maxlen=size)
+        self.count = 0
+
+    @classmethod
+    def from_history(cls, vwaps, volumes, windows=VWAP_WINDOWS):
+        """
+        既存の日ごとの VWAP・出来高の続きから追加できるように作成
+        """
+        rolling = cls(windows=windows)
+        trading_prices = np.asarray(vwaps, dtype=np.float64) * np.asarray(volumes, dtype=np.float64)
+        cum_trading_prices = np.concatenate([[0.0], np.cumsum(trading_prices)])
+        cum_volumes = np.concatenate([[0.0], np.cumsum(np.asarray(volumes, dtype=np.float64))])
+        rolling.cum_trading_prices.extend(cum_trading_prices[1:].tolist())
+        rolling.cum_volumes.extend(cum_volumes[1:].tolist())
+        rolling.count = len(trading_prices)
+        return rolling
+
+    def append(self, vwap: float, volume: float) -> dict:
+        """
+        :return: 期間 → 追加した日の移動VWAP（期間に満たなければ NaN）
+        """
+        self.cum_trading_prices.append(self.cum_trading_prices[-1] + float(vwap) * float(volume))
+        self.cum_volumes.append(self.cum_volumes[-1] + float(volume))
+        self.count += 1
+        result = {}
+        for window in self.windows:
+            if self.count < window:
+                result[window] = np.nan
+                continue
+            volume_sum = self.cum_volumes[-1] - self.cum_volumes[-1 - window]
+            trading_price_sum = self.cum_trading_prices[-1] - self.cum_trading_prices[-1 - window]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[window] = float(np.float64(trading_price_sum) / volume_sum)
+        return result
+
+
+def add_vwap_columns(df, windows=VWAP_WINDOWS):
+    """
+    VWAP・出来高の列がある DataFrame に 売買代金（TradingPrice）・移動VWAP（VWAP_期間）の列を追加
+    """
+    df['TradingPrice'] = df['VWAP'] * df['Volume']
+    for window, values in rolling_vwap(df['VWAP'].to_numpy(), df['Volume'].to_numpy(), windows=windows).items():
+        df[f'VWAP_{window}'] = values
+    return df
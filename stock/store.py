@@ -0,0 +1,211 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from cmn.log import get_logger
+from stock.indicator import VWAP_WINDOWS, add_vwap_columns
+
+logger = get_logger(modname=__name__, is_debug=True)
+
+# 銘柄ごとの列ファイルの置き場
+STORE_DIR = 'timechart'
+# 元ファイル（SBI証券から取得した時系列csv）で使う列（日付・始値・高値・安値・終値・VWAP・出来高）
+SBI_COLUMNS = [0, 1, 2, 3, 4, 8, 9]
+
+# 列名 → 型（日付は日単位の datetime64。行の並びは日付の古い順）
+DATE = 'Date'
+COLUMNS = {
+    DATE: np.dtype('datetime64[D]'),
+    'Open': np.dtype(np.float64),
+    'High': np.dtype(np.float64),
+    'Low': np.dtype(np.float64),
+    'Close': np.dtype(np.float64),
+    'VWAP': np.dtype(np.float64),
+    'Volume': np.dtype(np.int64),
+    'TradingPrice': np.dtype(np.float64),
+    **{f'VWAP_{window}': np.dtype(np.float64) for window in VWAP_WINDOWS},
+}
+
+
+def read_sbi_csv(file_name) -> pd.DataFrame:
+    """
+    SBI証券から取得した時系列csv（Shift-JIS、新しい日付が先頭）を mplf用の列名・日付の古い順にして読み込む
+    :param file_name: ファイル名（ファイルオブジェクトも可）
+    """
+    df = pd.read_csv(file_name, index_col=0, encoding="SHIFT-JIS", usecols=SBI_COLUMNS)
+    df = df.sort_index(ascending=True)
+    # mplf用の必須column調整
+    df["Date"] = pd.to_datetime(df.index.values, format='%Y%m%d')
+    df = df.set_index("Date")
+    return df.rename(columns={'始値': 'Open', '高値': 'High', '安値': 'Low', '終値': 'Close', '出来高': 'Volume'})
+
+
+class TimechartStore:
+    """
+    銘柄ごとの日足を列ごとの生のバイナリファイル（{銘柄}/{列名}.{版}）で保持する
+    読み込みは np.memmap で開くだけで、文字列の変換・型の推定をしない
+    版と行数は meta.json に持ち、書き直し・追記では列ファイルを書き終えてから meta.json を置き換える
+    （読み込みは meta.json の版・行数だけを使うので、書き込み途中で終了しても前回までの内容が読める）
+    """
+
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+
+    def get_dir(self, stock_code: str) -> str:
+        return os.path.join(self.root, stock_code)
+
+    def get_meta_file_name(self, stock_code: str) -> str:
+        return os.path.join(self.get_dir(stock_code), 'meta.json')
+
+    def get_file_name(self, stock_code: str, col: str, version: int = None) -> str:
+        # 版のない meta.json（版を持つ前に書いたもの）の列ファイルは {列名}
+        return os.path.join(self.get_dir(stock_code), col if version is None else f'{col}.{version}')
+
+    def exists(self, stock_code: str) -> bool:
+        return os.path.isfile(self.get_meta_file_name(stock_code))
+
+    def get_stock_codes(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(stock_code for stock_code in os.listdir(self.root) if self.exists(stock_code))
+
+    def get_mtime(self, stock_code: str) -> int:
+        # meta.json は最後に置き換えるので、その更新時刻をデータの更新時刻とする
+        return os.stat(self.get_meta_file_name(stock_code)).st_mtime_ns
+
+    def read_meta(self, stock_code: str) -> dict:
+        """
+        :return: {'version': 版, 'size': 行数, 'columns': 列名 → 型}（版を持つ前に書いたものは版・行数なし）
+        """
+        with open(file=self.get_meta_file_name(stock_code), mode='r') as f:
+            return json.load(f)
+
+    def write_meta(self, stock_code: str, version: int, size: int):
+        # 一時ファイルに書いてから置き換える（書き直し・追記の確定）
+        file_name = self.get_meta_file_name(stock_code)
+        with open(file=file_name + '.tmp', mode='w') as f:
+            json.dump({'version': version, 'size': size,
+                       'columns': {col: dtype.str for col, dtype in COLUMNS.items()}}, f)
+        os.replace(file_name + '.tmp', file_name)
+
+    def size(self, stock_code: str, meta: dict = None) -> int:
+        """
+        読み込める行数（meta.json で確定した行数）
+        """
+        meta = meta or self.read_meta(stock_code)
+        if 'size' in meta:
+            return meta['size']
+        # 版を持つ前に書いたものは全列がそろっている行まで
+        sizes = []
+        for col, dtype in COLUMNS.items():
+            file_name = self.get_file_name(stock_code, col)
+            sizes.append(os.path.getsize(file_name) // dtype.itemsize if os.path.exists(file_name) else 0)
+        return min(sizes)
+
+    def write(self, stock_code: str, df: pd.DataFrame):
+        """
+        銘柄の全行を書き直す（新しい版の列ファイルを書いてから meta.json を置き換え、古い版を消す）
+        """
+        os.makedirs(self.get_dir(stock_code), exist_ok=True)
+        old_version = self.read_meta(stock_code).get('version') if self.exists(stock_code) else None
+        version = (old_version or 0) + 1
+        for col in COLUMNS:
+            with open(file=self.get_file_name(stock_code, col, version), mode='wb') as f:
+                f.write(self.to_array(df, col).tobytes())
+        self.write_meta(stock_code, version=version, size=len(df))
+        for col in COLUMNS:
+            file_name = self.get_file_name(stock_code, col, old_version)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def append(self, stock_code: str, df: pd.DataFrame):
+        """
+        銘柄の末尾に行を追記する（既存の最終日より新しい日付の行のみ。列ファイルに追記してから meta.json の行数を増やす）
+        """
+        meta = self.read_meta(stock_code)
+        version = meta.get('version')
+        size = self.size(stock_code, meta=meta)
+        # 書き込み途中で終了していた行は切り捨ててから追記する
+        for col in COLUMNS:
+            with open(file=self.get_file_name(stock_code, col, version), mode='r+b') as f:
+                f.truncate(size * COLUMNS[col].itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(self.to_array(df, col).tobytes())
+        self.write_meta(stock_code, version=version, size=size + len(df))
+
+    @staticmethod
+    def to_array(df: pd.DataFrame, col: str) -> np.ndarray:
+        values = df.index.to_numpy() if col == DATE else df[col].to_numpy()
+        return np.ascontiguousarray(values.astype(COLUMNS[col]))
+
+    def read_columns(self, stock_code: str, columns=None) -> dict:
+        """
+        列ごとの配列（np.memmap。meta.json で確定した版・行数まで）
+        """
+        meta = self.read_meta(stock_code)
+        while True:
+            size = self.size(stock_code, meta=meta)
+            try:
+                arrays = {}
+                for col in [DATE] + [col for col in (columns or COLUMNS) if col != DATE]:
+                    if size == 0:
+                        arrays[col] = np.empty(0, dtype=COLUMNS[col])
+                    else:
+                        arrays[col] = np.memmap(self.get_file_name(stock_code, col, meta.get('version')),
+                                                dtype=COLUMNS[col], mode='r', shape=(size,))
+                return arrays
+            except FileNotFoundError:
+                # 読み込み中に書き直されて古い版が消された場合は新しい版を読む
+                latest = self.read_meta(stock_code)
+                if latest.get('version') == meta.get('version'):
+                    raise
+                meta = latest
+
+    def load(self, stock_code: str, start=None, end=None, columns=None) -> pd.DataFrame:
+        """
+        銘柄の日足を読み込む（指定した期間・列だけ）
+        :param start: この日付以降（'2021-09-01' など。未指定なら先頭から）
+        :param end: この日付以前（未指定なら最後まで）
+        :param columns: 読み込む列（未指定なら全列）
+        """
+        arrays = self.read_columns(stock_code, columns=columns)
+        dates = arrays.pop(DATE)
+        # 日付の古い順に並んでいるので、期間の範囲は二分探索で求める
+        first = np.searchsorted(dates, np.datetime64(start, 'D'), side='left') if start is not None else 0
+        last = np.searchsorted(dates, np.datetime64(end, 'D'), side='right') if end is not None else len(dates)
+        index = pd.DatetimeIndex(dates[first:last], name=DATE)
+        return pd.DataFrame({col: array[first:last] for col, array in arrays.items()}, index=index, copy=False)
+
+    def tail(self, stock_code: str, size: int, columns=None) -> pd.DataFrame:
+        """
+        末尾 size 行
+        """
+        arrays = self.read_columns(stock_code, columns=columns)
+        dates = arrays.pop(DATE)
+        index = pd.DatetimeIndex(dates[-size:], name=DATE)
+        return pd.DataFrame({col: array[-size:] for col, array in arrays.items()}, index=index, copy=False)
+
+
+def convert(src_dir: str = 'sbi_timechart_csv', root: str = STORE_DIR) -> int:
+    """
+    SBI証券から取得した時系列csv（NNNN.csv）を全て読み込み、移動VWAPを計算して列ファイルに書き出す（初回の変換用）
+    :return: 変換した銘柄数
+    """
+    store = TimechartStore(root=root)
+    count = 0
+    for file_name in sorted(os.listdir(src_dir)):
+        match = re.search(r'(\d\d\d\d),*\.csv', file_name)
+        if not match:
+            continue
+        df = add_vwap_columns(read_sbi_csv(os.path.join(src_dir, file_name)))
+        store.write(match.group(1), df)
+        count += 1
+    logger.info(f'変換しました: {src_dir} -> {root}  {count}銘柄')
+    return count
+
+
+if __name__ == '__main__':
+    convert()
@@ -1,71 +1,127 @@
+import hashlib
+import io
+import json
 import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
 import pandas as pd
 import mplfinance as mpf
 
 from cmn.log import get_logger
+from stock.indicator import VWAP_WINDOWS, RollingVWAP, add_vwap_columns
+from stock.store import STORE_DIR, TimechartStore, read_sbi_csv
 
 logger = get_logger(modname=__name__, is_debug=True)
 
+# SBI証券から取得した時系列csvの置き場
+SBI_DIR = 'sbi_timechart_csv'
+PLOT_DIR = 'plot'
+# 元ファイルごとの 更新時刻・サイズ・内容のハッシュ（前回処理した時点）
+MANIFEST = os.path.join(STORE_DIR, 'manifest.json')
 
-def plot(stock_code: str):
+# 調整済みのデータ（銘柄ごとの列ファイル）
+store = TimechartStore()
 
-    # SBI証券から取得した時系列csv
-    sbi_timechart_csv = os.path.join('sbi_timechart_csv', stock_code + '.csv')
-    # 過去に出力したcsv（調整済み）
-    mplf_csv = os.path.join('mplf_csv', stock_code + '.csv' + '.mplf')
 
-    # 過去に調整済みのcsvがあればそこから読み込み
-    if os.path.isfile(mplf_csv):
-        df = pd.read_csv(mplf_csv, index_col=0, parse_dates=[0], encoding="SHIFT-JIS")
-        df = df.sort_index(ascending=True)
+def get_file_names(stock_code: str):
+    """
+    :return: 元ファイル、出力する画像のリスト
+    """
+    sbi_timechart_csv = os.path.join(SBI_DIR, stock_code + '.csv')
+    pngs = [os.path.join(PLOT_DIR, f'{stock_code}_vwap.png'), os.path.join(PLOT_DIR, f'{stock_code}_mav.png')]
+    return sbi_timechart_csv, pngs
+
+
+def load(stock_code: str, refresh: bool = False, ingest: bool = False) -> Optional[pd.DataFrame]:
+    """
+    調整済みのデータを読み込む（なければ元ファイルから作成）
+    :param refresh: 調整済みのデータがあっても元ファイルから作り直す
+    :param ingest: 調整済みのデータより新しい日付が元ファイルにあれば、その分だけ計算して追記してから読み込む
+    """
+    sbi_timechart_csv, _ = get_file_names(stock_code)
+    if ingest and not refresh and store.exists(stock_code) and os.path.isfile(sbi_timechart_csv):
+        refresh = ingest_new_rows(stock_code) is None
+
+    # 過去に調整済みのデータがあればそこから読み込み
+    if store.exists(stock_code) and not refresh:
+        df = store.load(stock_code)
     # なければ元ファイルを読み込んで調整
     elif os.path.isfile(sbi_timechart_csv):
-        df = pd.read_csv(sbi_timechart_csv, index_col=0, encoding="SHIFT-JIS", usecols=[0, 1, 2, 3, 4, 8, 9])
-        df = df.sort_index(ascending=True)
-        # mplf用の必須column調整
-        df["Date"] = pd.to_datetime(df.index.values, format='%Y%m%d')
-        df = df.set_index("Date")
-        df = df.rename(columns={'始値': 'Open', '高値': 'High', '安値': 'Low', '終値': 'Close', '出来高': 'Volume'})
-        # 独自の値を計算して列追加
-        tradingprice_list = []
-        vwap_5_list = []
-        vwap_25_list = []
-        vwap_75_list = []
-        for i, (vwap, volume) in enumerate(zip(df['VWAP'], df['Volume'])):
-            tradingprice_list.append(vwap * volume)
-            vwap_5 = sum(tradingprice_list[max(i - 4, 0):i + 1]) / sum(df['Volume'][max(i - 4, 0):i + 1])
-            vwap_25 = sum(tradingprice_list[max(i - 24, 0):i + 1]) / sum(df['Volume'][max(i - 24, 0):i + 1])
-            vwap_75 = sum(tradingprice_list[max(i - 74, 0):i + 1]) / sum(df['Volume'][max(i - 74, 0):i + 1])
-            if i + 1 < 5:
-                vwap_5_list.append(None)
-                vwap_25_list.append(None)
-                vwap_75_list.append(None)
-            elif i + 1 < 25:
-                vwap_5_list.append(vwap_5)
-                vwap_25_list.append(None)
-                vwap_75_list.append(None)
-            elif i + 1 < 75:
-                vwap_5_list.append(vwap_5)
-                vwap_25_list.append(vwap_25)
-                vwap_75_list.append(None)
-            elif i + 1 >= 75:
-                vwap_5_list.append(vwap_5)
-                vwap_25_list.append(vwap_25)
-                vwap_75_list.append(vwap_75)
-        df['TradingPrice'] = tradingprice_list
-        df['VWAP_5'] = vwap_5_list
-        df['VWAP_25'] = vwap_25_list
-        df['VWAP_75'] = vwap_75_list
-        df.to_csv(mplf_csv)
+        # 独自の値を計算して列追加（移動VWAPは累積和からまとめて計算）
+        df = add_vwap_columns(read_sbi_csv(sbi_timechart_csv))
+        store.write(stock_code, df)
     # ファイルが存在しない場合
     else:
         logger.error(f"元にするファイルが見つかりません：{sbi_timechart_csv}")
-        return
+        return None
+    return df
 
-    logger.info(df.head())
 
+def read_new_lines(file_name: str, last_date: int):
+    """
+    元ファイルの先頭から last_date より新しい日付の行を読む（SBI証券の時系列csvは新しい日付が先頭）
+    :return: ヘッダ行、新しい行（新しい順）、last_date 以前で最も新しい行（なければ None）
+    """
+    lines = []
+    with open(file=file_name, mode='rb') as f:
+        header = f.readline()
+        for line in f:
+            if not line.strip():
+                continue
+            if int(line.split(b',', 1)[0]) <= last_date:
+                return header, lines, line
+            lines.append(line)
+    return header, lines, None
+
+
+def ingest_new_rows(stock_code: str) -> Optional[int]:
+    """
+    調整済みのデータの最終日より新しい行だけを、末尾の移動VWAPの期間分の行から続けて計算して追記する
+    処理は新しい行数分（履歴の長さによらない）
+    :return: 追記した行数（調整済みの最終日の行が元ファイルにない・値が違う場合は None）
+    """
+    sbi_timechart_csv, _ = get_file_names(stock_code)
+    tail = store.tail(stock_code, size=max(VWAP_WINDOWS), columns=['VWAP', 'Volume'])
+    if tail.empty:
+        return None
+    last_date = int(tail.index[-1].strftime('%Y%m%d'))
+    header, lines, last_line = read_new_lines(sbi_timechart_csv, last_date=last_date)
+    # 調整済みの最終日が元ファイルにない・値が違う場合は、過去分が修正されているので作り直す（それより前の行は確認しない）
+    if last_line is None:
+        return None
+    last = read_sbi_csv(io.BytesIO(header + last_line))
+    if last.index[-1] != tail.index[-1] or last['VWAP'].iloc[-1] != tail['VWAP'].iloc[-1] \
+            or last['Volume'].iloc[-1] != tail['Volume'].iloc[-1]:
+        logger.warning(f'元ファイルの過去分が変わっています。作り直します：{sbi_timechart_csv}')
+        return None
+    if not lines:
+        return 0
+
+    df = read_sbi_csv(io.BytesIO(header + b''.join(lines)))
+    df['TradingPrice'] = df['VWAP'] * df['Volume']
+    rolling = RollingVWAP.from_history(tail['VWAP'].to_numpy(), tail['Volume'].to_numpy())
+    values = [rolling.append(vwap, volume) for vwap, volume in zip(df['VWAP'].to_numpy(), df['Volume'].to_numpy())]
+    for window in VWAP_WINDOWS:
+        df[f'VWAP_{window}'] = [value[window] for value in values]
+    store.append(stock_code, df)
+    logger.debug(f'{len(df)}行追記しました：{stock_code}')
+    return len(df)
+
+
+def is_rendered(stock_code: str) -> bool:
+    # 画像が全て調整済みのデータより新しければ描画済み
+    _, pngs = get_file_names(stock_code)
+    if not store.exists(stock_code):
+        return False
+    mtime = store.get_mtime(stock_code)
+    return all(os.path.isfile(png) and os.stat(png).st_mtime_ns >= mtime for png in pngs)
+
+
+def render(df: pd.DataFrame, stock_code: str):
+    sbi_timechart_csv, (vwap_png, mav_png) = get_file_names(stock_code)
     addplot = mpf.make_addplot(data=df[['VWAP_25', 'VWAP_75']])
     mpf.plot(
         data=df,
@@ -75,7 +131,7 @@ def plot(stock_code: str):
         volume=True,
         title=sbi_timechart_csv,
         style='nightclouds',
-        savefig=os.path.join('plot', f'{stock_code}_vwap.png')
+        savefig=vwap_png
     )
     mpf.plot(
         data=df,
@@ -85,19 +141,122 @@ def plot(stock_code: str):
         volume=True,
         title=sbi_timechart_csv,
         style='nightclouds',
-        savefig=os.path.join('plot', f'{stock_code}_mav.png')
+        savefig=mav_png
     )
 
 
-def main():
+def plot(stock_code: str, refresh: bool = False, ingest: bool = False, skip_rendered: bool = False):
+    """
+    :param refresh: 調整済みのデータがあっても元ファイルから作り直す
+    :param ingest: 元ファイルの新しい日付の行だけ調整済みのデータに追記する
+    :param skip_rendered: 画像が調整済みのデータより新しければ描画しない
+    """
+    df = load(stock_code=stock_code, refresh=refresh, ingest=ingest)
+    if df is None:
+        return
+
+    logger.info(df.head())
+
+    if skip_rendered and is_rendered(stock_code):
+        return
+    render(df=df, stock_code=stock_code)
+
+
+class Manifest:
+    """
+    元ファイルごとの前回処理した時点の 更新時刻・サイズ・内容のハッシュ
+    更新時刻とサイズが同じなら読み込まずに未変更とし、違う場合だけハッシュを比べる
+    """
+
+    def __init__(self, file_name: str = MANIFEST):
+        self.file_name = file_name
+        self.entries = {}
+        self.pendings = {}  # 変わっていた元ファイルの新しい 更新時刻・サイズ・ハッシュ（処理が済んだら記録）
+        if os.path.isfile(file_name):
+            with open(file=file_name, mode='r') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def get_hash(file_name: str) -> str:
+        with open(file=file_name, mode='rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def is_changed(self, stock_code: str, file_name: str) -> bool:
+        """
+        前回処理した時点から元ファイルが変わったか（内容が同じなら更新時刻だけ記録し直す）
+        """
+        stat = os.stat(file_name)
+        entry = self.entries.get(stock_code)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return False
+        file_hash = self.get_hash(file_name)
+        if entry and entry['hash'] == file_hash:
+            entry['mtime_ns'], entry['size'] = stat.st_mtime_ns, stat.st_size
+            return False
+        self.pendings[stock_code] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'hash': file_hash}
+        return True
+
+    def update(self, stock_code: str):
+        # 処理が済んだ元ファイルを記録（エラーの銘柄は記録しないので次回も作り直す）
+        if stock_code in self.pendings:
+            self.entries[stock_code] = self.pendings.pop(stock_code)
+
+    def save(self):
+        # 途中で落ちても前回の内容が残るように、一時ファイルに書いてから置き換える
+        tmp_file_name = self.file_name + '.tmp'
+        with open(file=tmp_file_name, mode='w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_file_name, self.file_name)
+
+
+def _plot_stock(args):
+    # プロセスプールのワーカー（pickle できるようにモジュール直下に置く）
+    stock_code, is_changed = args
+    try:
+        plot(stock_code=stock_code, ingest=is_changed, skip_rendered=True)
+        return stock_code, None
+    except Exception as e:
+        return stock_code, repr(e)
+
+
+def get_stock_codes() -> list:
     stock_code_list = []
-    for file_name in os.listdir('sbi_timechart_csv'):
+    for file_name in os.listdir(SBI_DIR):
         match = re.search(r'(\d\d\d\d),*\.csv', file_name)
         if match:
             stock_code_list.append(match.group(1))
+    return sorted(stock_code_list)
+
+
+def main(processes: Optional[int] = None):
+    """
+    元ファイルが変わった銘柄だけ新しい日付の行を追記し、画像が古い・ない銘柄だけ描画する（銘柄ごとにプロセスプールで並列実行）
+    :param processes: プロセス数（未指定ならCPU数）
+    """
+    started_at = time.perf_counter()
+    os.makedirs(STORE_DIR, exist_ok=True)
+    os.makedirs(PLOT_DIR, exist_ok=True)
+    manifest = Manifest()
+
+    tasks = []
+    for stock_code in get_stock_codes():
+        sbi_timechart_csv, _ = get_file_names(stock_code)
+        is_changed = manifest.is_changed(stock_code, sbi_timechart_csv)
+        if is_changed or not is_rendered(stock_code):
+            tasks.append((stock_code, is_changed))
 
-    for stock_code in stock_code_list:
-        plot(stock_code)
+    error_count = 0
+    if tasks:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for stock_code, error in executor.map(_plot_stock, tasks, chunksize=max(len(tasks) // 64, 1)):
+                if error:
+                    error_count += 1
+                    logger.error(f'作成エラー: {stock_code} {error}')
+                else:
+                    manifest.update(stock_code)
+    manifest.save()
+    logger.info(f'作成 {len(tasks) - error_count}銘柄  エラー {error_count}銘柄  '
+                f'{time.perf_counter() - started_at:.2f}秒')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,36 @@
+from bitbank.const import ORDER, PAIR
+from bitbank.fixed import Volume
+from bitbank.paper import PaperOrder
+from bitbank.tape import TapeWatch, TradeTape
+
+
+def transactions(*amounts, price=5000000):
+    return [{'transaction_id': i, 'executed_at': 1000 + i, 'price': price, 'amount': amount}
+            for i, amount in enumerate(amounts, start=1)]
+
+
+def test_tape_watch_fills_split_volume():
+    # 小数で足すと 0.7 + 0.1 = 0.7999999999999999 < 0.8 で成立しない
+    for amounts in ((0.7, 0.1), ('0.7', '0.1')):
+        tape = TradeTape(pair=PAIR.BTC_JPY)
+        watch = tape.watch(TapeWatch.for_order(order=ORDER.BUY, price=5000000, volume=Volume('0.8')))
+        tape.add(transactions(*amounts))
+        assert watch.is_done
+        assert watch.filled_volume == Volume('0.8')
+
+
+def test_tape_watch_not_filled_below_volume():
+    tape = TradeTape(pair=PAIR.BTC_JPY)
+    watch = tape.watch(TapeWatch.for_order(order=ORDER.BUY, price=5000000, volume=Volume('0.8')))
+    tape.add(transactions(0.7, 0.09999999))
+    assert not watch.is_done
+
+
+def test_paper_order_fills_split_volume():
+    paper_order = PaperOrder(order=ORDER.BUY, price=5000000, volume=Volume('0.8'), queue_ahead=0.3)
+    tape = TradeTape(pair=PAIR.BTC_JPY)
+    tape.watch(paper_order)
+    # 先に並んでいる 0.3 を消化してから 0.7 + 0.1 で全量約定
+    tape.add(transactions(1.0, 0.1))
+    assert paper_order.is_done
+    assert paper_order.filled_volume == Volume('0.8')
@@ -0,0 +1,21 @@
+from bitbank.orderbook import OrderBook, SIDE
+
+
+def test_apply_diff_keeps_levels_beyond_limit():
+    # 上位2件だけ累積和を求める板で、上位の価格が消えたら3件目以降が繰り上がる
+    book = OrderBook(asks=[['101', '1'], ['102', '1'], ['103', '1'], ['104', '3']],
+                     bids=[['100', '1']], levels=2)
+    book = book.apply_diff({'a': [['101', '0'], ['102', '0']], 's': '2'})
+    assert book.best_ask == 103
+    assert book.mean(SIDE.ASK, size=2) == round((103 * 1 + 104 * 3) / 4)
+    assert book.volume_at(SIDE.ASK, 104) == 3
+
+
+def test_mean_of_empty_side():
+    book = OrderBook(asks=[['101', '1']], bids=[])
+    assert book.mean(SIDE.BID) is None
+    assert book.spread() is None
+    assert book.spread_rate() is None
+    book = book.apply_diff({'a': [['101', '0']], 'b': [['100', '2']]})
+    assert book.mean(SIDE.ASK) is None
+    assert book.mean(SIDE.BID) == 100
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from bitbank.const import ORDER, PAIR, TRADERULE
+from bitbank.fixed import Volume
+from bitbank.market import MESSAGE, MarketData, ReplayTransport
+from bitbank.paper import PaperExchange
+from bitbank.trade import Trade
+
+
+def depth(time):
+    return {'pair': PAIR.BTC_JPY.value, 'type': MESSAGE.DEPTH, 'time': time,
+            'data': {'asks': [['5000100', '1.0']], 'bids': [['5000000', '0.3']], 'sequenceId': str(time)}}
+
+
+def transactions(time, price, amount):
+    return {'pair': PAIR.BTC_JPY.value, 'type': MESSAGE.TRANSACTIONS, 'time': time,
+            'data': {'transactions': [{'transaction_id': time, 'executed_at': time, 'side': 'sell',
+                                       'price': str(price), 'amount': amount}]}}
+
+
+def limit_order(tmp_path, messages, wait):
+    # 同期版の limit_order を、別スレッドで再生する MarketData に対して動かす
+    market = MarketData(pair=PAIR.BTC_JPY, transport=ReplayTransport(messages=messages[1:]))
+    exchange = PaperExchange(market=market)
+    market.feed(messages[0])
+    trade = Trade(pair=PAIR.BTC_JPY, rule=TRADERULE.WITHIN_DIFFRATE, market=market, exchange=exchange,
+                  file_name=str(tmp_path / 'record.csv'))
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(executed_at=trade.limit_order(
+        order=ORDER.BUY, price=5000000, volume=Volume('0.5'), wait=wait)), daemon=True)
+    thread.start()
+    # 注文してから再生を始める
+    while not market.tape.watches and thread.is_alive():
+        time.sleep(0.01)
+    market.start()
+    thread.join(timeout=10)
+    market.stop()
+    assert not thread.is_alive()
+    return result['executed_at'], exchange.clock
+
+
+def test_limit_order_filled_over_replay(tmp_path):
+    # 前に並んでいる 0.3 を消化した後の 0.5 で成立し、成立時刻は約定メッセージの時刻
+    messages = [depth(1000), transactions(2000, 5000000, '0.3'), transactions(3000, 5000000, '0.4'),
+                transactions(4000, 5000000, '0.1')]
+    executed_at, clock = limit_order(tmp_path, messages, wait=60)
+    assert executed_at == 4000
+    assert clock.time() == 4
+
+
+def test_limit_order_expires_in_replay_time(tmp_path):
+    # 成立しないまま、メッセージの時刻で期限（wait 秒）を過ぎたら取り消す
+    messages = [depth(1000), transactions(2000, 5000100, '1.0'), transactions(5000, 5000100, '1.0')]
+    executed_at, clock = limit_order(tmp_path, messages, wait=3)
+    assert executed_at is None
+    assert clock.time() == 5
+
+
+def test_limit_order_stops_when_replay_ends(tmp_path):
+    # 再生が終わって時計が進まなくなっても待ち続けない
+    messages = [depth(1000), transactions(2000, 5000100, '1.0')]
+    executed_at, clock = limit_order(tmp_path, messages, wait=2)
+    assert executed_at is None
+    assert clock.time() == 2